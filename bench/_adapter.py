@@ -0,0 +1,113 @@
+'''基准测试使用的最小适配器
+
+只实现 NoneBot 处理事件所需的部分，`send` 与 API 调用均不进行 I/O，
+用于将消息直接交给 `handle_event`，经过插件真实的事件响应器。
+'''
+
+from typing import Any
+from typing_extensions import override
+
+from nonebot.adapters import Bot as BaseBot
+from nonebot.adapters import Event as BaseEvent
+from nonebot.adapters import Adapter as BaseAdapter
+from nonebot.adapters import Message as BaseMessage
+from nonebot.adapters import MessageSegment as BaseMessageSegment
+
+class MessageSegment(BaseMessageSegment["Message"]):
+    @classmethod
+    @override
+    def get_message_class(cls) -> type:
+        return Message
+
+    @override
+    def __str__(self) -> str:
+        return self.data.get("text", "")
+
+    @override
+    def is_text(self) -> bool:
+        return self.type == "text"
+
+    @staticmethod
+    def text(text: str) -> "MessageSegment":
+        return MessageSegment("text", {"text": text})
+
+class Message(BaseMessage[MessageSegment]):
+    @classmethod
+    @override
+    def get_segment_class(cls) -> type:
+        return MessageSegment
+
+    @staticmethod
+    @override
+    def _construct(msg: str) -> Any:
+        yield MessageSegment.text(msg)
+
+class Event(BaseEvent):
+    message: Message
+    user_id: str = "10001"
+    group_id: str = "1"
+
+    @override
+    def get_type(self) -> str:
+        return "message"
+
+    @override
+    def get_event_name(self) -> str:
+        return "message.group"
+
+    @override
+    def get_event_description(self) -> str:
+        return str(self.message)
+
+    @override
+    def get_user_id(self) -> str:
+        return self.user_id
+
+    @override
+    def get_session_id(self) -> str:
+        return f"group_{self.group_id}_{self.user_id}"
+
+    @override
+    def get_message(self) -> Message:
+        return self.message
+
+    @override
+    def is_tome(self) -> bool:
+        return False
+
+class Adapter(BaseAdapter):
+    @classmethod
+    @override
+    def get_name(cls) -> str:
+        # 与 nonebug 的适配器同名，使用 uniseg 为其提供的纯文本消息转换器
+        return "fake"
+
+    @override
+    async def _call_api(self, bot: BaseBot, api: str, **data: Any) -> Any:
+        return None
+
+class Bot(BaseBot):
+    '''记录发送次数的机器人，`send` 不进行任何 I/O'''
+
+    def __init__(self, adapter: Adapter, self_id: str) -> None:
+        super().__init__(adapter, self_id)
+        self.sent = 0
+
+    @override
+    async def send(self, event: BaseEvent, message: Any, **kwargs: Any) -> Any:
+        self.sent += 1
+
+_counter = 0
+
+def make_event(text: str, user_id: str = "10001", group_id: str = "1") -> Event:
+    '''构造一条群消息事件，每条事件使用不同的消息 ID'''
+    global _counter
+    _counter += 1
+    event = Event(message=Message(text), user_id=user_id, group_id=group_id)
+    # uniseg 为该适配器使用会话 ID 作为消息 ID，同一用户的不同消息需要区分
+    object.__setattr__(event, "__uniseg_message_id__", str(_counter))
+    return event
+
+def make_bot(self_id: str = "1") -> Bot:
+    import nonebot
+    return Bot(Adapter(nonebot.get_driver()), self_id)
@@ -0,0 +1,139 @@
+'''基准测试使用的本地后端桩
+
+在后台线程中运行一个 HTTP 服务器，按接口路径返回与 Tsugu 后端形状相同的响应，
+延迟、图片大小与错误率均可在运行中修改。
+'''
+
+import os
+import json
+import time
+import base64
+import random
+import threading
+from collections import Counter
+from typing import Any, Dict, Optional
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+def user_data(user_id: str, platform: str) -> Dict[str, Any]:
+    '''一个绑定了日服玩家的用户'''
+    return {
+        "userId": user_id,
+        "platform": platform,
+        "mainServer": 0,
+        "displayedServerList": [0, 3],
+        "shareRoomNumber": True,
+        "userPlayerIndex": 0,
+        "userPlayerList": [{"playerId": 10000000 + int(user_id) % 1000, "server": 0}],
+    }
+
+class StubBackend:
+    '''本地后端桩
+
+    `latency` 为每个请求的处理时间（秒），`payload_size` 为渲染接口返回的图片字节数，
+    为 0 时返回文字，`error_rate` 为返回 503 的概率。
+    '''
+    def __init__(
+        self,
+        latency: float = 0,
+        payload_size: int = 0,
+        error_rate: float = 0,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.latency = latency
+        self.payload_size = payload_size
+        self.error_rate = error_rate
+        self.hits: 'Counter[str]' = Counter()
+        '''各接口的请求次数'''
+        self.connections = 0
+        '''建立过的连接数'''
+        self._random = random.Random(seed)
+        self._payloads: Dict[int, bytes] = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self) -> 'StubBackend':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'StubBackend':
+        return self.start()
+
+    def __exit__(self, *args: Any) -> None:
+        self.stop()
+
+    def _render(self) -> bytes:
+        size = self.payload_size
+        if size <= 0:
+            return json.dumps([{"type": "string", "string": "ok"}]).encode()
+        with self._lock:
+            if (payload := self._payloads.get(size)) is None:
+                string = base64.b64encode(os.urandom(size)).decode()
+                payload = self._payloads[size] = json.dumps([{"type": "base64", "string": string}]).encode()
+        return payload
+
+    def respond(self, path: str, data: Dict[str, Any]) -> bytes:
+        '''按接口路径构造响应体'''
+        if path.endswith("/user/getUserData"):
+            body: Any = {"status": "success", "data": user_data(str(data.get("userId", "0")), str(data.get("platform", "")))}
+        elif path.endswith("/station/queryAllRoom"):
+            body = {"status": "success", "data": []}
+        elif path.startswith("/user/") or path.startswith("/station/"):
+            body = {"status": "success", "data": "ok"}
+        elif path.endswith("/fuzzySearch"):
+            body = {"status": "success", "data": {}}
+        else:
+            return self._render()
+        return json.dumps(body).encode()
+
+    def _handler(self) -> type:
+        stub = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # 响应头与响应体一并发送，避免 Nagle 算法与延迟确认带来的 40ms 等待
+            wbufsize = -1
+
+            def setup(self) -> None:
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+            def _reply(self) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                with stub._lock:
+                    stub.hits[self.path] += 1
+                if stub.latency > 0:
+                    time.sleep(stub.latency)
+                if stub.error_rate > 0 and stub._random.random() < stub.error_rate:
+                    status, body = 503, b"Service Unavailable"
+                else:
+                    try:
+                        data = json.loads(raw) if raw else {}
+                    except ValueError:
+                        data = {}
+                    status, body = 200, stub.respond(self.path, data)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = _reply
+            do_POST = _reply
+
+        return _Handler
@@ -0,0 +1,70 @@
+'''指令前缀过滤基准
+
+将模拟的群聊消息经由最小适配器交给 NoneBot 的 `handle_event`，
+比较开启与关闭指令前缀过滤时，插件全部事件响应器每秒可处理的消息数。
+群聊中绝大多数消息不是指令，这些消息在过滤开启时不再经过每个指令的解析。
+
+    python bench/command_gate.py [--messages 500] [--rounds 2]
+'''
+
+import sys
+import json
+import random
+import asyncio
+import argparse
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+CHATTER = [
+    "今天也要好好打歌", "有人一起协力吗", "哈哈哈哈哈", "这期活动好肝啊", "ff", "我抽到了！",
+    "晚安", "谁有ex的攻略", "好耶", "明天更新吗", "这个谱面好难", "[图片]", "草", "？？？",
+]
+
+async def main(args: argparse.Namespace) -> None:
+    import nonebot
+
+    nonebot.init(driver="~none", command_start={"/", ""}, log_level="WARNING")
+    nonebot.load_plugin("nonebot_plugin_tsugu_bangdream_bot")
+    from nonebot.message import handle_event
+
+    import nonebot_plugin_tsugu_bangdream_bot as plugin
+    from nonebot_plugin_tsugu_bangdream_bot._gate import command_gate
+    from _adapter import make_bot, make_event
+
+    await plugin._build_command_gate() # type: ignore
+    bot = make_bot()
+    rng = random.Random(1)
+    texts = [rng.choice(CHATTER) + str(index % 7) for index in range(args.messages)]
+
+    async def _run(enabled: bool) -> float:
+        command_gate.enabled = enabled
+        events = [make_event(text) for text in texts]
+        for event in events[:50]:
+            await handle_event(bot, event)
+        start = perf_counter()
+        for event in events:
+            await handle_event(bot, event)
+        return len(events) / (perf_counter() - start)
+
+    results: Dict[str, List[float]] = {"gate_on": [], "gate_off": []}
+    for _ in range(args.rounds):
+        results["gate_on"].append(await _run(True))
+        results["gate_off"].append(await _run(False))
+
+    report: Dict[str, Any] = {
+        "messages": args.messages,
+        "gate": command_gate.stats(),
+    }
+    for name, rates in results.items():
+        report[name] = {"messages_per_second": round(max(rates))}
+    report["speedup"] = round(max(results["gate_on"]) / max(results["gate_off"]), 2)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=2)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,89 @@
+'''渲染结果解码的峰值内存基准
+
+模拟多个渲染请求同时返回：每个请求解析响应 JSON，解码其中的 base64 图片并构造消息，
+在“发送”期间持有消息，比较原实现与当前实现在并发下由 tracemalloc 统计的峰值内存。
+
+原实现在消息发送完成前同时持有全部 base64 字符串与全部解码结果；
+当前实现逐个解码并从响应中移除，base64 字符串在解码后即可释放。
+
+    python bench/decode_memory.py [--concurrency 8] [--images 4] [--image-size 1000000]
+'''
+
+import os
+import sys
+import json
+import base64
+import asyncio
+import argparse
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, List, Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+def _old_list_to_message(response: List[Dict[str, Any]]) -> Any:
+    from nonebot_plugin_alconna import Text, Image, UniMessage
+
+    segments = []
+    for _r in response:
+        if _r["type"] == "string":
+            segments.append(Text(_r["string"]))
+        else:
+            segments.append(Image(raw=base64.b64decode(_r["string"])))
+    return UniMessage(segments)
+
+async def _measure(build: Callable[[List[Dict[str, Any]]], Any], bodies: List[bytes], send_time: float) -> int:
+    async def _one(index: int) -> None:
+        await asyncio.sleep(0)
+        # 响应体在解析后即被释放，与 HTTP 客户端的行为一致
+        body, bodies[index] = bodies[index], b""
+        response = json.loads(body)
+        del body
+        message = build(response)
+        await asyncio.sleep(send_time)
+        del message, response
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    await asyncio.gather(*(_one(index) for index in range(len(bodies))))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - base
+
+async def main(args: argparse.Namespace) -> None:
+    import nonebot
+
+    nonebot.init(driver="~none", log_level="WARNING")
+    nonebot.load_plugin("nonebot_plugin_tsugu_bangdream_bot")
+    from nonebot_plugin_tsugu_bangdream_bot import _commands
+
+    def _new_list_to_message(response: List[Dict[str, Any]]) -> Any:
+        return _commands._parts_to_message(_commands._decode_response(response)) # type: ignore
+
+    image = base64.b64encode(os.urandom(args.image_size)).decode()
+    body = json.dumps(
+        [{"type": "string", "string": "title"}]
+        + [{"type": "base64", "string": image} for _ in range(args.images)]
+    ).encode()
+
+    report: Dict[str, Any] = {
+        "concurrency": args.concurrency,
+        "images_per_response": args.images,
+        "image_bytes": args.image_size,
+    }
+    for name, build in (("old", _old_list_to_message), ("current", _new_list_to_message)):
+        # 每个请求使用独立的响应体，避免共享同一个对象而低估内存
+        bodies = [bytes(body) for _ in range(args.concurrency)]
+        peak = await _measure(build, bodies, args.send_time)
+        report[name] = {"peak_mb": round(peak / 1e6, 1)}
+        del bodies
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--images", type=int, default=4)
+    parser.add_argument("--image-size", type=int, default=1_000_000, help="每张图片解码后的字节数")
+    parser.add_argument("--send-time", type=float, default=0.05, help="模拟发送消息的耗时（秒）")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,167 @@
+'''车牌关键词匹配基准
+
+在模拟的群聊车牌消息上比较三种实现的分类速度，并校验分类结果一致：
+
+- `loop`：原实现，逐个关键词 `in` 判断
+- `aho_corasick`：纯 Python 的 Aho-Corasick 自动机，扫描一次消息
+- `regex`：当前实现 `RoomKeywordMatcher`，关键词编译为一个多选正则，在 C 层扫描
+
+`--extra` 可追加随机关键词，模拟配置了大量自定义关键词的情况。
+
+    python bench/keyword_match.py [--messages 20000] [--extra 0]
+'''
+
+import json
+import random
+import argparse
+import importlib.util
+from pathlib import Path
+from collections import deque
+from time import perf_counter
+from typing import Dict, List, Tuple, Callable, Optional, Sequence
+
+_PACKAGE = Path(__file__).resolve().parents[1] / "nonebot_plugin_tsugu_bangdream_bot"
+
+def _load(name: str):
+    # 直接加载单个模块，不经过插件的 `__init__`，无需初始化 NoneBot
+    spec = importlib.util.spec_from_file_location(name, _PACKAGE / f"{name}.py")
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+Result = Tuple[bool, Optional[str]]
+
+def loop_classifier(car: Sequence[str], fake: Sequence[str]) -> Callable[[str], Result]:
+    def classify(text: str) -> Result:
+        hit = None
+        for keyword in car:
+            if keyword in text:
+                hit = keyword
+                break
+        if hit is None:
+            return False, None
+        for keyword in fake:
+            if keyword in text:
+                return False, keyword
+        return True, hit
+    return classify
+
+class _Automaton:
+    def __init__(self, keywords: Sequence[str]) -> None:
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[bool] = [False]
+        for keyword in keywords:
+            state = 0
+            for char in keyword:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(False)
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state] = True
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(char, 0)
+                self.output[child] = self.output[child] or self.output[self.fail[child]]
+
+    def search(self, text: str) -> bool:
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                return True
+        return False
+
+def aho_corasick_classifier(car: Sequence[str], fake: Sequence[str]) -> Callable[[str], Result]:
+    car_automaton, fake_automaton = _Automaton(car), _Automaton(fake)
+    # 自动机只判断是否命中，命中时再取出关键词用于日志，与其余实现的结果对齐
+    loop = loop_classifier(car, fake)
+    def classify(text: str) -> Result:
+        if not car_automaton.search(text):
+            return False, None
+        if fake_automaton.search(text):
+            return loop(text)
+        return True, loop(text)[1]
+    return classify
+
+def chat_messages(count: int, car: Sequence[str], fake: Sequence[str], seed: int = 1) -> List[str]:
+    '''以数字开头的群聊消息，约四分之一为车牌，其中一部分带有无效关键词'''
+    rng = random.Random(seed)
+    chatter = [
+        "哈哈哈哈哈", "这期活动好肝啊", "有人一起协力吗", "今天也要好好打歌", "我抽到了！",
+        "晚安", "谁有ex的攻略", "好耶", "明天更新吗", "这个卡面好好看", "来个人带带我",
+        "刚才掉线了", "分数线多少了", "", "？", "这首歌的谱面太难了吧",
+    ]
+    messages = []
+    for _ in range(count):
+        number = str(rng.randint(10000, 999999))
+        roll = rng.random()
+        if roll < 0.25:
+            keywords = rng.sample(list(car), rng.randint(1, 3))
+            text = " ".join([number, *keywords, rng.choice(chatter)])
+        elif roll < 0.3:
+            text = " ".join([number, rng.choice(car), rng.choice(fake), rng.choice(chatter)])
+        else:
+            text = number + rng.choice(chatter) * rng.randint(1, 3)
+        messages.append(text)
+    return messages
+
+def main(args: argparse.Namespace) -> None:
+    config, keyword = _load("config"), _load("_keyword")
+    car, fake = list(dict.fromkeys(config.CAR)), list(dict.fromkeys(config.FAKE))
+    rng = random.Random(2)
+    alphabet = "abcdefghijklmnopqrstuvwxyz车房间协力大分活动"
+    car += ["".join(rng.choice(alphabet) for _ in range(rng.randint(3, 6))) for _ in range(args.extra)]
+    fake += ["".join(rng.choice(alphabet) for _ in range(rng.randint(3, 6))) for _ in range(args.extra)]
+    messages = chat_messages(args.messages, car, fake)
+
+    classifiers: Dict[str, Callable[[str], Result]] = {
+        "loop": loop_classifier(car, fake),
+        "aho_corasick": aho_corasick_classifier(car, fake),
+        "regex": keyword.RoomKeywordMatcher(car, fake).classify,
+    }
+
+    # 是否为车牌必须一致；命中的关键词可能不同（原实现取列表中的第一个，正则取最长匹配）
+    expected = [classifiers["loop"](text)[0] for text in messages]
+    for name, classify in classifiers.items():
+        mismatches = sum(classify(text)[0] != result for text, result in zip(messages, expected))
+        assert mismatches == 0, f"{name} disagrees with loop on {mismatches} messages"
+
+    report: Dict[str, Dict[str, float]] = {}
+    for name, classify in classifiers.items():
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = perf_counter()
+            for text in messages:
+                classify(text)
+            best = min(best, perf_counter() - start)
+        report[name] = {
+            "us_per_message": round(best / len(messages) * 1e6, 3),
+            "messages_per_second": round(len(messages) / best),
+        }
+    print(json.dumps({
+        "messages": len(messages),
+        "car_keywords": len(car),
+        "fake_keywords": len(fake),
+        "cars": sum(expected),
+        "results": report,
+    }, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--extra", type=int, default=0, help="追加的随机关键词数量")
+    parser.add_argument("--repeat", type=int, default=5)
+    main(parser.parse_args())
@@ -0,0 +1,201 @@
+'''压测工具
+
+启动本地后端桩，通过最小适配器按目标速率向插件真实的事件响应器投递消息，
+运行结束后输出 JSON 报告：每秒完成的消息数、各类消息的延迟分位数、
+后端请求数、进程峰值内存与插件各组件的统计信息。
+
+后端桩的延迟、图片大小与错误率可配置，未指定时使用场景的默认值。可用场景：
+
+- `ycx_storm`：活动结束前大量用户同时查询档线预测
+- `car_flood`：车牌刷屏，包含重复车牌与带有无效关键词的消息
+- `gacha`：大量抽卡模拟，返回体积较大的图片
+- `mixed`：以上消息与普通群聊、查卡等指令混合
+
+    python bench/load.py --scenario mixed --rate 50 --duration 10 [--output report.json]
+'''
+
+import sys
+import json
+import random
+import asyncio
+import argparse
+from pathlib import Path
+from time import perf_counter
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple, Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from _stub import StubBackend
+
+Generator = Callable[[random.Random], str]
+
+def _room(rng: random.Random) -> str:
+    # 约一成的车牌重复，用于检验去重
+    number = rng.randint(100000, 100050) if rng.random() < 0.1 else rng.randint(10000, 999999)
+    return f"{number} {rng.choice(['q4', 'q3', '缺1', '差2'])} {rng.choice(['大分e', '3火', '清火', '长途'])}"
+
+def _fake_room(rng: random.Random) -> str:
+    return f"{rng.randint(10000, 999999)} {rng.choice(['q1', '3火'])} {rng.choice(['114514', '麻将', 'qq.com'])}"
+
+def _chatter(rng: random.Random) -> str:
+    return rng.choice(["哈哈哈哈哈", "有人一起协力吗", "这期活动好肝啊", "晚安", "好耶", "今天也要好好打歌", "？"])
+
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    "ycx_storm": {
+        "stub": {"latency": 0.2, "payload_size": 300_000, "error_rate": 0.0},
+        "messages": [
+            (6, "ycx", lambda rng: f"ycx {rng.choice([100, 1000, 2000, 5000])}"),
+            (2, "ycx_server", lambda rng: f"ycx {rng.choice([100, 1000])} {rng.choice(['jp', 'cn'])}"),
+            (1, "ycxall", lambda rng: "ycxall"),
+            (1, "lsycx", lambda rng: "lsycx 1000"),
+        ],
+    },
+    "car_flood": {
+        "stub": {"latency": 0.05, "payload_size": 0, "error_rate": 0.0},
+        "messages": [
+            (8, "car", _room),
+            (1, "fake_car", _fake_room),
+            (3, "chatter", _chatter),
+        ],
+    },
+    "gacha": {
+        "stub": {"latency": 0.5, "payload_size": 2_000_000, "error_rate": 0.0},
+        "messages": [
+            (3, "gacha", lambda rng: f"抽卡模拟 {rng.choice([10, 100, 300])}"),
+            (1, "chatter", _chatter),
+        ],
+    },
+    "mixed": {
+        "stub": {"latency": 0.1, "payload_size": 500_000, "error_rate": 0.01},
+        "messages": [
+            (20, "chatter", _chatter),
+            (4, "car", _room),
+            (1, "fake_car", _fake_room),
+            (3, "ycx", lambda rng: f"ycx {rng.choice([100, 1000, 2000])}"),
+            (2, "card", lambda rng: f"查卡 {rng.randint(1, 2000)}"),
+            (1, "player", lambda rng: "玩家状态"),
+            (1, "gacha", lambda rng: "抽卡模拟 10"),
+        ],
+    },
+}
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def _at(ratio: float) -> float:
+        return round(values[min(len(values) - 1, int(len(values) * ratio))] * 1000, 2)
+
+    return {"p50_ms": _at(0.5), "p90_ms": _at(0.9), "p99_ms": _at(0.99), "max_ms": round(values[-1] * 1000, 2)}
+
+async def main(args: argparse.Namespace) -> None:
+    scenario = SCENARIOS[args.scenario]
+    stub_settings = {
+        key: getattr(args, key) if getattr(args, key) is not None else value
+        for key, value in scenario["stub"].items()
+    }
+
+    with StubBackend(seed=args.seed, **stub_settings) as stub:
+        import nonebot
+
+        nonebot.init(
+            driver="~none+~httpx",
+            command_start={"/", ""},
+            log_level=args.log_level,
+            tsugu_backend_url=stub.url,
+            tsugu_data_backend_url=stub.url,
+        )
+        nonebot.load_plugin("nonebot_plugin_tsugu_bangdream_bot")
+        from nonebot.message import handle_event
+
+        from nonebot_plugin_tsugu_bangdream_bot._metrics import metrics, process_stats
+        from _adapter import make_bot, make_event
+
+        driver = nonebot.get_driver()
+        await driver._lifespan.startup() # type: ignore
+        bot = make_bot()
+
+        rng = random.Random(args.seed)
+        kinds = scenario["messages"]
+        weights = [weight for weight, _, _ in kinds]
+        total = int(args.rate * args.duration)
+        plan: List[Tuple[str, str, str]] = []
+        for _ in range(total):
+            _, kind, generate = rng.choices(kinds, weights)[0]
+            plan.append((kind, generate(rng), str(rng.randint(1, args.users))))
+
+        latencies: Dict[str, List[float]] = defaultdict(list)
+        errors: Dict[str, int] = defaultdict(int)
+        finished: List[float] = []
+
+        async def _handle(kind: str, text: str, user_id: str) -> None:
+            event = make_event(text, user_id=user_id)
+            started = perf_counter()
+            try:
+                await handle_event(bot, event)
+            except Exception:
+                errors[kind] += 1
+            latencies[kind].append(perf_counter() - started)
+            finished.append(perf_counter())
+
+        # 开环投递：按计划时间发出消息，不等待前一条处理完成
+        tasks: List['asyncio.Task[None]'] = []
+        start = perf_counter()
+        for index, (kind, text, user_id) in enumerate(plan):
+            delay = start + index / args.rate - perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(_handle(kind, text, user_id)))
+        dispatched = perf_counter() - start
+        _, pending = await asyncio.wait(tasks, timeout=args.drain_timeout) if tasks else (set(), set())
+        for task in pending:
+            task.cancel()
+        elapsed = (max(finished) if finished else perf_counter()) - start
+
+        all_latencies = [value for values in latencies.values() for value in values]
+        report: Dict[str, Any] = {
+            "scenario": args.scenario,
+            "target_rate": args.rate,
+            "duration": args.duration,
+            "users": args.users,
+            "stub": stub_settings,
+            "messages": total,
+            "completed": len(finished),
+            "timed_out": len(pending),
+            "replies": bot.sent,
+            "dispatch_seconds": round(dispatched, 3),
+            "elapsed_seconds": round(elapsed, 3),
+            "commands_per_second": round(len(finished) / elapsed, 2) if elapsed > 0 else 0,
+            "latency": _percentiles(all_latencies),
+            "latency_by_kind": {
+                kind: {"count": len(values), "errors": errors[kind], **_percentiles(values)}
+                for kind, values in sorted(latencies.items())
+            },
+            "backend_requests": dict(stub.hits),
+            "backend_connections": stub.connections,
+            "process": process_stats(),
+            "plugin": {name: source() for name, source in metrics.sources.items()},
+        }
+        await driver._lifespan.shutdown() # type: ignore
+
+    output = json.dumps(report, indent=2, ensure_ascii=False, default=str)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+    print(output)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mixed")
+    parser.add_argument("--rate", type=float, default=50, help="每秒投递的消息数")
+    parser.add_argument("--duration", type=float, default=10, help="投递持续时间（秒）")
+    parser.add_argument("--users", type=int, default=200, help="发送消息的用户数")
+    parser.add_argument("--latency", type=float, default=None, help="后端桩的处理时间（秒）")
+    parser.add_argument("--payload-size", dest="payload_size", type=int, default=None, help="渲染接口返回的图片字节数")
+    parser.add_argument("--error-rate", dest="error_rate", type=float, default=None, help="后端桩返回 503 的概率")
+    parser.add_argument("--drain-timeout", type=float, default=60, help="投递结束后等待处理完成的最长时间（秒）")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", default="", help="报告的输出路径，为空时只打印")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,67 @@
+'''会话复用基准
+
+对本地后端桩依次发送请求，比较每个请求新建会话（原实现）与复用长连接会话池的单请求延迟。
+
+    python bench/pool_reuse.py [--requests 500] [--latency 0]
+'''
+
+import sys
+import json
+import asyncio
+import argparse
+from pathlib import Path
+from time import perf_counter
+from typing import List, Dict
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from _stub import StubBackend
+
+def _summary(latencies: List[float]) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 3),
+    }
+
+async def main(args: argparse.Namespace) -> None:
+    import nonebot
+    from nonebot.drivers import Request
+
+    with StubBackend(latency=args.latency) as stub:
+        nonebot.init(driver="~none+~httpx", log_level="WARNING", tsugu_data_backend_url=stub.url)
+        nonebot.load_plugin("nonebot_plugin_tsugu_bangdream_bot")
+        import tsugu_api_async
+
+        driver = nonebot.get_driver()
+        await driver._lifespan.startup() # type: ignore
+        url = stub.url + "/user/getUserData"
+        body = json.dumps({"platform": "red", "userId": "1"}).encode()
+
+        async def _fresh() -> None:
+            # 原实现：每个请求由驱动新建并关闭一个会话
+            await driver.request(Request("POST", url, content=body)) # type: ignore
+
+        async def _pooled() -> None:
+            await tsugu_api_async.get_user_data("red", "1")
+
+        report = {}
+        for name, call in (("fresh_session", _fresh), ("pooled_session", _pooled)):
+            await call()
+            connections = stub.connections
+            latencies = []
+            for _ in range(args.requests):
+                start = perf_counter()
+                await call()
+                latencies.append(perf_counter() - start)
+            report[name] = {**_summary(latencies), "connections": stub.connections - connections}
+        await driver._lifespan.shutdown() # type: ignore
+
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0, help="后端桩的处理时间（秒）")
+    asyncio.run(main(parser.parse_args()))
@@ -1,8 +1,16 @@
-from typing import TYPE_CHECKING, Any, Set, List, Type, Tuple, Union
+import re
+from time import perf_counter
+from dataclasses import asdict
+from importlib.util import find_spec
+from typing import TYPE_CHECKING, Any, Set, Dict, List, Type, Tuple, Union, Optional, Sequence, cast
 
 from nonebot.log import logger
 from nonebot.adapters import Bot, Event, Message
+from nonebot.matcher import Matcher
+from nonebot.permission import SUPERUSER, Permission
 from nonebot.params import RegexGroup, ArgPlainText
+from nonebot.message import run_preprocessor, run_postprocessor
+from nonebot.drivers import URL, Request, Response, ASGIMixin, HTTPServerSetup
 from nonebot import on_regex, get_driver, get_plugin_config
 from nonebot.plugin import PluginMetadata, require, inherit_supported_adapters
 
@@ -12,8 +20,10 @@ from nonebot_plugin_alconna import Args, Match, Query, Arparma
 from nonebot_plugin_alconna.uniseg import At, Reply, UniMessage
 from nonebot_plugin_alconna import (
     Field,
+    Option,
     Alconna,
     Command,
+    Subcommand,
     Extension,
     namespace,
     CommandMeta,
@@ -29,34 +39,55 @@ require("nonebot_plugin_userinfo")
 from nonebot_plugin_userinfo import get_user_info
 
 from .config import Config
+from ._gate import gated, command_gate
+from ._flight import gather
+from ._master import master_index
+from ._prerender import prerenderer
+from ._transcode import transcoder
+from ._userstore import user_store
+from ._metrics import metrics, process_stats
+from ._scheduler import scheduler
 from ._utils import USAGES, server_name_to_id, tier_list_of_server_to_string
 from ._commands import (
+    _backend,
     room_list,
     song_meta,
     song_chart,
     search_ycx,
+    user_cache,
+    room_cache,
     event_stage,
     player_bind,
     player_info,
     random_song,
     search_card,
     search_song,
-    forward_room,
+    stale_cache,
     search_event,
     search_gacha,
     search_lsycx,
+    cutoff_cache,
     player_unbind,
     search_player,
+    render_flight,
+    response_cache,
     simulate_gacha,
     switch_forward,
     search_ycx_all,
     _get_tsugu_user,
     get_player_list,
     search_character,
+    room_render_cache,
+    room_submit_queue,
+    fuzzy_search_cache,
     switch_main_server,
     set_default_servers,
     switch_player_index,
+    room_keyword_matcher,
+    classify_room_message,
     get_card_illustration,
+    car_forwarding_counter,
+    _invalidate_tsugu_user,
     server_id_to_full_name,
     server_name_fuzzy_search,
     difficulty_id_fuzzy_search
@@ -84,37 +115,132 @@ __plugin_meta__ = PluginMetadata(
     )
 )
 
+def _urls_of(urls: Union[str, List[str]]) -> List[str]:
+    return [url for url in ([urls] if isinstance(urls, str) else urls) if len(url) > 0]
+
+# 后端地址可配置多个，首个地址交给 `tsugu_api`，请求时由 HTTP 客户端按健康状况与延迟选择实际地址
+_backend_urls = _urls_of(_config.tsugu_backend_url)
+_data_backend_urls = _urls_of(_config.tsugu_data_backend_url)
+
 try:
     from . import _client
     from tsugu_api_core import register_client
     
     register_client(_client.Client)
+    _client.client_settings.max_connections = _config.tsugu_max_connections
+    _client.client_settings.idle_timeout = _config.tsugu_idle_timeout
+    _client.client_settings.retry_budget_ratio = _config.tsugu_retry_budget_ratio
+    _client.client_settings.retry_budget_burst = _config.tsugu_retry_budget_burst
+    _client.client_settings.breaker_threshold = _config.tsugu_breaker_threshold
+    _client.client_settings.breaker_reset_timeout = _config.tsugu_breaker_reset_timeout
+    _client.client_settings.health_check_interval = _config.tsugu_backend_check_interval
+    _client.client_settings.hedge = _config.tsugu_backend_hedge
+    _client.client_settings.hedge_min_delay = _config.tsugu_backend_hedge_min_delay
+    _client.json_codec.use(_config.tsugu_json_codec)
+    _client.json_codec.offload_size = _config.tsugu_json_offload_size
+    for _urls, _proxy in (
+        (_backend_urls, _config.tsugu_backend_proxy),
+        (_data_backend_urls, _config.tsugu_data_backend_proxy),
+    ):
+        if len(_urls) > 1:
+            _client.backend_router.add(_urls, _proxy)
+    get_driver().on_startup(_client.backend_router.start)
+    get_driver().on_shutdown(_client.backend_router.stop)
+    metrics.sources["client"] = lambda: dict(_client.client_counter)
+    metrics.sources["breaker"] = _client.breaker_states
+    metrics.sources["backends"] = _client.backend_router.stats
+    metrics.sources["json"] = _client.json_codec.stats
 except ImportError:
-    # 尝试导入两个内置客户端适配的库
-    try:
-        import httpx
+    if len(_backend_urls) > 1 or len(_data_backend_urls) > 1:
+        logger.warning("Multiple backend URLs require a NoneBot driver with HTTP client support, only the first URL will be used")
+    # 检查两个内置客户端适配的库是否可用，实际导入推迟到首次请求时
+    if find_spec("httpx") is not None:
         tsugu_api_async.settings.client = 'httpx'
-    except ImportError:
-        try:
-            import aiohttp
-            tsugu_api_async.settings.client = 'aiohttp'
-        except ImportError:
-            raise ImportError("Failed to import httpx and aiohttp, please install one of them to use this plugin.")
+    elif find_spec("aiohttp") is not None:
+        tsugu_api_async.settings.client = 'aiohttp'
+    else:
+        raise ImportError("Failed to import httpx and aiohttp, please install one of them to use this plugin.")
 
 tsugu_api_async.settings.max_retries = _config.tsugu_retries
 tsugu_api_async.settings.use_easy_bg = _config.tsugu_use_easy_bg
 tsugu_api_async.settings.compress = _config.tsugu_compress
 
-if len(_config.tsugu_backend_url) > 0:
-    tsugu_api_async.settings.backend_url = _config.tsugu_backend_url
-if len(_config.tsugu_data_backend_url) > 0:
-    tsugu_api_async.settings.userdata_backend_url = _config.tsugu_data_backend_url
+if len(_backend_urls) > 0:
+    tsugu_api_async.settings.backend_url = _backend_urls[0]
+if len(_data_backend_urls) > 0:
+    tsugu_api_async.settings.userdata_backend_url = _data_backend_urls[0]
 
 tsugu_api_async.settings.proxy = _config.tsugu_proxy
 tsugu_api_async.settings.backend_proxy = _config.tsugu_backend_proxy
 tsugu_api_async.settings.userdata_backend_proxy = _config.tsugu_data_backend_proxy
 tsugu_api_async.settings.timeout = _config.tsugu_timeout
 
+scheduler.configure("light", _config.tsugu_light_concurrency, _config.tsugu_light_queue_size)
+scheduler.configure("render", _config.tsugu_render_concurrency, _config.tsugu_render_queue_size)
+scheduler.configure("heavy", _config.tsugu_heavy_concurrency, _config.tsugu_heavy_queue_size)
+
+room_keyword_matcher.extend(_config.tsugu_car_keywords, _config.tsugu_fake_keywords)
+
+user_cache.maxsize = _config.tsugu_user_cache_size
+user_cache.ttl = _config.tsugu_user_cache_ttl
+
+user_store.path = _config.tsugu_user_store_path
+user_store.refresh_age = _config.tsugu_user_store_refresh
+user_store.check_interval = _config.tsugu_user_store_check_interval
+
+get_driver().on_startup(user_store.start)
+get_driver().on_shutdown(user_store.stop)
+
+response_cache.maxbytes = _config.tsugu_response_cache_size
+response_cache.ttl = _config.tsugu_response_cache_ttl
+response_cache.directory = _config.tsugu_response_cache_dir
+response_cache.disk_maxbytes = _config.tsugu_response_cache_disk_size
+
+cutoff_cache.maxsize = _config.tsugu_cutoff_cache_size
+cutoff_cache.interval = _config.tsugu_cutoff_update_interval
+cutoff_cache.delay = _config.tsugu_cutoff_update_delay
+cutoff_cache.stale = _config.tsugu_cutoff_stale
+
+room_cache.ttl = _config.tsugu_room_cache_ttl
+room_render_cache.ttl = _config.tsugu_room_cache_ttl
+
+stale_cache.maxbytes = _config.tsugu_stale_cache_size
+stale_cache.max_age = _config.tsugu_stale_max_age
+stale_cache.max_ages.update(_config.tsugu_stale_max_ages)
+stale_cache.budget = _config.tsugu_stale_latency_budget
+
+master_index.directory = _config.tsugu_master_data_dir
+master_index.refresh_interval = _config.tsugu_master_data_refresh
+master_index.slack = _config.tsugu_master_data_slack
+
+get_driver().on_startup(master_index.start)
+get_driver().on_shutdown(master_index.stop)
+
+prerenderer.enabled = _config.tsugu_prerender
+prerenderer.stagger = _config.tsugu_prerender_stagger
+prerenderer.idle = _config.tsugu_prerender_idle
+prerenderer.slow = _config.tsugu_prerender_slow
+
+get_driver().on_startup(prerenderer.start)
+get_driver().on_shutdown(prerenderer.stop)
+
+transcoder.format = _config.tsugu_image_format.lower()
+transcoder.quality = _config.tsugu_image_quality
+transcoder.max_size = _config.tsugu_image_max_size
+transcoder.workers = _config.tsugu_image_workers
+
+get_driver().on_startup(transcoder.start)
+get_driver().on_shutdown(transcoder.stop)
+
+room_submit_queue.window = _config.tsugu_car_forward_window
+room_submit_queue.concurrency = _config.tsugu_car_forward_concurrency
+
+get_driver().on_shutdown(room_submit_queue.stop)
+
+command_gate.enabled = _config.tsugu_command_gate
+
+metrics.sample_rate = _config.tsugu_metrics_sample_rate
+
 class TsuguExtension(Extension):
     @property
     def priority(self) -> int:
@@ -180,34 +306,47 @@ def _get_platform(bot: Bot) -> str:
 # 自动转发房间号，不作为单独命令算入 namespace
 @(car_forwarding := on_regex(r"(^(\d{5,6})(.*)$)")).handle()
 async def _(bot: Bot, event: Event, group: Tuple[Any, ...] = RegexGroup()) -> None:
-    user_info = await get_user_info(bot, event, event.get_user_id())
+    car_forwarding_counter["received"] += 1
+    
+    # 先进行不涉及 I/O 的关键词判断，绝大多数消息在此被过滤
+    is_car, keyword = classify_room_message(group[0])
+    if not is_car:
+        if keyword is None:
+            car_forwarding_counter["rejected_by_keyword"] += 1
+        else:
+            car_forwarding_counter["rejected_by_fake"] += 1
+            logger.debug(f"Invalid keyword in message: {keyword}")
+        car_forwarding.skip()
     
     try:
         tsugu_user = await _get_tsugu_user(_get_platform(bot), event.get_user_id())
     except Exception as exception:
+        car_forwarding_counter["rejected_by_user_data"] += 1
         logger.warning(f"Failed to get user data: '{exception}'")
         car_forwarding.skip()
     
-    if isinstance(tsugu_user, str):
-        logger.warning(f"Failed to get user data: '{tsugu_user}'")
+    if not tsugu_user["shareRoomNumber"]:
+        car_forwarding_counter["rejected_by_user_setting"] += 1
+        logger.debug("User is disabled to forward room number")
         car_forwarding.skip()
     
-    try:
-        is_forwarded = await forward_room(
+    user_info = await get_user_info(bot, event, event.get_user_id())
+    
+    # 提交在后台进行，不等待车站的响应
+    if room_submit_queue.put(
+        (int(group[1]), group[0].strip()),
+        (
             int(group[1]),
             group[0],
-            tsugu_user,
             "red",
             user_info.user_id if user_info is not None else event.get_user_id(),
             user_info.user_name if user_info is not None else event.get_user_id(),
             _config.tsugu_bandori_station_token
         )
-    except Exception as exception:
-        logger.warning(f"Failed to submit room number: '{exception}'")
-        car_forwarding.skip()
-    
-    if is_forwarded:
-        logger.debug(f"Submitted room number: '{group[0]}'")
+    ):
+        car_forwarding_counter["queued"] += 1
+    else:
+        logger.debug(f"Room number is duplicated or the queue is full: '{group[0]}'")
 
 # 统一的命令参数预处理，添加帮助指令自动回复
 async def _process_if_unmatch(matcher: AlconnaMatcher, arp: Arparma) -> None:
@@ -222,51 +361,87 @@ async def _process_if_unmatch(matcher: AlconnaMatcher, arp: Arparma) -> None:
     else:
         matcher.skip()
 
-# 统一的命令 build 方法
-def _build(cmd: Command, aliases: Set[str], *, priority: int = 1, block: bool = False) -> Type[AlconnaMatcher]:
-    _matcher = cmd.build(
+# 以命令字符串构造命令
+# 不使用 `Command` 构造：`Command` 构造时通过 `inspect.stack()` 查找调用方模块以解析参数类型，
+# 插件加载时调用栈很深，所有命令的构造合计占据了加载耗时的一半以上。参数类型直接以本模块的命名空间解析
+def _command(
+    command: str,
+    help_text: Optional[str] = None,
+    *options: Union[Option, Subcommand],
+    meta: Optional[CommandMeta] = None,
+    usage: Optional[str] = None,
+    examples: Sequence[str] = ()
+) -> Alconna:
+    head, _, args = command.partition(" ")
+    _meta = CommandMeta(fuzzy_match=True) if meta is None else CommandMeta(**asdict(meta))
+    _meta.description = help_text or head
+    _meta.usage = usage
+    _meta.example = "\n".join(examples) or None
+    return Alconna(head, Command.args_gen(args, globals()), *options, meta=_meta)
+
+# 统一的命令 build 方法，`alias` 为保留命令前缀的快捷指令
+def _build(
+    command: Alconna,
+    aliases: Set[str],
+    *,
+    priority: int = 1,
+    block: bool = False,
+    permission: Optional[Permission] = None,
+    alias: Sequence[str] = (),
+    shortcuts: Optional[Dict[str, Any]] = None
+) -> Type[AlconnaMatcher]:
+    _matcher = on_alconna(
+        command,
         skip_for_unmatch=False,
         auto_send_output=False,
         aliases=aliases,
         extensions=[extension],
         use_cmd_start=True,
+        permission=permission,
         priority=priority,
         block=block,
     )
+    # 快捷指令在设置命令前缀之后添加
+    for key in alias:
+        _matcher.shortcut(key, {"prefix": True})
+    for key, args in (shortcuts or {}).items():
+        _matcher.shortcut(key, args)
+    _matcher.rule = gated(_matcher.rule)
     _matcher.handle()(_process_if_unmatch)
     return _matcher
 
 # 定义 tsugu namespace
 with namespace("tsugu") as tsugu_namespace:
     
-    @(open_forward := _build(Command("开启车牌转发", "开启车牌转发", meta=meta), _config.tsugu_open_forward_aliases)).handle()
+    @(open_forward := _build(_command("开启车牌转发", "开启车牌转发", meta=meta), _config.tsugu_open_forward_aliases)).handle()
     async def _(bot: Bot, event: Event) -> None:
         user_id = event.get_user_id()
         await open_forward.send(await switch_forward(_get_platform(bot), user_id, True))
 
-    @(close_forward := _build(Command("关闭车牌转发", "关闭车牌转发", meta=meta), _config.tsugu_close_forward_aliases)).handle()
+    @(close_forward := _build(_command("关闭车牌转发", "关闭车牌转发", meta=meta), _config.tsugu_close_forward_aliases)).handle()
     async def _(bot: Bot, event: Event) -> None:
         user_id = event.get_user_id()
         await close_forward.send(await switch_forward(_get_platform(bot), user_id, False))
 
     @(bind_player := _build(
-        Command("绑定玩家 [server_name:str]", "绑定玩家信息", meta=meta)
-        .usage(
-            '开始玩家数据绑定流程，请不要在"绑定玩家"指令后添加玩家ID。'
-            '省略服务器名时，默认为绑定到你当前的主服务器。'
-            '请在获得临时验证数字后，将玩家签名改为该数字，并回复你的玩家ID'
+        _command(
+            "绑定玩家 [server_name:str]",
+            "绑定玩家信息",
+            meta=meta,
+            usage=(
+                '开始玩家数据绑定流程，请不要在"绑定玩家"指令后添加玩家ID。'
+                '省略服务器名时，默认为绑定到你当前的主服务器。'
+                '请在获得临时验证数字后，将玩家签名改为该数字，并回复你的玩家ID'
+            )
         ),
         _config.tsugu_bind_player_aliases
     )).handle()
     async def _(server_name: Match[str], bot: Bot, event: Event) -> None:
         if server_name.available:
             try:
-                _server = server_name_to_id(server_name.result)
+                _server = await server_name_fuzzy_search(server_name.result)
             except ValueError:
-                try:
-                    _server = await server_name_fuzzy_search(server_name.result)
-                except ValueError:
-                    await bind_player.finish("错误: 服务器名未能匹配任何服务器")
+                await bind_player.finish("错误: 服务器名未能匹配任何服务器")
         else:
             try:
                 tsugu_user = await _get_tsugu_user(_get_platform(bot), event.get_user_id())
@@ -289,42 +464,36 @@ with namespace("tsugu") as tsugu_namespace:
         assert server is not None # 理论上不会被触发
 
         try:
-            response = await tsugu_api_async.bind_player_verification(_get_platform(bot), event.get_user_id(), server, int(player_id), "bind")
+            async with _backend("light"):
+                response = await tsugu_api_async.bind_player_verification(_get_platform(bot), event.get_user_id(), server, int(player_id), "bind")
         except FailedException as exception:
             return await bind_player.finish(exception.response["data"])
-
-        await bind_player.send(f"绑定 {server_id_to_full_name(server)} 玩家 {player_id} 成功，正在生成玩家状态图片")
+        except Exception as exception:
+            logger.opt(exception=exception).debug('Failed to verify binding player')
+            return await bind_player.finish(f"错误: {exception}")
         
-        message = await search_player(_get_platform(bot), event.get_user_id(), int(player_id), server)
+        await _invalidate_tsugu_user(_get_platform(bot), event.get_user_id())
+
+        # 玩家状态的渲染不依赖提示消息，与发送提示消息并发进行
+        message, _ = await gather(
+            search_player(_get_platform(bot), event.get_user_id(), int(player_id), server),
+            bind_player.send(f"绑定 {server_id_to_full_name(server)} 玩家 {player_id} 成功，正在生成玩家状态图片")
+        )
         return await bind_player.finish(message)
 
     @(unbind_player := _build(
-        Command("解除绑定 [server_name:str]", "解除当前服务器的玩家绑定", meta=meta)
-        .alias("解绑玩家")
-        .usage("解除指定服务器的玩家数据绑定。省略服务器名时，默认为当前的主服务器"),
-        _config.tsugu_unbind_player_aliases
+        _command(
+            "解除绑定 [server_name:str]",
+            "解除当前服务器的玩家绑定",
+            meta=meta,
+            usage="解除指定服务器的玩家数据绑定。省略服务器名时，默认为当前的主服务器"
+        ),
+        _config.tsugu_unbind_player_aliases,
+        alias=["解绑玩家"]
     )).handle()
     async def _(server_name: Match[str], bot: Bot, event: Event) -> None:
-        if server_name.available:
-            try:
-                _server = server_name_to_id(server_name.result)
-            except ValueError:
-                try:
-                    _server = await server_name_fuzzy_search(server_name.result)
-                except ValueError:
-                    await bind_player.finish("错误: 服务器名未能匹配任何服务器")
-        else:
-            try:
-                tsugu_user = await _get_tsugu_user(_get_platform(bot), event.get_user_id())
-            except FailedException as exception:
-                return await bind_player.finish(exception.response["data"])
-            except Exception as exception:
-                return await bind_player.finish(f"错误: {exception}")
-            
-            _server = tsugu_user["mainServer"]
-    
-        
-        return await player_unbind(bind_player, _get_platform(bot), event.get_user_id(), _server)
+        _server_name = server_name.result if server_name.available else None
+        return await player_unbind(unbind_player, _get_platform(bot), event.get_user_id(), _server_name)
 
     @unbind_player.got("_anything")
     async def _(bot: Bot, event: Event) -> None:
@@ -335,36 +504,46 @@ with namespace("tsugu") as tsugu_namespace:
         assert player_id is not None
         
         try:
-            response = await tsugu_api_async.bind_player_verification(_get_platform(bot), event.get_user_id(), server, int(player_id), "unbind")
+            async with _backend("light"):
+                response = await tsugu_api_async.bind_player_verification(_get_platform(bot), event.get_user_id(), server, int(player_id), "unbind")
         except FailedException as exception:
             return await bind_player.finish(exception.response["data"])
+        except Exception as exception:
+            logger.opt(exception=exception).debug('Failed to verify unbinding player')
+            return await unbind_player.finish(f"错误: {exception}")
         
+        await _invalidate_tsugu_user(_get_platform(bot), event.get_user_id())
         await unbind_player.finish(response["data"])
 
     @(main_server := _build(
-        Command("主服务器 <server_name:str>", "设置主服务器", meta=meta)
-        .alias("服务器模式").alias("切换服务器")
-        .usage("将指定的服务器设置为你的主服务器")
-        .example("主服务器 cn : 将国服设置为主服务器").example("日服模式 : 将日服设置为主服务器")
-        .shortcut(r"(.+服)模式$", {"args": ["{0}"], "prefix": True}),
-        _config.tsugu_main_server_aliases
+        _command(
+            "主服务器 <server_name:str>",
+            "设置主服务器",
+            meta=meta,
+            usage="将指定的服务器设置为你的主服务器",
+            examples=["主服务器 cn : 将国服设置为主服务器", "日服模式 : 将日服设置为主服务器"]
+        ),
+        _config.tsugu_main_server_aliases,
+        alias=["服务器模式", "切换服务器"],
+        shortcuts={r"(.+服)模式$": {"args": ["{0}"], "prefix": True}}
     )).handle()
     async def _(server_name: Match[str], bot: Bot, event: Event) -> None:
         try:
-            _server = server_name_to_id(server_name.result)
+            _server = await server_name_fuzzy_search(server_name.result)
         except ValueError:
-            try:
-                _server = await server_name_fuzzy_search(server_name.result)
-            except ValueError:
-                await bind_player.finish("错误: 服务器名未能匹配任何服务器")
+            await bind_player.finish("错误: 服务器名未能匹配任何服务器")
         await main_server.finish(await switch_main_server(_get_platform(bot), event.get_user_id(), _server))
 
     @(display_servers := _build(
-        Command("设置显示服务器 <server_list:str*>", "设定信息显示中的默认服务器排序", meta=meta)
-        .alias("默认服务器").alias("设置默认服务器")
-        .usage("使用空格分隔服务器列表")
-        .example("设置默认服务器 国服 日服 : 将国服设置为第一服务器，日服设置为第二服务器"),
-        aliases=_config.tsugu_default_servers_aliases
+        _command(
+            "设置显示服务器 <server_list:str*>",
+            "设定信息显示中的默认服务器排序",
+            meta=meta,
+            usage="使用空格分隔服务器列表",
+            examples=["设置默认服务器 国服 日服 : 将国服设置为第一服务器，日服设置为第二服务器"]
+        ),
+        aliases=_config.tsugu_default_servers_aliases,
+        alias=["默认服务器", "设置默认服务器"]
     )).handle()
     async def _(server_list: List[str], bot: Bot, event: Event) -> None:
         servers: List['ServerId'] = []
@@ -382,10 +561,14 @@ with namespace("tsugu") as tsugu_namespace:
         await display_servers.finish(await set_default_servers(_get_platform(bot), event.get_user_id(), servers))
 
     @(player_status := _build(
-        Command("玩家状态 [index:int] [server_name:str]", "查询自己的玩家状态", meta=meta)
-        .shortcut(r"(.+服)玩家状态$", {"args": ["{0}"], "command": f"{list(_command_start)[0]}玩家状态"}),
+        _command(
+            "玩家状态 [index:int] [server_name:str]",
+            "查询自己的玩家状态",
+            meta=meta
+        ),
         _config.tsugu_player_status_aliases,
-        block=True
+        block=True,
+        shortcuts={r"(.+服)玩家状态$": {"args": ["{0}"], "command": f"{list(_command_start)[0]}玩家状态"}}
     )).handle()
     async def _(index: Match[int], server_name: Match[str], bot: Bot, event: Event) -> None:
         if index.available:
@@ -401,32 +584,43 @@ with namespace("tsugu") as tsugu_namespace:
         await player_status.finish(await player_info(_get_platform(bot), event.get_user_id(), _index, _server_name))
 
     @(player_list := _build(
-        Command("玩家状态列表", "查询目前已经绑定的所有玩家信息")
-        .alias("玩家列表").alias("玩家信息列表"),
+        _command(
+            "玩家状态列表",
+            "查询目前已经绑定的所有玩家信息"
+        ),
         _config.tsugu_player_list_aliases,
-        priority=2
+        priority=2,
+        alias=["玩家列表", "玩家信息列表"]
     )).handle()
     async def _(bot: Bot, event: Event) -> None:
         return await player_list.finish(await get_player_list(_get_platform(bot), event.get_user_id()))
 
     @(switch_index := _build(
-        Command("玩家默认ID <index:int>", "设置默认显示的玩家ID")
-        .usage(
-            "调整玩家状态指令，和发送车牌时的默认玩家信息。\n"
-            "规则: \n如果该ID对应的玩家信息在当前默认服务器中, 显示。\n"
-            "如果不在当前默认服务器中, 显示当前默认服务器的编号最靠前的玩家信息"
-        ).alias("默认玩家ID").alias("默认玩家").alias("玩家ID"),
-        _config.tsugu_switch_index_aliases
+        _command(
+            "玩家默认ID <index:int>",
+            "设置默认显示的玩家ID",
+            usage=(
+                "调整玩家状态指令，和发送车牌时的默认玩家信息。\n"
+                "规则: \n如果该ID对应的玩家信息在当前默认服务器中, 显示。\n"
+                "如果不在当前默认服务器中, 显示当前默认服务器的编号最靠前的玩家信息"
+            )
+        ),
+        _config.tsugu_switch_index_aliases,
+        alias=["默认玩家ID", "默认玩家", "玩家ID"]
     )).handle()
     async def _(index: Match[int], bot: Bot, event: Event) -> None:
         return await switch_index.finish(await switch_player_index(_get_platform(bot), event.get_user_id(), index.result))
 
     @(ycm := _build(
-        Command("ycm <keyword:str*>", "获取车牌", meta=meta)
-        .alias("有车吗").alias("车来")
-        .usage("获取所有车牌车牌，可以通过关键词过滤")
-        .example("ycm : 获取所有车牌").example('ycm 大分: 获取所有车牌，其中包含"大分"关键词的车牌'),
-        _config.tsugu_ycm_aliases
+        _command(
+            "ycm <keyword:str*>",
+            "获取车牌",
+            meta=meta,
+            usage="获取所有车牌车牌，可以通过关键词过滤",
+            examples=["ycm : 获取所有车牌", 'ycm 大分: 获取所有车牌，其中包含"大分"关键词的车牌']
+        ),
+        _config.tsugu_ycm_aliases,
+        alias=["有车吗", "车来"]
     )).handle()
     async def _(keyword: List[str]) -> None:
         if len(keyword) > 0:
@@ -437,11 +631,15 @@ with namespace("tsugu") as tsugu_namespace:
         await ycm.finish(await room_list(_keyword))
 
     @(player_search := _build(
-        Command("查玩家 <player_id:int> [server_name:str]", "查询玩家信息", meta=meta)
-        .alias("查询玩家")
-        .usage("查询指定ID玩家的信息。省略服务器名时，默认从你当前的主服务器查询")
-        .example("查玩家 10000000 : 查询你当前默认服务器中，玩家ID为10000000的玩家信息").example("查玩家 40474621 jp : 查询日服玩家ID为40474621的玩家信息"),
-        aliases=_config.tsugu_search_player_aliases
+        _command(
+            "查玩家 <player_id:int> [server_name:str]",
+            "查询玩家信息",
+            meta=meta,
+            usage="查询指定ID玩家的信息。省略服务器名时，默认从你当前的主服务器查询",
+            examples=["查玩家 10000000 : 查询你当前默认服务器中，玩家ID为10000000的玩家信息", "查玩家 40474621 jp : 查询日服玩家ID为40474621的玩家信息"]
+        ),
+        aliases=_config.tsugu_search_player_aliases,
+        alias=["查询玩家"]
     )).handle()
     async def _(player_id: Match[int], server_name: Match[str], bot: Bot, event: Event) -> None:
         if not player_id.available:
@@ -458,57 +656,82 @@ with namespace("tsugu") as tsugu_namespace:
         await player_search.finish(await search_player(_get_platform(bot), event.get_user_id(), player_id.result, _server))
 
     @(card_search := _build(
-        Command("查卡 <word:str*>", "查卡", meta=meta).alias("查卡牌")
-        .usage("根据关键词或卡牌ID查询卡片信息，请使用空格隔开所有参数")
-        .example("查卡 1399 :返回1399号卡牌的信息").example("查卡 绿 tsugu :返回所有属性为pure的羽泽鸫的卡牌列表"),
+        _command(
+            "查卡 <word:str*>",
+            "查卡",
+            meta=meta,
+            usage="根据关键词或卡牌ID查询卡片信息，请使用空格隔开所有参数",
+            examples=["查卡 1399 :返回1399号卡牌的信息", "查卡 绿 tsugu :返回所有属性为pure的羽泽鸫的卡牌列表"]
+        ),
         _config.tsugu_search_card_aliases,
-        priority=2
+        priority=2,
+        alias=["查卡牌"]
     )).handle()
     async def _(word: List[str], bot: Bot, event: Event) -> None:
         await card_search.finish(await search_card(_get_platform(bot), event.get_user_id(), " ".join(word)))
 
     @(card_illustration := _build(
-        Command("查卡面 <card_id:int>", "查卡面", meta=meta)
-        .alias("查卡插画").alias("查插画")
-        .usage("根据卡片ID查询卡片插画")
-        .example("查卡面 1399 :返回1399号卡牌的插画"),
+        _command(
+            "查卡面 <card_id:int>",
+            "查卡面",
+            meta=meta,
+            usage="根据卡片ID查询卡片插画",
+            examples=["查卡面 1399 :返回1399号卡牌的插画"]
+        ),
         _config.tsugu_card_illustration_aliases,
-        block=True
+        block=True,
+        alias=["查卡插画", "查插画"]
     )).handle()
     async def _(card_id: Match[int]) -> None:
         await card_illustration.finish(await get_card_illustration(card_id.result))
 
     @(character_search := _build(
-        Command("查角色 <word:str*>", "查角色", meta=meta)
-        .usage("根据关键词或角色ID查询角色信息")
-        .example("查角色 10 :返回10号角色的信息").example("查角色 吉他 :返回所有角色模糊搜索标签中包含吉他的角色列表"),
+        _command(
+            "查角色 <word:str*>",
+            "查角色",
+            meta=meta,
+            usage="根据关键词或角色ID查询角色信息",
+            examples=["查角色 10 :返回10号角色的信息", "查角色 吉他 :返回所有角色模糊搜索标签中包含吉他的角色列表"]
+        ),
         _config.tsugu_search_character_aliases
     )).handle()
     async def _(word: List[str], bot: Bot, event: Event) -> None:
         await character_search.finish(await search_character(_get_platform(bot), event.get_user_id(), " ".join(word)))
 
     @(event_search := _build(
-        Command("查活动 <word:str*>", "查活动", meta=meta)
-        .usage("根据关键词或活动ID查询活动信息")
-        .example("查活动 177 :返回177号活动的信息").example("查活动 绿 tsugu :返回所有属性加成为pure，且活动加成角色中包括羽泽鸫的活动列表"),
+        _command(
+            "查活动 <word:str*>",
+            "查活动",
+            meta=meta,
+            usage="根据关键词或活动ID查询活动信息",
+            examples=["查活动 177 :返回177号活动的信息", "查活动 绿 tsugu :返回所有属性加成为pure，且活动加成角色中包括羽泽鸫的活动列表"]
+        ),
         _config.tsugu_search_event_aliases
     )).handle()
     async def _(word: List[str], bot: Bot, event: Event) -> None:
         await event_search.finish(await search_event(_get_platform(bot), event.get_user_id(), " ".join(word)))
 
     @(song_search := _build(
-        Command("查曲 <word:str*>", "查曲", meta=meta)
-        .usage("根据关键词或曲目ID查询曲目信息")
-        .example("查曲 1 :返回1号曲的信息").example("查曲 ag lv27 :返回所有难度为27的ag曲列表"),
+        _command(
+            "查曲 <word:str*>",
+            "查曲",
+            meta=meta,
+            usage="根据关键词或曲目ID查询曲目信息",
+            examples=["查曲 1 :返回1号曲的信息", "查曲 ag lv27 :返回所有难度为27的ag曲列表"]
+        ),
         _config.tsugu_search_song_aliases
     )).handle()
     async def _(word: List[str], bot: Bot, event: Event) -> None:
         await song_search.finish(await search_song(_get_platform(bot), event.get_user_id(), " ".join(word)))
 
     @(chart_search := _build(
-        Command("查谱面 <song_id:int> [difficulty:str]", "查谱面", meta=meta)
-        .usage("根据曲目ID与难度查询谱面信息")
-        .example("查谱面 1 :返回1号曲的所有谱面").example("查谱面 1 expert :返回1号曲的expert难度谱面"),
+        _command(
+            "查谱面 <song_id:int> [difficulty:str]",
+            "查谱面",
+            meta=meta,
+            usage="根据曲目ID与难度查询谱面信息",
+            examples=["查谱面 1 :返回1号曲的所有谱面", "查谱面 1 expert :返回1号曲的expert难度谱面"]
+        ),
         _config.tsugu_song_chart_aliases
     )).handle()
     async def _(song_id: Match[int], bot: Bot, event: Event, difficulty: str = "expert") -> None:
@@ -520,40 +743,48 @@ with namespace("tsugu") as tsugu_namespace:
         await chart_search.finish(await song_chart(_get_platform(bot), event.get_user_id(), song_id.result, difficulty_id))
 
     @(song_random := _build(
-        Command("随机曲 <word:str*>", "随机曲", meta=meta)
-        .alias("随机")
-        .example("随机曲 lv24 :在所有包含24等级难度的曲中, 随机返回其中一个").example("随机曲 lv24 ag :在所有包含24等级难度的afterglow曲中, 随机返回其中一个"),
-        _config.tsugu_song_random_aliases
+        _command(
+            "随机曲 <word:str*>",
+            "随机曲",
+            meta=meta,
+            examples=["随机曲 lv24 :在所有包含24等级难度的曲中, 随机返回其中一个", "随机曲 lv24 ag :在所有包含24等级难度的afterglow曲中, 随机返回其中一个"]
+        ),
+        _config.tsugu_song_random_aliases,
+        alias=["随机"]
     )).handle()
     async def _(word: List[str], bot: Bot, event: Event) -> None:
         await song_random.finish(await random_song(_get_platform(bot), event.get_user_id(), " ".join(word)))
 
     @(meta_search := _build(
-        Command("查询分数表 <server_name:str>", "查询分数表", meta=meta)
-        .usage("查询指定服务器的歌曲分数表，如果没有服务器名的话，服务器为用户的默认服务器")
-        .alias("查分数表").alias("查询分数榜").alias("查分数榜")
-        .example("查询分数表 cn :返回国服的歌曲分数表"),
-        _config.tsugu_song_meta_aliases
+        _command(
+            "查询分数表 <server_name:str>",
+            "查询分数表",
+            meta=meta,
+            usage="查询指定服务器的歌曲分数表，如果没有服务器名的话，服务器为用户的默认服务器",
+            examples=["查询分数表 cn :返回国服的歌曲分数表"]
+        ),
+        _config.tsugu_song_meta_aliases,
+        alias=["查分数表", "查询分数榜", "查分数榜"]
     )).handle()
     async def _(server_name: Match[str], bot: Bot, event: Event) -> None:
         try:
-            _server = server_name_to_id(server_name.result)
+            _server = await server_name_fuzzy_search(server_name.result)
         except ValueError:
-            try:
-                _server = await server_name_fuzzy_search(server_name.result)
-            except ValueError:
-                await meta_search.finish("错误: 服务器名未能匹配任何服务器")
+            await meta_search.finish("错误: 服务器名未能匹配任何服务器")
         
         await meta_search.finish(await song_meta(_get_platform(bot), event.get_user_id(), _server))
 
     @(stage_search := _build(
-        Command("查试炼 [event_id:int]", "查试炼", meta=meta)
-        .usage("查询当前服务器当前活动试炼信息\n可以自定义活动ID\n参数:-m 显示歌曲meta(相对效率)")
-        .alias("查stage").alias("查舞台").alias("查festival").alias("查5v5")
-        .example("查试炼 157 -m :返回157号活动的试炼信息，包含歌曲meta")
-        .example("查试炼 -m :返回当前活动的试炼信息，包含歌曲meta").example("查试炼 :返回当前活动的试炼信息")
-        .option("meta", "-m", False, store_true),
-        _config.tsugu_event_stage_aliases
+        _command(
+            "查试炼 [event_id:int]",
+            "查试炼",
+            Option("--meta|-m", dest="meta", default=False, action=store_true),
+            meta=meta,
+            usage="查询当前服务器当前活动试炼信息\n可以自定义活动ID\n参数:-m 显示歌曲meta(相对效率)",
+            examples=["查试炼 157 -m :返回157号活动的试炼信息，包含歌曲meta", "查试炼 -m :返回当前活动的试炼信息，包含歌曲meta", "查试炼 :返回当前活动的试炼信息"]
+        ),
+        _config.tsugu_event_stage_aliases,
+        alias=["查stage", "查舞台", "查festival", "查5v5"]
     )).handle()
     async def _(event_id: Match[int], bot: Bot, event: Event, meta: Query[bool]=Query("meta.value", False)) -> None:
         if event_id.available:
@@ -564,8 +795,12 @@ with namespace("tsugu") as tsugu_namespace:
         await stage_search.finish(await event_stage(_get_platform(bot), event.get_user_id(), _event_id, meta.result))
 
     @(gacha_search := _build(
-        Command("查卡池 <gacha_id:int>", "查卡池", meta=meta)
-        .usage("根据卡池ID查询卡池信息"),
+        _command(
+            "查卡池 <gacha_id:int>",
+            "查卡池",
+            meta=meta,
+            usage="根据卡池ID查询卡池信息"
+        ),
         _config.tsugu_search_gacha_aliases,
         block=True
     )).handle()
@@ -573,11 +808,16 @@ with namespace("tsugu") as tsugu_namespace:
         await gacha_search.finish(await search_gacha(_get_platform(bot), event.get_user_id(), gacha_id.result))
 
     @(ycx := _build(
-        Command("ycx <tier:int> [event_id:int] [server_name:str]", "查询指定档位的预测线", meta=meta)
-        .usage(
-            f"查询指定档位的预测线，如果没有服务器名的话，服务器为用户的默认服务器。"
-            "如果没有活动ID的话，活动为当前活动\n可用档线:\n{tier_list_of_server_to_string()}"
-        ).example("ycx 1000 :返回默认服务器当前活动1000档位的档线与预测线").example("ycx 1000 177 jp:返回日服177号活动1000档位的档线与预测线"),
+        _command(
+            "ycx <tier:int> [event_id:int] [server_name:str]",
+            "查询指定档位的预测线",
+            meta=meta,
+            usage=(
+                f"查询指定档位的预测线，如果没有服务器名的话，服务器为用户的默认服务器。"
+                "如果没有活动ID的话，活动为当前活动\n可用档线:\n{tier_list_of_server_to_string()}"
+            ),
+            examples=["ycx 1000 :返回默认服务器当前活动1000档位的档线与预测线", "ycx 1000 177 jp:返回日服177号活动1000档位的档线与预测线"]
+        ),
         _config.tsugu_ycx_aliases,
         priority=2
     )).handle()
@@ -589,25 +829,27 @@ with namespace("tsugu") as tsugu_namespace:
         
         if server_name.available:
             try:
-                _server = server_name_to_id(server_name.result)
+                _server = await server_name_fuzzy_search(server_name.result)
             except ValueError:
-                try:
-                    _server = await server_name_fuzzy_search(server_name.result)
-                except ValueError:
-                    await ycx.finish("错误: 服务器名未能匹配任何服务器")
+                await ycx.finish("错误: 服务器名未能匹配任何服务器")
         else:
             _server = None
         
         await ycx.finish(await search_ycx(_get_platform(bot), event.get_user_id(), tier.result, _event_id, _server))
 
     @(ycx_all := _build(
-        Command("ycxall [event_id:int] [server_name:str]", "查询所有档位的预测线", meta=meta)
-        .usage(
-            f"查询所有档位的预测线，如果没有服务器名的话，服务器为用户的默认服务器。"
-            "如果没有活动ID的话，活动为当前活动\n可用档线:\n{tier_list_of_server_to_string()}"
-        ).alias("myycx"),
+        _command(
+            "ycxall [event_id:int] [server_name:str]",
+            "查询所有档位的预测线",
+            meta=meta,
+            usage=(
+                f"查询所有档位的预测线，如果没有服务器名的话，服务器为用户的默认服务器。"
+                "如果没有活动ID的话，活动为当前活动\n可用档线:\n{tier_list_of_server_to_string()}"
+            )
+        ),
         _config.tsugu_ycx_all_aliases,
-        block=True
+        block=True,
+        alias=["myycx"]
     )).handle()
     async def _(event_id: Match[int], server_name: Match[str], bot: Bot, event: Event) -> None:
         if event_id.available:
@@ -617,23 +859,25 @@ with namespace("tsugu") as tsugu_namespace:
         
         if server_name.available:
             try:
-                _server = server_name_to_id(server_name.result)
+                _server = await server_name_fuzzy_search(server_name.result)
             except ValueError:
-                try:
-                    _server = await server_name_fuzzy_search(server_name.result)
-                except ValueError:
-                    await ycx_all.finish("错误: 服务器名未能匹配任何服务器")
+                await ycx_all.finish("错误: 服务器名未能匹配任何服务器")
         else:
             _server = None
         
         await ycx_all.finish(await search_ycx_all(_get_platform(bot), event.get_user_id(), _server, _event_id))
 
     @(lsycx := _build(
-        Command("lsycx <tier:int> [event_id:int] [server_name:str]", "查询指定档位的预测线", meta=meta)
-        .usage(
-            "查询指定档位的预测线，与最近的4期活动类型相同的活动的档线数据，如果没有服务器名的话，服务器为用户的默认服务器。"
-            + f"如果没有活动ID的话，活动为当前活动\n可用档线:\n{tier_list_of_server_to_string()}"
-        ).example("lsycx 1000 :返回默认服务器当前活动的档线与预测线，与最近的4期活动类型相同的活动的档线数据").example("lsycx 1000 177 jp:返回日服177号活动1000档位档线与最近的4期活动类型相同的活动的档线数据"),
+        _command(
+            "lsycx <tier:int> [event_id:int] [server_name:str]",
+            "查询指定档位的预测线",
+            meta=meta,
+            usage=(
+                "查询指定档位的预测线，与最近的4期活动类型相同的活动的档线数据，如果没有服务器名的话，服务器为用户的默认服务器。"
+                + f"如果没有活动ID的话，活动为当前活动\n可用档线:\n{tier_list_of_server_to_string()}"
+            ),
+            examples=["lsycx 1000 :返回默认服务器当前活动的档线与预测线，与最近的4期活动类型相同的活动的档线数据", "lsycx 1000 177 jp:返回日服177号活动1000档位档线与最近的4期活动类型相同的活动的档线数据"]
+        ),
         _config.tsugu_lsycx_aliases
     )).handle()
     async def _(tier: Match[int], event_id: Match[int], server_name: Match[str], bot: Bot, event: Event) -> None:
@@ -644,21 +888,21 @@ with namespace("tsugu") as tsugu_namespace:
         
         if server_name.available:
             try:
-                _server = server_name_to_id(server_name.result)
+                _server = await server_name_fuzzy_search(server_name.result)
             except ValueError:
-                try:
-                    _server = await server_name_fuzzy_search(server_name.result)
-                except ValueError:
-                    await lsycx.finish("错误: 服务器名未能匹配任何服务器")
+                await lsycx.finish("错误: 服务器名未能匹配任何服务器")
         else:
             _server = None
         
         await lsycx.finish(await search_lsycx(_get_platform(bot), event.get_user_id(), tier.result, _event_id, _server))
 
     @(gacha_simulate := _build(
-        Command("抽卡模拟 [times:int] [gacha_id:int]", meta=meta)
-        .usage("模拟抽卡，如果没有卡池ID的话，卡池为当前活动的卡池")
-        .example("抽卡模拟:模拟抽卡10次").example("抽卡模拟 300 922 :模拟抽卡300次，卡池为922号卡池"),
+        _command(
+            "抽卡模拟 [times:int] [gacha_id:int]",
+            meta=meta,
+            usage="模拟抽卡，如果没有卡池ID的话，卡池为当前活动的卡池",
+            examples=["抽卡模拟:模拟抽卡10次", "抽卡模拟 300 922 :模拟抽卡300次，卡池为922号卡池"]
+        ),
         _config.tsugu_gacha_simulate_aliases
     )).handle()
     async def _(times: Match[int], gacha_id: Match[int], bot: Bot, event: Event) -> None:
@@ -674,6 +918,21 @@ with namespace("tsugu") as tsugu_namespace:
         
         await gacha_simulate.finish(await simulate_gacha(_get_platform(bot), event.get_user_id(), _times, _gacha_id))
 
+    @(tsugu_stats := _build(
+        _command(
+            "tsugu",
+            "查看插件的耗时与缓存统计",
+            Subcommand("stats"),
+            meta=CommandMeta(hide=True)
+        ),
+        set(),
+        permission=SUPERUSER
+    )).handle()
+    async def _(arp: Arparma) -> None:
+        if not arp.find("stats"):
+            await tsugu_stats.finish(tsugu_stats.command().get_help())
+        await tsugu_stats.finish(metrics.summary())
+
 # help 的内部实现，避免对其他 help 产生阻塞
 @(_help := on_alconna(
     Alconna("help", Args["query#输入命令名称查看帮助;/?", str, Field("-1")], meta=CommandMeta(description="显示命令帮助")),
@@ -700,3 +959,81 @@ async def _(arp: Arparma) -> None:
         return await _help.finish(msg)
     else:
         return await _help.skip()
+
+_help.rule = gated(_help.rule)
+
+@get_driver().on_startup
+async def _build_command_gate() -> None:
+    # 所有快捷指令与别名均在启动前注册完毕，此时构建前缀树
+    words: List[str] = []
+    patterns: List[str] = []
+    for command in (*command_manager.get_commands("tsugu"), _help.command()):
+        words.extend(command.aliases)
+        for key in command_manager.get_shortcut(command):
+            if re.escape(key) == key:
+                words.append(key)
+            else:
+                patterns.append(key)
+    # 不带前缀的快捷指令同样需要放行
+    command_gate.build((*_command_start, ""), words, patterns)
+
+metrics.names[car_forwarding] = "车牌转发"
+metrics.sources.update({
+    "user_cache": user_cache.stats,
+    "user_store": user_store.stats,
+    "response_cache": response_cache.stats,
+    "fuzzy_search_cache": fuzzy_search_cache.stats,
+    "cutoff_cache": cutoff_cache.stats,
+    "room_cache": room_cache.stats,
+    "room_render_cache": room_render_cache.stats,
+    "stale_cache": stale_cache.stats,
+    "render_flight": render_flight.stats,
+    "scheduler": scheduler.stats,
+    "command_gate": command_gate.stats,
+    "prerender": prerenderer.stats,
+    "transcoder": transcoder.stats,
+    "car_forwarding": lambda: dict(car_forwarding_counter),
+    "room_submit_queue": room_submit_queue.stats,
+    "process": process_stats,
+})
+
+# 命令开始时间在事件响应器状态中的键
+_METRICS_START = "_tsugu_metrics_start"
+# 命令中正在进行的 API 调用，键为调用参数的 id，值为 (阶段, 开始时间)
+_calling: Dict[int, Tuple[str, float]] = {}
+
+@run_preprocessor
+async def _(matcher: Matcher) -> None:
+    if metrics.command_of(matcher) is not None and metrics.sampled():
+        matcher.state[_METRICS_START] = perf_counter()
+
+@run_postprocessor
+async def _(matcher: Matcher, exception: Optional[Exception]) -> None:
+    start = matcher.state.pop(_METRICS_START, None)
+    if start is not None:
+        metrics.observe_stage("command", perf_counter() - start, exception is not None, metrics.command_of(matcher))
+
+@Bot.on_calling_api
+async def _(bot: Bot, api: str, data: Dict[str, Any]) -> None:
+    if metrics.current_command() is not None and metrics.sampled():
+        # 各适配器发送消息的 API 名称不同，大多包含 send 或 message
+        stage = "send" if "send" in api or "message" in api else "api"
+        _calling[id(data)] = (stage, perf_counter())
+
+@Bot.on_called_api
+async def _(bot: Bot, exception: Optional[Exception], api: str, data: Dict[str, Any], result: Any) -> None:
+    calling = _calling.pop(id(data), None)
+    if calling is not None:
+        metrics.observe_stage(calling[0], perf_counter() - calling[1], exception is not None)
+
+if _config.tsugu_metrics_path and isinstance(get_driver(), ASGIMixin):
+    async def _metrics_endpoint(request: Request) -> Response:
+        return Response(
+            200,
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+            content=metrics.render_prometheus()
+        )
+    
+    cast(ASGIMixin, get_driver()).setup_http_server(
+        HTTPServerSetup(URL(_config.tsugu_metrics_path), "GET", "tsugu_metrics", _metrics_endpoint)
+    )
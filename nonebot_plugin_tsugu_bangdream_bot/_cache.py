@@ -0,0 +1,499 @@
+'''插件内部使用的缓存实现'''
+
+import struct
+import asyncio
+import threading
+from pathlib import Path
+from hashlib import sha256
+from time import time, monotonic
+from collections import Counter, OrderedDict
+from typing import Dict, List, Tuple, Union, Generic, TypeVar, Hashable, Optional
+
+from nonebot import logger
+
+_K = TypeVar("_K", bound=Hashable)
+_V = TypeVar("_V")
+
+class TTLCache(Generic[_K, _V]):
+    '''带过期时间的 LRU 缓存
+
+    参数:
+        maxsize (int): 最大缓存条目数，`<= 0` 时关闭缓存
+        ttl (float): 缓存条目的存活时间（秒），`<= 0` 时关闭缓存
+    '''
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        '''最大缓存条目数'''
+        self.ttl = ttl
+        '''缓存条目的存活时间（秒）'''
+        self.hits = 0
+        '''命中次数'''
+        self.misses = 0
+        '''未命中次数'''
+        self._data: 'OrderedDict[_K, Tuple[float, _V]]' = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.ttl > 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: _K) -> Optional[_V]:
+        '''获取缓存内容，不存在或已过期时返回 `None`'''
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        expire, value = item
+        if expire <= monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: _K, value: _V) -> None:
+        '''写入缓存内容，超出容量时淘汰最久未使用的条目'''
+        if not self.enabled:
+            return
+
+        self._data[key] = (monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def peek(self, key: _K) -> Optional[_V]:
+        '''获取缓存内容，但不计入统计也不改变淘汰顺序'''
+        item = self._data.get(key)
+        if item is None or item[0] <= monotonic():
+            return None
+        return item[1]
+
+    def replace(self, key: _K, value: _V) -> bool:
+        '''仅在条目存在且未过期时替换其内容，不刷新过期时间'''
+        item = self._data.get(key)
+        if item is None or item[0] <= monotonic():
+            return False
+
+        self._data[key] = (item[0], value)
+        return True
+
+    def pop(self, key: _K) -> None:
+        '''移除缓存条目'''
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        '''清空缓存'''
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        '''获取缓存统计信息'''
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+class CadenceCache(Generic[_K, _V]):
+    '''按数据更新周期过期的 LRU 缓存
+
+    条目在下一个预期的数据更新时刻过期，而不是在写入后经过固定时间过期。
+    过期后的一段时间内仍会返回旧内容并标记为过期，由调用方在后台刷新。
+
+    参数:
+        maxsize (int): 最大缓存条目数，`<= 0` 时关闭缓存
+        interval (float): 数据更新周期（秒），以 UTC 零点对齐，`<= 0` 时关闭缓存
+        delay (float): 每个周期开始后数据实际可用的延迟（秒）
+        stale (float): 过期后仍可返回旧内容的时长（秒）
+    '''
+    def __init__(self, maxsize: int, interval: float, delay: float, stale: float) -> None:
+        self.maxsize = maxsize
+        '''最大缓存条目数'''
+        self.interval = interval
+        '''数据更新周期（秒）'''
+        self.delay = delay
+        '''每个周期开始后数据实际可用的延迟（秒）'''
+        self.stale = stale
+        '''过期后仍可返回旧内容的时长（秒）'''
+        self.hits = 0
+        '''命中次数'''
+        self.stale_hits = 0
+        '''返回过期内容的次数'''
+        self.misses = 0
+        '''未命中次数'''
+        self._data: 'OrderedDict[_K, Tuple[float, _V]]' = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.interval > 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def next_update(self, now: Optional[float]=None) -> float:
+        '''获取下一个预期的数据更新时刻（时间戳）'''
+        now = time() if now is None else now
+        return ((now - self.delay) // self.interval + 1) * self.interval + self.delay
+
+    def get(self, key: _K) -> Tuple[Optional[_V], bool]:
+        '''获取缓存内容
+
+        返回:
+            Tuple[Optional[_V], bool]: (缓存内容, 是否未过期)，不存在或超出可返回旧内容的时长时内容为 `None`
+        '''
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None, False
+
+        expire, value = item
+        now = time()
+        if expire > now:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value, True
+        if expire + self.stale > now:
+            self._data.move_to_end(key)
+            self.stale_hits += 1
+            return value, False
+
+        del self._data[key]
+        self.misses += 1
+        return None, False
+
+    def fresh(self, key: _K) -> bool:
+        '''判断条目是否存在且未过期，不计入统计也不改变淘汰顺序'''
+        item = self._data.get(key)
+        return item is not None and item[0] > time()
+
+    def set(self, key: _K, value: _V, final: bool=False) -> None:
+        '''写入缓存内容，`final` 为 `True` 时条目不会过期，仅在超出容量时被淘汰'''
+        if not self.enabled:
+            return
+
+        self._data[key] = (float("inf") if final else self.next_update(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        '''清空缓存'''
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        '''获取缓存统计信息'''
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+        }
+
+RenderedParts = Tuple[Tuple[str, Union[str, bytes]], ...]
+'''已解码的渲染结果，每项为 ("string", 文本) 或 ("image", 图片数据)'''
+
+def parts_size(parts: RenderedParts) -> int:
+    '''渲染结果的总字节数'''
+    return sum(len(value) for _, value in parts)
+
+# 磁盘缓存文件的格式：文件头后依次为各项的类型（1 字节）、长度（4 字节）与内容
+_PARTS_MAGIC = b"TSGRC1"
+_PART_HEADER = struct.Struct(">cI")
+
+def encode_parts(parts: RenderedParts) -> bytes:
+    '''将渲染结果编码为字节串'''
+    chunks: List[bytes] = [_PARTS_MAGIC]
+    for kind, value in parts:
+        if kind == "string":
+            data = value.encode() if isinstance(value, str) else value
+            chunks.append(_PART_HEADER.pack(b"s", len(data)))
+        else:
+            data = value if isinstance(value, bytes) else value.encode()
+            chunks.append(_PART_HEADER.pack(b"i", len(data)))
+        chunks.append(data)
+    return b"".join(chunks)
+
+def decode_parts(data: bytes) -> RenderedParts:
+    '''解码 `encode_parts` 编码的渲染结果，格式不正确时抛出 `ValueError`'''
+    if not data.startswith(_PARTS_MAGIC):
+        raise ValueError("Unknown response cache format")
+    parts: List[Tuple[str, Union[str, bytes]]] = []
+    view = memoryview(data)
+    offset = len(_PARTS_MAGIC)
+    while offset < len(data):
+        if offset + _PART_HEADER.size > len(data):
+            raise ValueError("Truncated response cache")
+        kind, length = _PART_HEADER.unpack_from(data, offset)
+        offset += _PART_HEADER.size
+        if offset + length > len(data):
+            raise ValueError("Truncated response cache")
+        chunk = bytes(view[offset:offset + length])
+        offset += length
+        if kind == b"s":
+            parts.append(("string", chunk.decode()))
+        elif kind == b"i":
+            parts.append(("image", chunk))
+        else:
+            raise ValueError(f"Unknown response cache part type: {kind!r}")
+    return tuple(parts)
+
+class ResponseCache:
+    '''按字节数限制容量的渲染结果 LRU 缓存，可选地持久化到磁盘
+
+    参数:
+        maxbytes (int): 内存中缓存的最大字节数，`<= 0` 时关闭缓存
+        ttl (float): 缓存条目的存活时间（秒），`<= 0` 时关闭缓存
+        directory (Optional[Path]): 磁盘缓存目录，为 `None` 时不使用磁盘缓存
+        disk_maxbytes (int): 磁盘缓存的最大字节数
+    '''
+    def __init__(self, maxbytes: int, ttl: float, directory: Optional[Path]=None, disk_maxbytes: int=0) -> None:
+        self.maxbytes = maxbytes
+        '''内存中缓存的最大字节数'''
+        self.ttl = ttl
+        '''缓存条目的存活时间（秒）'''
+        self.directory = directory
+        '''磁盘缓存目录'''
+        self.disk_maxbytes = disk_maxbytes
+        '''磁盘缓存的最大字节数'''
+        self.hits = 0
+        '''内存命中次数'''
+        self.disk_hits = 0
+        '''磁盘命中次数'''
+        self.misses = 0
+        '''未命中次数'''
+        self._size = 0
+        self._data: 'OrderedDict[Hashable, Tuple[float, int, RenderedParts]]' = OrderedDict()
+        self._disk_size = 0
+        self._disk_files: 'Optional[OrderedDict[Path, int]]' = None
+        # 磁盘读写在线程池中进行，文件索引的修改需要加锁
+        self._disk_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxbytes > 0 and self.ttl > 0
+
+    def _path(self, key: Hashable) -> Path:
+        assert self.directory is not None
+        return self.directory / f"{sha256(repr(key).encode()).hexdigest()}.bin"
+
+    def _index_disk(self) -> 'OrderedDict[Path, int]':
+        # 仅在首次访问时扫描一次目录，之后在内存中维护各文件的大小，按写入顺序排列
+        if self._disk_files is None:
+            assert self.directory is not None
+            files = []
+            for path in self.directory.glob("*.bin"):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, path, stat.st_size))
+            files.sort()
+            self._disk_files = OrderedDict((path, size) for _, path, size in files)
+            self._disk_size = sum(self._disk_files.values())
+        return self._disk_files
+
+    def _forget_disk(self, path: Path) -> None:
+        with self._disk_lock:
+            if self._disk_files is not None:
+                self._disk_size -= self._disk_files.pop(path, 0)
+
+    def _store(self, key: Hashable, expire: float, parts: RenderedParts) -> None:
+        size = parts_size(parts)
+        if size > self.maxbytes:
+            return
+
+        self.pop(key)
+        self._data[key] = (expire, size, parts)
+        self._size += size
+        while self._size > self.maxbytes:
+            _, (_, _size, _) = self._data.popitem(last=False)
+            self._size -= _size
+
+    def _read_disk(self, path: Path) -> Optional[RenderedParts]:
+        try:
+            if time() - path.stat().st_mtime > self.ttl:
+                path.unlink()
+                self._forget_disk(path)
+                return None
+            return decode_parts(path.read_bytes())
+        except FileNotFoundError:
+            self._forget_disk(path)
+            return None
+        except Exception as exception:
+            logger.debug(f"Failed to read response cache '{path}': {repr(exception)}")
+            return None
+
+    def _write_disk(self, path: Path, parts: RenderedParts) -> None:
+        data = encode_parts(parts)
+        if len(data) > self.disk_maxbytes:
+            return
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+            temp.write_bytes(data)
+            temp.replace(path)
+
+            # 超出磁盘容量时淘汰最早写入的缓存文件
+            evicted: List[Path] = []
+            with self._disk_lock:
+                files = self._index_disk()
+                self._disk_size -= files.pop(path, 0)
+                files[path] = len(data)
+                self._disk_size += len(data)
+                while self._disk_size > self.disk_maxbytes:
+                    _path, size = files.popitem(last=False)
+                    self._disk_size -= size
+                    evicted.append(_path)
+            for _path in evicted:
+                _path.unlink(missing_ok=True)
+        except Exception as exception:
+            logger.debug(f"Failed to write response cache '{path}': {repr(exception)}")
+
+    async def get(self, key: Hashable) -> Optional[RenderedParts]:
+        '''获取缓存的渲染结果，内存未命中时尝试读取磁盘缓存'''
+        if not self.enabled:
+            return None
+
+        item = self._data.get(key)
+        if item is not None:
+            if item[0] > monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[2]
+            self.pop(key)
+
+        if self.directory is not None:
+            loop = asyncio.get_running_loop()
+            parts = await loop.run_in_executor(None, self._read_disk, self._path(key))
+            if parts is not None:
+                self._store(key, monotonic() + self.ttl, parts)
+                self.disk_hits += 1
+                return parts
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: Hashable, parts: RenderedParts) -> None:
+        '''写入渲染结果'''
+        if not self.enabled:
+            return
+
+        self._store(key, monotonic() + self.ttl, parts)
+        if self.directory is not None and self.disk_maxbytes > 0:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._write_disk, self._path(key), parts)
+
+    def pop(self, key: Hashable) -> None:
+        '''移除内存中的缓存条目'''
+        item = self._data.pop(key, None)
+        if item is not None:
+            self._size -= item[1]
+
+    def clear(self) -> None:
+        '''清空内存中的缓存'''
+        self._data.clear()
+        self._size = 0
+
+    def stats(self) -> Dict[str, int]:
+        '''获取缓存统计信息'''
+        return {
+            "size": len(self._data),
+            "bytes": self._size,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "disk_bytes": self._disk_size,
+            "misses": self.misses,
+        }
+
+class StaleCache:
+    '''按字节数限制容量的最近一次成功渲染结果 LRU 缓存，用于后端不可用时的降级返回
+
+    条目不会过期，由调用方按命令类别决定可以返回多旧的结果。键的第一项为命令类别。
+    与其他缓存保存的是同一份渲染结果，不额外占用图片内存。
+
+    参数:
+        maxbytes (int): 最大字节数，`<= 0` 时关闭缓存
+        max_age (float): 未单独配置的命令类别可返回的最长时间（秒），`<= 0` 时不返回
+        budget (float): 请求超过多久（秒）仍未完成时先返回旧结果，`<= 0` 时只在请求失败后返回
+    '''
+    def __init__(self, maxbytes: int, max_age: float, budget: float=0) -> None:
+        self.maxbytes = maxbytes
+        '''最大字节数'''
+        self.max_age = max_age
+        '''未单独配置的命令类别可返回的最长时间（秒）'''
+        self.max_ages: Dict[str, float] = {}
+        '''各命令类别可返回的最长时间（秒）'''
+        self.budget = budget
+        '''请求超过多久（秒）仍未完成时先返回旧结果'''
+        self.served: 'Counter[str]' = Counter()
+        '''各命令类别返回旧结果的次数'''
+        self.slow: 'Counter[str]' = Counter()
+        '''各命令类别因超出延迟预算而返回旧结果的次数'''
+        self.unavailable: 'Counter[str]' = Counter()
+        '''各命令类别请求失败且没有可用旧结果的次数'''
+        self._size = 0
+        self._data: 'OrderedDict[Tuple[Hashable, ...], Tuple[float, int, RenderedParts]]' = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxbytes > 0
+
+    def max_age_of(self, family: str) -> float:
+        '''获取命令类别可返回的最长时间（秒），`<= 0` 时不返回旧结果'''
+        return self.max_ages.get(family, self.max_age) if self.enabled else 0
+
+    def set(self, key: Tuple[Hashable, ...], parts: RenderedParts) -> None:
+        '''记录成功的渲染结果'''
+        if self.max_age_of(str(key[0])) <= 0:
+            return
+        size = parts_size(parts)
+        if size > self.maxbytes:
+            return
+
+        self.pop(key)
+        self._data[key] = (time(), size, parts)
+        self._size += size
+        while self._size > self.maxbytes:
+            _, (_, _size, _) = self._data.popitem(last=False)
+            self._size -= _size
+
+    def get(self, key: Tuple[Hashable, ...]) -> Optional[Tuple[RenderedParts, float]]:
+        '''获取 (渲染结果, 已过去的时间)，不存在或超出该命令类别可返回的最长时间时返回 `None`'''
+        item = self._data.get(key)
+        if item is None:
+            return None
+        age = time() - item[0]
+        if age > self.max_age_of(str(key[0])):
+            self.pop(key)
+            return None
+        self._data.move_to_end(key)
+        return item[2], age
+
+    def pop(self, key: Tuple[Hashable, ...]) -> None:
+        '''移除缓存条目'''
+        item = self._data.pop(key, None)
+        if item is not None:
+            self._size -= item[1]
+
+    def clear(self) -> None:
+        '''清空缓存'''
+        self._data.clear()
+        self._size = 0
+
+    def stats(self) -> Dict[str, Union[int, Dict[str, int]]]:
+        '''获取缓存统计信息，各命令类别的计数以嵌套字典给出'''
+        stats: Dict[str, Union[int, Dict[str, int]]] = {
+            "size": len(self._data),
+            "bytes": self._size,
+        }
+        for family in sorted({*self.served, *self.slow, *self.unavailable}):
+            stats[family] = {
+                "served": self.served[family],
+                "slow": self.slow[family],
+                "unavailable": self.unavailable[family],
+            }
+        return stats
@@ -1,8 +1,10 @@
 '''`tsugu_api` HTTP 客户端的 `nonebot` 驱动实现'''
 
 import asyncio
-from json import dumps
-from typing_extensions import cast
+from random import uniform
+from time import monotonic
+from collections import Counter, deque
+from urllib.parse import urlsplit
 
 from nonebot import get_driver
 from nonebot.drivers import HTTPClientMixin, HTTPClientSession
@@ -12,19 +14,408 @@ driver = get_driver()
 if not isinstance(driver, HTTPClientMixin):
     raise ImportError("Current driver does not support HTTPClient")
 
-from typing import Any
+from typing import Any, Dict, List, Tuple, Deque, Optional, Sequence
 from typing_extensions import override
 
 from nonebot import logger
 from nonebot.drivers import Request as NonebotRequest
+from nonebot.drivers import Response as NonebotResponse
 
 from tsugu_api_async import settings
 from tsugu_api_core.client import Client as _Client
 from tsugu_api_core.client import Request, Response
 
+from ._json import json_codec
+
+class ClientSettings:
+    '''客户端配置'''
+    
+    max_connections: int = 10
+    '''每个后端的最大并发连接数，`<= 0` 时不限制'''
+    
+    idle_timeout: float = 60
+    '''连接池空闲超时时间（秒），超时后将在下次请求时重建会话'''
+    
+    backoff_base: float = 0.5
+    '''重试退避的基础时间（秒），每次重试翻倍'''
+    
+    backoff_max: float = 8
+    '''重试退避的最长时间（秒）'''
+    
+    retry_budget_ratio: float = 0.2
+    '''全局重试预算，每个请求可为重试积累的额度'''
+    
+    retry_budget_burst: float = 10
+    '''全局重试预算的最大额度，即允许突发的重试次数'''
+    
+    breaker_threshold: int = 5
+    '''熔断器在连续失败多少次后打开，`<= 0` 时关闭熔断'''
+    
+    breaker_reset_timeout: float = 30
+    '''熔断器打开后多久（秒）进入半开状态进行探测'''
+    
+    health_check_interval: float = 30
+    '''配置了多个后端地址时，对近期没有请求的地址进行健康检查的间隔（秒），`<= 0` 时不检查'''
+    
+    hedge: bool = False
+    '''配置了多个后端地址时，是否在请求超过首选地址的 p95 延迟后向次选地址发送对冲请求'''
+    
+    hedge_min_delay: float = 0.05
+    '''对冲请求的最短等待时间（秒）'''
+
+client_settings = ClientSettings()
+
+# 客户端各类事件的统计计数
+client_counter: 'Counter[str]' = Counter()
+
+# 修改数据的接口，请求可能已被后端处理，仅在连接失败时重试
+_NON_IDEMPOTENT_APIS = (
+    "/user/changeUserData",
+    "/user/bindPlayerRequest",
+    "/user/bindPlayerVerification",
+    "/station/submitRoomNumber",
+)
+
+# 通常由网关或后端过载产生、可以重试的状态码
+_RETRYABLE_STATUS = (502, 503, 504)
+
+# 建立连接失败、请求必定未发出的异常类名，按类名匹配以免导入驱动未使用的库
+_CONNECT_EXCEPTIONS = (
+    "ConnectError", # httpx
+    "ConnectTimeout", # httpx
+    "ClientConnectorError", # aiohttp
+)
+
+def _classify_exception(exception: Exception) -> str:
+    '''将请求异常分类为 `connect`、`timeout` 或 `other`
+
+    只有确定请求未发出的失败才视为 `connect`。连接被重置、对端断开等异常可能发生在请求已被后端接收之后，
+    视为 `other`，不对修改数据的接口重试。
+    '''
+    if isinstance(exception, ConnectionRefusedError) or any(
+        cls.__name__ in _CONNECT_EXCEPTIONS for cls in type(exception).__mro__
+    ):
+        return "connect"
+    if isinstance(exception, (asyncio.TimeoutError, TimeoutError)) or "timeout" in type(exception).__name__.lower():
+        return "timeout"
+    return "other"
+
+class CircuitOpenError(RuntimeError):
+    '''熔断器打开时快速失败的异常'''
+
+class _RetryBudget:
+    '''全局重试预算，限制重试请求在总请求中的占比'''
+    
+    def __init__(self) -> None:
+        self.tokens = client_settings.retry_budget_burst
+    
+    def deposit(self) -> None:
+        self.tokens = min(client_settings.retry_budget_burst, self.tokens + client_settings.retry_budget_ratio)
+    
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+retry_budget = _RetryBudget()
+
+class CircuitBreaker:
+    '''单个后端的熔断器'''
+    
+    def __init__(self, backend: str) -> None:
+        self.backend = backend
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+    
+    def _transition(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger.debug(f"Circuit breaker of {self.backend} changed from {self.state} to {state}")
+        client_counter[f"breaker_{state}"] += 1
+        self.state = state
+    
+    def check(self) -> None:
+        '''检查是否允许发送请求，不允许时抛出 `CircuitOpenError`'''
+        if self.state == "closed":
+            return
+        if self.state == "open":
+            if monotonic() - self._opened_at < client_settings.breaker_reset_timeout:
+                client_counter["rejected_by_breaker"] += 1
+                raise CircuitOpenError(f"后端 {self.backend} 暂时不可用，请稍后再试")
+            self._transition("half_open")
+        # 半开状态下同时只允许一个探测请求
+        if self._probing:
+            client_counter["rejected_by_breaker"] += 1
+            raise CircuitOpenError(f"后端 {self.backend} 暂时不可用，请稍后再试")
+        self._probing = True
+    
+    def record_success(self) -> None:
+        self.failures = 0
+        self._probing = False
+        self._transition("closed")
+    
+    def abort(self) -> None:
+        '''请求被取消，不计入成功或失败'''
+        self._probing = False
+    
+    def available(self) -> bool:
+        '''是否可能允许请求，不改变状态'''
+        return self.state != "open" or monotonic() - self._opened_at >= client_settings.breaker_reset_timeout
+    
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if client_settings.breaker_threshold <= 0:
+            return
+        if self.state == "half_open" or self.failures >= client_settings.breaker_threshold:
+            self._opened_at = monotonic()
+            self._transition("open")
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+def breaker_states() -> Dict[str, str]:
+    '''获取各后端熔断器的当前状态'''
+    return {backend: breaker.state for backend, breaker in _breakers.items()}
+
+# 延迟与错误率的指数加权平均系数
+_EWMA_ALPHA = 0.2
+
+class Endpoint:
+    '''后端的单个地址，记录请求延迟与错误率的指数加权平均'''
+    
+    def __init__(self, url: str, proxy: bool) -> None:
+        self.url = url.rstrip("/")
+        _url = urlsplit(self.url)
+        self.backend = f"{_url.scheme}://{_url.netloc}"
+        self.proxy = proxy
+        '''是否通过代理服务器访问'''
+        self.latency: Optional[float] = None
+        '''延迟（秒）的指数加权平均，尚无成功请求时为 `None`'''
+        self.error_rate = 0.0
+        '''错误率的指数加权平均'''
+        self.requests = 0
+        self.failures = 0
+        self.last_observed = 0.0
+        self._samples: Deque[float] = deque(maxlen=128)
+    
+    def observe(self, latency: Optional[float]) -> None:
+        '''记录一次请求的结果，`latency` 为 `None` 时为失败'''
+        self.requests += 1
+        self.last_observed = monotonic()
+        if latency is None:
+            self.failures += 1
+            self.error_rate += _EWMA_ALPHA * (1 - self.error_rate)
+            return
+        self.error_rate -= _EWMA_ALPHA * self.error_rate
+        self.latency = latency if self.latency is None else self.latency + _EWMA_ALPHA * (latency - self.latency)
+        self._samples.append(latency)
+    
+    @property
+    def healthy(self) -> bool:
+        breaker = _breakers.get(self.backend)
+        return self.error_rate < 0.5 and (breaker is None or breaker.available())
+    
+    def p95(self) -> Optional[float]:
+        '''最近成功请求延迟的 p95（秒），样本不足时为 `None`'''
+        if len(self._samples) < 20:
+            return None
+        samples = sorted(self._samples)
+        return samples[int(len(samples) * 0.95)]
+    
+    def score(self) -> float:
+        if self.latency is None:
+            # 尚未请求过的地址优先，以便尽快获得其延迟；只失败过的地址排在有成功请求的地址之后
+            return 0.0 if self.failures == 0 else float("inf")
+        return self.latency / (1 - min(self.error_rate, 0.99))
+
+class BackendRouter:
+    '''在同一后端的多个地址间按健康状况与延迟选择'''
+    
+    def __init__(self) -> None:
+        self.groups: Dict[str, List[Endpoint]] = {}
+        '''以首个地址为键的地址列表'''
+        self._task: Optional['asyncio.Task[None]'] = None
+    
+    def add(self, urls: Sequence[str], proxy: bool) -> str:
+        '''添加同一后端的多个地址，返回作为 `tsugu_api` 请求地址的首个地址'''
+        primary = urls[0].rstrip("/")
+        endpoints = self.groups.setdefault(primary, [])
+        known = {endpoint.url for endpoint in endpoints}
+        for url in urls:
+            if url.rstrip("/") not in known:
+                endpoints.append(Endpoint(url, proxy))
+                known.add(url.rstrip("/"))
+        return primary
+    
+    def route(self, url: str) -> List[Tuple[Optional[Endpoint], str]]:
+        '''获取请求可用的 (地址, 请求 URL) 列表，按优先程度排序，不属于任何后端时地址为 `None`'''
+        for primary, endpoints in self.groups.items():
+            # 首个地址之后必须是路径或查询参数，避免 `http://a:3000` 匹配到 `http://a:30001`
+            if len(endpoints) > 1 and url.startswith(primary) and url[len(primary):len(primary) + 1] in ("", "/", "?"):
+                path = url[len(primary):]
+                ordered = sorted(endpoints, key=lambda endpoint: (not endpoint.healthy, endpoint.score()))
+                return [(endpoint, endpoint.url + path) for endpoint in ordered]
+        return [(None, url)]
+    
+    async def check(self) -> None:
+        '''检查近期没有请求的地址，任何非 5xx 响应都视为可用'''
+        interval = client_settings.health_check_interval
+        endpoints = [
+            endpoint for endpoints in self.groups.values() if len(endpoints) > 1
+            for endpoint in endpoints if monotonic() - endpoint.last_observed >= interval
+        ]
+        
+        async def _check(endpoint: Endpoint) -> None:
+            pool = _get_pool(endpoint.backend, settings.proxy if endpoint.proxy and settings.proxy else None)
+            start = monotonic()
+            try:
+                session = await pool.acquire()
+                try:
+                    response = await session.request(NonebotRequest("GET", endpoint.url + "/"))
+                finally:
+                    pool.release()
+            except Exception as exception:
+                logger.debug(f"Health check of {endpoint.url} failed: {repr(exception)}")
+                endpoint.observe(None)
+                return
+            endpoint.observe(monotonic() - start if response.status_code < 500 else None)
+        
+        await asyncio.gather(*(_check(endpoint) for endpoint in endpoints))
+    
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(client_settings.health_check_interval)
+            try:
+                await self.check()
+            except Exception as exception:
+                logger.warning(f"Failed to check backend health: {repr(exception)}")
+    
+    async def start(self) -> None:
+        '''启动后台健康检查，只有一个地址时不检查'''
+        if (
+            client_settings.health_check_interval > 0 and self._task is None
+            and any(len(endpoints) > 1 for endpoints in self.groups.values())
+        ):
+            self._task = asyncio.ensure_future(self._run())
+    
+    async def stop(self) -> None:
+        '''停止后台健康检查'''
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+    
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        '''获取各地址的统计信息'''
+        return {
+            endpoint.url: {
+                "healthy": int(endpoint.healthy),
+                "latency": round(endpoint.latency, 4) if endpoint.latency is not None else -1,
+                "error_rate": round(endpoint.error_rate, 4),
+                "requests": endpoint.requests,
+                "failures": endpoint.failures,
+            }
+            for endpoints in self.groups.values() if len(endpoints) > 1
+            for endpoint in endpoints
+        }
+
+backend_router = BackendRouter()
+
+class _Pool:
+    '''单个后端的长连接会话池'''
+    
+    def __init__(self, proxy: Optional[str]) -> None:
+        self.proxy = proxy
+        self.session: Optional[HTTPClientSession] = None
+        self.last_used = monotonic()
+        self._lock = asyncio.Lock()
+        self._semaphore = (
+            asyncio.Semaphore(client_settings.max_connections)
+            if client_settings.max_connections > 0 else None
+        )
+    
+    async def acquire(self) -> HTTPClientSession:
+        if self._semaphore is not None:
+            await self._semaphore.acquire()
+        try:
+            async with self._lock:
+                if self.session is not None and monotonic() - self.last_used > client_settings.idle_timeout:
+                    # 空闲过久的连接大概率已被对端关闭，直接重建会话
+                    await self._close()
+                if self.session is None:
+                    session = driver.get_session(timeout=settings.timeout, proxy=self.proxy)
+                    await session.setup()
+                    self.session = session
+                self.last_used = monotonic()
+                return self.session
+        except BaseException:
+            self.release()
+            raise
+    
+    def release(self) -> None:
+        self.last_used = monotonic()
+        if self._semaphore is not None:
+            self._semaphore.release()
+    
+    async def _close(self) -> None:
+        session, self.session = self.session, None
+        if session is not None:
+            try:
+                await session.close()
+            except Exception as exception:
+                logger.debug(f"Failed to close session: {repr(exception)}")
+    
+    async def close(self) -> None:
+        async with self._lock:
+            await self._close()
+
+# 以 (后端地址, 代理) 为键的会话池
+_pools: Dict[Tuple[str, Optional[str]], _Pool] = {}
+
+def _get_pool(backend: str, proxy: Optional[str]) -> _Pool:
+    key = (backend, proxy)
+    if (pool := _pools.get(key)) is None:
+        pool = _pools[key] = _Pool(proxy)
+    return pool
+
+def _get_breaker(backend: str) -> CircuitBreaker:
+    if (breaker := _breakers.get(backend)) is None:
+        breaker = _breakers[backend] = CircuitBreaker(backend)
+    return breaker
+
+@driver.on_startup
+async def _warm_up_pools() -> None:
+    # 首个会话的创建需要加载 TLS 证书等，提前在启动时完成，避免由第一个命令承担
+    backends = {
+        (f"{_url.scheme}://{_url.netloc}", settings.proxy if use_proxy and settings.proxy else None)
+        for _url, use_proxy in (
+            (urlsplit(settings.backend_url), settings.backend_proxy),
+            (urlsplit(settings.userdata_backend_url), settings.userdata_backend_proxy),
+            *(
+                (urlsplit(endpoint.url), endpoint.proxy)
+                for endpoints in backend_router.groups.values() for endpoint in endpoints
+            ),
+        )
+    }
+    for backend, proxy in backends:
+        pool = _get_pool(backend, proxy)
+        try:
+            await pool.acquire()
+        except Exception as exception:
+            logger.debug(f"Failed to warm up session for {backend}: {repr(exception)}")
+            continue
+        pool.release()
+
+@driver.on_shutdown
+async def _close_pools() -> None:
+    pools = list(_pools.values())
+    _pools.clear()
+    await asyncio.gather(*(pool.close() for pool in pools))
+
 class Client(_Client):
     _client: HTTPClientMixin = driver
-    _session: HTTPClientSession
     
     @override
     def __enter__(self) -> 'Client':
@@ -32,11 +423,7 @@ class Client(_Client):
     
     @override
     async def __aenter__(self) -> 'Client':
-        self._session = self._client.get_session(
-            timeout=settings.timeout,
-            proxy=settings.proxy if self.proxy and settings.proxy else None,
-        )
-        await self._session.__aenter__()
+        # 会话由连接池统一管理，在请求时获取
         return self
     
     @override
@@ -45,41 +432,155 @@ class Client(_Client):
     
     @override
     async def __aexit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
-        await self._session.__aexit__(exc_type, exc_value, traceback)
+        pass
     
     @override
     def request(self, request: Request) -> Response:
         raise RuntimeError("Nonebot does not support sync request, use async method instead")
     
+    async def _send(self, endpoint: Optional[Endpoint], url: str, request: Request, body: Optional[bytes]) -> NonebotResponse:
+        _url = urlsplit(url)
+        backend = f"{_url.scheme}://{_url.netloc}"
+        pool = _get_pool(backend, settings.proxy if self.proxy and settings.proxy else None)
+        breaker = _get_breaker(backend)
+        breaker.check()
+        
+        start = monotonic()
+        try:
+            session = await pool.acquire()
+            try:
+                response = await session.request(NonebotRequest(
+                    request.method,
+                    url,
+                    params=request.params,
+                    content=body,
+                    headers=request.headers,
+                ))
+            finally:
+                pool.release()
+        except asyncio.CancelledError:
+            breaker.abort()
+            raise
+        except Exception:
+            breaker.record_failure()
+            if endpoint is not None:
+                endpoint.observe(None)
+            raise
+        
+        if response.status_code in _RETRYABLE_STATUS:
+            breaker.record_failure()
+            if endpoint is not None:
+                endpoint.observe(None)
+        else:
+            # 其余 4xx 与 5xx 为后端的业务响应，不视为失败
+            breaker.record_success()
+            if endpoint is not None:
+                endpoint.observe(monotonic() - start)
+        return response
+    
+    async def _hedged(self, routes: List[Tuple[Optional[Endpoint], str]], request: Request, body: Optional[bytes]) -> NonebotResponse:
+        # 首选地址超过其 p95 延迟仍未响应时向次选地址发送相同请求，采用先成功的响应
+        primary, secondary = routes[0], routes[1]
+        delay = primary[0].p95() if primary[0] is not None else None
+        if delay is None or secondary[0] is None or not secondary[0].healthy:
+            return await self._send(*primary, request, body)
+        
+        tasks = [asyncio.ensure_future(self._send(*primary, request, body))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=max(delay, client_settings.hedge_min_delay))
+            if not done:
+                client_counter["hedged"] += 1
+                tasks.append(asyncio.ensure_future(self._send(*secondary, request, body)))
+                pending = set(tasks)
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None and task.result().status_code not in _RETRYABLE_STATUS:
+                            if task is not tasks[0]:
+                                client_counter["hedge_wins"] += 1
+                            return task.result()
+            # 均失败时以首选地址的结果为准
+            return tasks[0].result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
     @override
     async def arequest(self, request: Request) -> Response:
-        _request = NonebotRequest(
-            request.method,
-            request.url,
-            params=request.params,
-            data=cast(dict, dumps(request.data)) if request.data else None,
-            headers=request.headers,
-        )
-
+        idempotent = not urlsplit(request.url).path.endswith(_NON_IDEMPOTENT_APIS)
+        # 请求体只编码一次，重试与对冲请求共用
+        body = json_codec.dumps(request.data) if request.data else None
+        
+        client_counter["requests"] += 1
+        retry_budget.deposit()
+        
         retries = 0
         while True:
+            # 每次重试重新选择地址，失败的地址错误率上升后将排在后面
+            routes = backend_router.route(request.url)
+            
+            exception: Optional[Exception] = None
             try:
-                _response = await self._client.request(_request)
-                break
+                if client_settings.hedge and idempotent and len(routes) > 1:
+                    _response = await self._hedged(routes, request, body)
+                else:
+                    _response = await self._send(*routes[0], request, body)
+            except CircuitOpenError:
+                raise
             except Exception as e:
-                if retries >= settings.max_retries:
-                    raise e
-                retries += 1
-                logger.debug(f"Request failed: {repr(e)}, retrying for the {retries}/{settings.max_retries} time...")
-                await asyncio.sleep(1)
+                exception = e
+            
+            if exception is not None:
+                failure = _classify_exception(exception)
+            elif _response.status_code in _RETRYABLE_STATUS:
+                failure = "5xx"
+            else:
+                break
+            
+            client_counter[f"failure_{failure}"] += 1
+            
+            # 连接失败时请求未发出，总是可以重试；其余失败仅重试幂等请求
+            if retries >= settings.max_retries or not (idempotent or failure == "connect"):
+                client_counter["retries_exhausted"] += 1
+                if exception is not None:
+                    raise exception
+                break
+            if not retry_budget.withdraw():
+                client_counter["retry_budget_exhausted"] += 1
+                if exception is not None:
+                    raise exception
+                break
+            
+            retries += 1
+            client_counter["retries"] += 1
+            delay = uniform(0, min(client_settings.backoff_max, client_settings.backoff_base * 2 ** (retries - 1)))
+            logger.debug(
+                f"Request failed ({failure}): {repr(exception) if exception is not None else _response.status_code}, "
+                f"retrying for the {retries}/{settings.max_retries} time in {delay:.2f}s..."
+            )
+            await asyncio.sleep(delay)
         
         if _response.content is None:
             raise RuntimeError("Response content is None")
         
-        return Response(
-            (
-                _response.content if isinstance(_response.content, bytes)
-                else _response.content # type: ignore
-            ),
-            _response.status_code,
-        )
\ No newline at end of file
+        content = _response.content if isinstance(_response.content, bytes) else _response.content.encode() # type: ignore
+        try:
+            data = await json_codec.aloads(content)
+        except ValueError:
+            # 非 JSON 的响应（如网关错误页）交由 `tsugu_api` 处理
+            return Response(content, _response.status_code)
+        return _ParsedResponse(content, _response.status_code, data)
+
+class _ParsedResponse(Response):
+    '''已解析 JSON 的响应，`tsugu_api` 调用 `json` 时不再在事件循环中重复解析'''
+    
+    def __init__(self, content: bytes, status_code: int, data: Any) -> None:
+        super().__init__(content, status_code)
+        self._data = data
+    
+    @override
+    def json(self, **kwargs: Any) -> Any:
+        if kwargs:
+            return super().json(**kwargs)
+        return self._data
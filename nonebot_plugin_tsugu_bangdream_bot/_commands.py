@@ -1,5 +1,9 @@
+import asyncio
+from time import time
 from base64 import b64decode
-from typing import TYPE_CHECKING, List, Type, Union, Optional
+from contextlib import asynccontextmanager
+from collections import Counter
+from typing import TYPE_CHECKING, Any, Set, Dict, List, Type, Tuple, Union, Callable, Optional, Awaitable, AsyncIterator, cast
 
 from nonebot import logger
 
@@ -14,28 +18,270 @@ if TYPE_CHECKING:
         _Response,
         ServerId,
         _TsuguUser,
+        StationRoom,
         _DifficultyId,
         _UserPlayerInList,
+        PartialTsuguUser,
         FuzzySearchResult
     )
 
 from .config import CAR, FAKE
 
-from ._utils import server_id_to_full_name
+from ._cache import TTLCache, StaleCache, CadenceCache, RenderedParts, ResponseCache, parts_size
+from ._flight import SingleFlight, gather
+from ._keyword import RoomKeywordMatcher
+from ._master import master_index
+from ._queue import SubmitQueue
+from ._metrics import metrics
+from ._scheduler import scheduler
+from ._transcode import transcoder
+from ._userstore import user_store
+from ._utils import TIER_LISTS, server_name_to_id, difficulty_name_to_id, server_id_to_full_name, server_id_to_short_name
 
-def _list_to_message(response: '_Response') -> UniMessage:
+# 用户数据缓存，键为 (platform, user_id)
+user_cache: 'TTLCache[Tuple[str, str], _TsuguUser]' = TTLCache(1024, 300)
+
+# 用户数据请求的合并，前台读取与后台刷新共享
+user_flight: 'SingleFlight[_TsuguUser]' = SingleFlight()
+
+# 不随时间变化的查询（卡面、谱面、卡池与按 ID 的查卡、查曲）的渲染结果缓存
+response_cache = ResponseCache(64 * 1024 * 1024, 21600)
+
+# 本地别名表未命中时的远程模糊搜索结果缓存
+fuzzy_search_cache: 'TTLCache[str, FuzzySearchResult]' = TTLCache(256, 3600)
+
+# 最近一次成功的渲染结果，后端失败或超出延迟预算时降级返回，键的第一项为命令类别，默认关闭
+stale_cache = StaleCache(0, 86400)
+# 车牌列表随时变化，旧结果没有意义
+stale_cache.max_ages["room_list"] = 0
+
+# 渲染请求的合并，结果为已解码的渲染结果
+render_flight: 'SingleFlight[RenderedParts]' = SingleFlight()
+
+# 档线预测的渲染结果缓存，在下一次预期的数据更新时过期，过期后短时间内先返回旧结果并在后台刷新
+cutoff_cache: 'CadenceCache[Tuple[Any, ...], RenderedParts]' = CadenceCache(256, 1800, 120, 600)
+
+class CutoffDemand(Dict[Tuple['ServerId', Optional[int]], float]):
+    '''当前活动档线预测的最近请求时间，键为 (server, tier)，tier 为 `None` 时为全部档线，用于决定预渲染的内容
+
+    档位由用户输入，只在预渲染开启时记录该服务器常用的档位，过期的记录由预渲染清理。
+    '''
+    def __init__(self) -> None:
+        super().__init__()
+        self.enabled = False
+        '''是否记录请求'''
+
+    def record(self, server: 'ServerId', tier: Optional[int]) -> None:
+        '''记录一次请求'''
+        if not self.enabled:
+            return
+        if tier is not None and tier not in TIER_LISTS.get(server_id_to_short_name(server), ()):
+            return
+        self[(server, tier)] = time()
+
+cutoff_demand = CutoffDemand()
+
+# 车站房间列表的短时缓存与请求合并，所有 ycm 共享同一份列表
+room_cache: 'TTLCache[str, List[StationRoom]]' = TTLCache(1, 5)
+room_flight: 'SingleFlight[List[StationRoom]]' = SingleFlight()
+
+# 车牌列表的渲染结果缓存，键为过滤后的房间，有效时间与房间列表缓存一致
+room_render_cache: 'TTLCache[Tuple[Any, ...], RenderedParts]' = TTLCache(64, 5)
+
+def _decode_response(response: '_Response') -> RenderedParts:
+    # 逐个解码并立即从响应中移除，使每张图片的 base64 字符串在解码后即可被释放，
+    # 峰值内存不再同时包含全部 base64 字符串与全部解码结果
+    parts: List[Tuple[str, Union[str, bytes]]] = []
+    with metrics.span("decode"):
+        response.reverse()
+        while response:
+            _r = response.pop()
+            if _r["type"] == "string":
+                parts.append(("string", _r["string"]))
+            else:
+                parts.append(("image", b64decode(_r["string"])))
+            del _r
+    
+    return tuple(parts)
+
+def _parts_to_message(parts: RenderedParts) -> UniMessage:
     segments: List[Segment] = []
-    for _r in response:
-        if _r["type"] == "string":
-            segments.append(Text(_r["string"]))
+    with metrics.span("build"):
+        for _type, _value in parts:
+            if _type == "string":
+                segments.append(Text(cast(str, _value)))
+            else:
+                segments.append(Image(raw=cast(bytes, _value)))
+        message = UniMessage(segments)
+    
+    metrics.observe_size(parts_size(parts))
+    return message
+
+async def _list_to_message(response: '_Response') -> UniMessage:
+    return _parts_to_message(await transcoder.transcode(_decode_response(response)))
+
+def _render_key(key: Tuple[Any, ...]) -> Tuple[Any, ...]:
+    # 渲染设置同样会影响结果，需要计入键中
+    return (*key, tsugu_api_async.settings.use_easy_bg, tsugu_api_async.settings.compress, transcoder.key)
+
+@asynccontextmanager
+async def _backend(lane: str, stage: str="backend") -> AsyncIterator[None]:
+    # 等待准入的时间由调度器统计，此处只统计实际请求后端的时间
+    async with scheduler.lane(lane):
+        with metrics.span(stage):
+            yield
+
+async def _fetch_parts(
+    key: Tuple[Any, ...],
+    call: Callable[[], Awaitable['_Response']],
+    lane: str,
+    store: Optional[Callable[[RenderedParts], Awaitable[None]]]=None
+) -> RenderedParts:
+    async def _fetch() -> RenderedParts:
+        async with _backend(lane):
+            response = await call()
+        # 重新编码在释放后端并发名额之后进行
+        parts = await transcoder.transcode(_decode_response(response))
+        stale_cache.set(key, parts)
+        # 缓存只由实际发出请求的任务写入一次，不由每个等待者重复写入
+        if store is not None:
+            await store(parts)
+        return parts
+    
+    # 并发的相同请求只向后端发送一次，结果与异常由所有等待者共享
+    return await render_flight.do(key, _fetch)
+
+# 后台刷新任务，保留引用以免被回收
+_revalidating: Set['asyncio.Future[Any]'] = set()
+
+def _revalidated(task: 'asyncio.Future[Any]') -> None:
+    _revalidating.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.opt(exception=task.exception()).debug('Failed to revalidate render')
+
+async def _fetch_degraded(
+    key: Tuple[Any, ...],
+    call: Callable[[], Awaitable['_Response']],
+    lane: str,
+    store: Optional[Callable[[RenderedParts], Awaitable[None]]]=None
+) -> Tuple[RenderedParts, Optional[float]]:
+    '''获取渲染结果，后端失败或超出延迟预算时返回最近一次成功的结果
+
+    后端的业务错误（`FailedException`）不会降级。超出延迟预算时请求在后台继续，完成后同样写入缓存。
+
+    返回:
+        Tuple[RenderedParts, Optional[float]]: (渲染结果, 旧结果已过去的时间)，结果为最新时时间为 `None`
+    '''
+    family = str(key[0])
+    fetch = asyncio.ensure_future(_fetch_parts(key, call, lane, store))
+    stale = stale_cache.get(key)
+    try:
+        if stale is not None and stale_cache.budget > 0:
+            parts = await asyncio.wait_for(asyncio.shield(fetch), stale_cache.budget)
         else:
-            segments.append(Image(raw=b64decode(_r["string"])))
+            parts = await fetch
+    except asyncio.CancelledError:
+        fetch.cancel()
+        raise
+    except FailedException:
+        raise
+    except Exception as exception:
+        if stale is None:
+            if stale_cache.max_age_of(family) > 0:
+                stale_cache.unavailable[family] += 1
+            raise
+        if not fetch.done():
+            # 超出延迟预算，请求在后台继续并在完成后写入缓存
+            task = fetch
+            _revalidating.add(task)
+            task.add_done_callback(_revalidated)
+            stale_cache.slow[family] += 1
+        else:
+            logger.opt(exception=exception).debug(f'Failed to render {family}, serving stale result')
+        stale_cache.served[family] += 1
+        return stale[0], stale[1]
     
-    return UniMessage(segments)
+    return parts, None
 
-async def _get_tsugu_user(platform: str, user_id: str) -> '_TsuguUser':
+def _format_age(seconds: float) -> str:
+    if seconds < 60:
+        return f"{int(seconds)} 秒"
+    if seconds < 3600:
+        return f"{int(seconds // 60)} 分钟"
+    if seconds < 86400:
+        return f"{int(seconds // 3600)} 小时"
+    return f"{int(seconds // 86400)} 天"
+
+def _degraded_message(parts: RenderedParts, age: Optional[float]) -> UniMessage:
+    if age is None:
+        return _parts_to_message(parts)
+    return _parts_to_message((("string", f"后端暂时无法及时响应，以下为 {_format_age(age)}前的结果\n"), *parts))
+
+async def _render(key: Tuple[Any, ...], call: Callable[[], Awaitable['_Response']], lane: str="render") -> UniMessage:
+    return _degraded_message(*await _fetch_degraded(_render_key(key), call, lane))
+
+async def _render_cached(key: Tuple[Any, ...], call: Callable[[], Awaitable['_Response']], lane: str="render") -> UniMessage:
+    key = _render_key(key)
+    parts = await response_cache.get(key)
+    if parts is not None:
+        return _parts_to_message(parts)
+    
+    async def _store(parts: RenderedParts) -> None:
+        await response_cache.set(key, parts)
+    
+    return _degraded_message(*await _fetch_degraded(key, call, lane, _store))
+
+def _revalidate_cutoff(key: Tuple[Any, ...], call: Callable[[], Awaitable['_Response']], lane: str, final: bool) -> None:
+    if key in render_flight:
+        return
+    
+    async def _refresh() -> RenderedParts:
+        parts = await _fetch_parts(key, call, lane)
+        cutoff_cache.set(key, parts, final)
+        return parts
+    
+    task = asyncio.ensure_future(_refresh())
+    _revalidating.add(task)
+    task.add_done_callback(_revalidated)
+
+async def _render_cutoff(key: Tuple[Any, ...], call: Callable[[], Awaitable['_Response']], lane: str="render", final: bool=False) -> UniMessage:
+    key = _render_key(key)
+    parts, fresh = cutoff_cache.get(key)
+    if parts is not None:
+        if not fresh:
+            _revalidate_cutoff(key, call, lane, final)
+        return _parts_to_message(parts)
+    
+    async def _store(parts: RenderedParts) -> None:
+        cutoff_cache.set(key, parts, final)
+    
+    return _degraded_message(*await _fetch_degraded(key, call, lane, _store))
+
+def _cutoff_request(server: 'ServerId', tier: Optional[int], event_id: Optional[int]) -> Tuple[Tuple[Any, ...], Callable[[], Awaitable['_Response']], str]:
+    # 用户请求与预渲染共用同一个键，保证预渲染结果能被命中
+    if tier is None:
+        return ("cutoff_all", server, event_id), lambda: tsugu_api_async.cutoff_all(server, event_id), "heavy"
+    return ("cutoff_detail", server, tier, event_id), lambda: tsugu_api_async.cutoff_detail(server, tier, event_id), "render"
+
+async def prerender_cutoff(server: 'ServerId', tier: Optional[int]=None) -> bool:
+    '''预渲染当前活动的档线预测并写入缓存，`tier` 为 `None` 时为全部档线
+
+    返回:
+        bool: 是否实际发出了渲染请求，缓存仍有效时不会请求
+    '''
+    key, call, lane = _cutoff_request(server, tier, None)
+    key = _render_key(key)
+    if cutoff_cache.fresh(key) or key in render_flight:
+        return False
+    
+    parts = await _fetch_parts(key, call, lane)
+    cutoff_cache.set(key, parts)
+    return True
+
+async def _fetch_tsugu_user(platform: str, user_id: str) -> '_TsuguUser':
     try:
-        response = await tsugu_api_async.get_user_data(platform, user_id)
+        async with _backend("light", "user"):
+            response = await tsugu_api_async.get_user_data(platform, user_id)
     except FailedException as exception:
         raise exception
     except Exception as exception:
@@ -44,6 +290,108 @@ async def _get_tsugu_user(platform: str, user_id: str) -> '_TsuguUser':
     
     return response["data"]
 
+user_store.fetch = _fetch_tsugu_user
+user_store.invalidate = lambda platform, user_id: user_cache.pop((platform, user_id))
+
+# 正在从后端加载的用户数据，值为加载期间是否被插件修改
+_loading_users: Dict[Tuple[str, str], bool] = {}
+
+async def _load_tsugu_user(platform: str, user_id: str) -> '_TsuguUser':
+    # 从后端获取并写入缓存与本地镜像
+    _loading_users[(platform, user_id)] = False
+    try:
+        tsugu_user = await _fetch_tsugu_user(platform, user_id)
+    finally:
+        modified = _loading_users.pop((platform, user_id), False)
+    if modified:
+        # 请求发出后数据被修改，返回的数据可能早于修改，不覆盖缓存与本地镜像中修改后的数据
+        return user_cache.peek((platform, user_id)) or tsugu_user
+    user_cache.set((platform, user_id), tsugu_user)
+    if user_store.enabled:
+        try:
+            await user_store.put(platform, user_id, tsugu_user)
+        except Exception as exception:
+            logger.opt(exception=exception).warning('Failed to write user data to local store')
+    return tsugu_user
+
+# 后台刷新用户数据的任务，保留引用以免被回收
+_refreshing: Set['asyncio.Future[_TsuguUser]'] = set()
+
+def _refresh_tsugu_user(platform: str, user_id: str) -> None:
+    if (platform, user_id) in user_flight:
+        return
+    
+    def _done(task: 'asyncio.Future[_TsuguUser]') -> None:
+        _refreshing.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.opt(exception=task.exception()).debug('Failed to refresh user data')
+    
+    task = asyncio.ensure_future(user_flight.do((platform, user_id), lambda: _load_tsugu_user(platform, user_id)))
+    _refreshing.add(task)
+    task.add_done_callback(_done)
+
+async def _get_tsugu_user(platform: str, user_id: str) -> '_TsuguUser':
+    tsugu_user = user_cache.get((platform, user_id))
+    if tsugu_user is not None:
+        return tsugu_user
+    
+    if user_store.enabled:
+        try:
+            record = await user_store.get(platform, user_id)
+        except Exception as exception:
+            logger.opt(exception=exception).warning('Failed to read user data from local store')
+            record = None
+        if record is not None:
+            # 本地数据立即返回，过旧时在后台向后端刷新
+            tsugu_user, updated_at = record
+            user_cache.set((platform, user_id), tsugu_user)
+            if time() - updated_at > user_store.refresh_age:
+                _refresh_tsugu_user(platform, user_id)
+            return tsugu_user
+    
+    return await user_flight.do((platform, user_id), lambda: _load_tsugu_user(platform, user_id))
+
+async def _patch_tsugu_user(platform: str, user_id: str, update: 'PartialTsuguUser') -> None:
+    # 将插件自身对用户数据的修改同步到缓存与本地镜像中
+    if (platform, user_id) in _loading_users:
+        _loading_users[(platform, user_id)] = True
+    tsugu_user = user_cache.peek((platform, user_id))
+    if tsugu_user is not None:
+        patched = tsugu_user.copy()
+        patched.update(update) # type: ignore
+        user_cache.replace((platform, user_id), patched)
+    
+    if user_store.enabled:
+        try:
+            await user_store.patch(platform, user_id, update)
+        except Exception as exception:
+            logger.opt(exception=exception).warning('Failed to write user data to local store')
+            await _invalidate_tsugu_user(platform, user_id)
+
+async def _invalidate_tsugu_user(platform: str, user_id: str) -> None:
+    if (platform, user_id) in _loading_users:
+        _loading_users[(platform, user_id)] = True
+    user_cache.pop((platform, user_id))
+    if user_store.enabled:
+        try:
+            await user_store.delete(platform, user_id)
+        except Exception as exception:
+            logger.opt(exception=exception).warning('Failed to delete user data from local store')
+
+_MISSING_MESSAGES = {
+    "cards": "错误: 卡牌不存在",
+    "songs": "错误: 歌曲不存在",
+    "events": "错误: 活动不存在",
+    "characters": "错误: 角色不存在",
+    "gachas": "错误: 卡池不存在",
+}
+
+def _check_id(dataset: str, id: int) -> Optional[str]:
+    '''使用本地游戏数据索引校验 ID，一定不存在时返回错误信息'''
+    if master_index.is_invalid(dataset, id):
+        return _MISSING_MESSAGES[dataset]
+    return None
+
 def _get_user_player_from_tsugu_user(tsugu_user: '_TsuguUser', server: Optional['ServerId']=None, index: Optional[int]=None) -> '_UserPlayerInList':
     server = server or tsugu_user["mainServer"]
     user_player_list = tsugu_user["userPlayerList"]
@@ -68,42 +416,38 @@ def _get_user_player_from_tsugu_user(tsugu_user: '_TsuguUser', server: Optional[
     logger.opt(exception=exception).debug('User player not found in server')
     raise exception
 
+# 车牌关键词匹配器，由 `CAR` 与 `FAKE` 构建
+room_keyword_matcher = RoomKeywordMatcher(CAR, FAKE)
+
+def classify_room_message(raw_message: str) -> Tuple[bool, Optional[str]]:
+    '''判断消息是否为有效车牌，不进行任何 I/O
+
+    返回:
+        Tuple[bool, Optional[str]]: (是否为有效车牌, 命中的关键词)，未命中车牌关键词时关键词为 `None`
+    '''
+    return room_keyword_matcher.classify(raw_message)
+
+# 车牌转发各阶段的统计计数
+car_forwarding_counter: 'Counter[str]' = Counter()
+
 async def forward_room(
     room_number: int,
     raw_message: str,
-    tsugu_user: '_TsuguUser',
     platform: str,
     user_id: str,
     user_name: str,
     bandori_station_token: Optional[str]
 ) -> bool:
-    if not tsugu_user["shareRoomNumber"]:
-        logger.debug("User is disabled to forward room number")
-        return False
-    
-    is_car: bool = False
-    for _car in CAR:
-        if _car in raw_message:
-            is_car = True
-            break
-    
-    if not is_car:
-        return False
-    
-    for _fake in FAKE:
-        if _fake in raw_message:
-            logger.debug(f"Invalid keyword in message: {_fake}")
-            return False
-    
     try:
-        response = await tsugu_api_async.station_submit_room_number(
-            room_number,
-            raw_message,
-            platform,
-            user_id,
-            user_name,
-            bandori_station_token
-        )
+        async with _backend("light"):
+            response = await tsugu_api_async.station_submit_room_number(
+                room_number,
+                raw_message,
+                platform,
+                user_id,
+                user_name,
+                bandori_station_token
+            )
     except Exception as exception:
         logger.warning(f"Failed to submit room number: {exception}")
         return False
@@ -114,19 +458,32 @@ async def forward_room(
         logger.warning(f"Failed to submit room number: {response['data']}")
         return False
 
+async def _submit_room(room: Tuple[int, str, str, str, str, Optional[str]]) -> bool:
+    if await forward_room(*room):
+        car_forwarding_counter["submitted"] += 1
+        logger.debug(f"Submitted room number: '{room[1]}'")
+        return True
+    car_forwarding_counter["failed"] += 1
+    return False
+
+# 车牌转发的后台提交队列，同一房间号与消息在窗口内只提交一次
+room_submit_queue: 'SubmitQueue[Tuple[int, str, str, str, str, Optional[str]]]' = SubmitQueue(_submit_room, 60)
+
 async def switch_forward(platform: str, user_id: str, mode: bool) -> str:
     try:
-        await tsugu_api_async.change_user_data(
-            platform,
-            user_id,
-            {"shareRoomNumber": mode}
-        )
+        async with _backend("light"):
+            await tsugu_api_async.change_user_data(
+                platform,
+                user_id,
+                {"shareRoomNumber": mode}
+            )
     except FailedException as exception:
         return exception.response["data"]
     except Exception as exception:
         logger.opt(exception=exception).debug('Failed to change user data')
         return f"错误: {exception}"
     
+    await _patch_tsugu_user(platform, user_id, {"shareRoomNumber": mode})
     return (
         "已"
         + ("开启" if mode else "关闭")
@@ -135,7 +492,8 @@ async def switch_forward(platform: str, user_id: str, mode: bool) -> str:
 
 async def player_bind(matcher: Type[AlconnaMatcher], platform: str, user_id: str, server: 'ServerId') -> None:
     try:
-        response = await tsugu_api_async.bind_player_request(platform, user_id)
+        async with _backend("light"):
+            response = await tsugu_api_async.bind_player_request(platform, user_id)
     except FailedException as exception:
         logger.opt(exception=exception).debug('Failed to request for binding player')
         return await matcher.finish(exception.response["data"])
@@ -152,25 +510,36 @@ async def player_bind(matcher: Type[AlconnaMatcher], platform: str, user_id: str
         + f"{verify_code}"
     )
 
-async def player_unbind(matcher: Type[AlconnaMatcher], platform: str, user_id: str, server: 'ServerId', index: Optional[int]=None) -> None:
+async def player_unbind(matcher: Type[AlconnaMatcher], platform: str, user_id: str, server_name: Optional[str]=None, index: Optional[int]=None) -> None:
+    server: Optional['ServerId'] = None
     try:
-        tsugu_user = await _get_tsugu_user(platform, user_id)
+        if server_name is not None:
+            # 用户数据与服务器名解析互不依赖，并发进行
+            tsugu_user, server = await gather(
+                _get_tsugu_user(platform, user_id),
+                server_name_fuzzy_search(server_name)
+            )
+        else:
+            tsugu_user = await _get_tsugu_user(platform, user_id)
     except FailedException as exception:
         return await matcher.finish(exception.response["data"])
+    except ValueError:
+        return await matcher.finish("错误: 服务器名未能匹配任何服务器")
     except Exception as exception:
         return await matcher.finish(f"错误: {exception}")
     
+    if server is None:
+        server = tsugu_user["mainServer"]
+    
     try:
         player = _get_user_player_from_tsugu_user(tsugu_user, server)
     except Exception as exception:
         return await matcher.finish(str(exception))
     player_id = player["playerId"]
     
-    if server is None:
-        server = tsugu_user["mainServer"]
-    
     try:
-        response = await tsugu_api_async.bind_player_request(platform, user_id)
+        async with _backend("light"):
+            response = await tsugu_api_async.bind_player_request(platform, user_id)
     except FailedException as exception:
         logger.opt(exception=exception).debug('Failed to request for unbinding player')
         return await matcher.finish(exception.response["data"])
@@ -189,11 +558,12 @@ async def player_unbind(matcher: Type[AlconnaMatcher], platform: str, user_id: s
 
 async def switch_main_server(platform: str, user_id: str, server: 'ServerId') -> str:
     try:
-        response = await tsugu_api_async.change_user_data(
-            platform,
-            user_id,
-            {"mainServer": server}
-        )
+        async with _backend("light"):
+            response = await tsugu_api_async.change_user_data(
+                platform,
+                user_id,
+                {"mainServer": server}
+            )
     except Exception as exception:
         logger.opt(exception=exception).debug('Failed to change main server')
         return f"错误: {exception}"
@@ -202,17 +572,19 @@ async def switch_main_server(platform: str, user_id: str, server: 'ServerId') ->
         assert "data" in response
         return response["data"]
     
+    await _patch_tsugu_user(platform, user_id, {"mainServer": server})
     return (
         f"已切换到{server_id_to_full_name(server)}模式"
     )
 
 async def set_default_servers(platform: str, user_id: str, servers: List['ServerId']) -> str:
     try:
-        response = await tsugu_api_async.change_user_data(
-            platform,
-            user_id,
-            {"displayedServerList": servers}
-        )
+        async with _backend("light"):
+            response = await tsugu_api_async.change_user_data(
+                platform,
+                user_id,
+                {"displayedServerList": servers}
+            )
     except Exception as exception:
         logger.opt(exception=exception).debug('Failed to change default servers')
         return f"错误: {exception}"
@@ -221,37 +593,40 @@ async def set_default_servers(platform: str, user_id: str, servers: List['Server
         assert "data" in response
         return response["data"]
     
+    await _patch_tsugu_user(platform, user_id, {"displayedServerList": servers})
     return (
         f"成功切换默认显示服务器顺序: {', '.join(server_id_to_full_name(server) for server in servers)}"
     )
 
 async def player_info(platform: str, user_id: str, index: Optional[int]=None, server_name: Optional[str]=None) -> Union[str, UniMessage]:
-    try:
-        tsugu_user = await _get_tsugu_user(platform, user_id)
-    except Exception as exception:
-        return str(exception)
+    server: Optional['ServerId'] = None
+    if index is None and server_name is not None:
+        # 用户数据与服务器名解析互不依赖，并发进行
+        try:
+            tsugu_user, server = await gather(
+                _get_tsugu_user(platform, user_id),
+                server_name_fuzzy_search(server_name)
+            )
+        except ValueError as exception:
+            logger.opt(exception=exception).debug('Failed to search server name')
+            return str(exception)
+        except Exception as exception:
+            return str(exception)
+    else:
+        try:
+            tsugu_user = await _get_tsugu_user(platform, user_id)
+        except Exception as exception:
+            return str(exception)
     
     player_list = tsugu_user["userPlayerList"]
     if len(player_list) < 1:
         return "未绑定任何玩家"
     
     if index is None:
-        if server_name is None:
-            try:
-                player = _get_user_player_from_tsugu_user(tsugu_user, tsugu_user["mainServer"])
-            except Exception as exception:
-                return str(exception)
-        else:
-            try:
-                server = await server_name_fuzzy_search(server_name)
-            except ValueError as exception:
-                logger.opt(exception=exception).debug('Failed to search server name')
-                return str(exception)
-            
-            try:
-                player = _get_user_player_from_tsugu_user(tsugu_user, server)
-            except Exception as exception:
-                return str(exception)
+        try:
+            player = _get_user_player_from_tsugu_user(tsugu_user, server if server is not None else tsugu_user["mainServer"])
+        except Exception as exception:
+            return str(exception)
     else:
         if index > len(player_list) or index < 1:
             logger.debug(f"Invalid index: {index}")
@@ -296,11 +671,12 @@ async def switch_player_index(platform: str, user_id: str, index: int) -> str:
         return "错误: 无效的绑定信息ID"
     
     try:
-        await tsugu_api_async.change_user_data(
-            platform,
-            user_id,
-            {"userPlayerIndex": index - 1}
-        )
+        async with _backend("light"):
+            await tsugu_api_async.change_user_data(
+                platform,
+                user_id,
+                {"userPlayerIndex": index - 1}
+            )
     except FailedException as exception:
         logger.opt(exception=exception).debug('Failed to change user player index')
         return exception.response["data"]
@@ -308,6 +684,7 @@ async def switch_player_index(platform: str, user_id: str, index: int) -> str:
         logger.opt(exception=exception).debug('Failed to change user player index')
         return f"错误: {exception}"
     
+    await _patch_tsugu_user(platform, user_id, {"userPlayerIndex": index - 1})
     return f"已切换至绑定信息ID: {index}"
 
 async def search_player(platform: str, user_id: str, player_id: int, server: Optional['ServerId']=None) -> Union[str, UniMessage]:
@@ -320,7 +697,10 @@ async def search_player(platform: str, user_id: str, player_id: int, server: Opt
         server = tsugu_user["mainServer"]
     
     try:
-        return _list_to_message(await tsugu_api_async.search_player(player_id, server))
+        return await _render(
+            ("search_player", player_id, server),
+            lambda: tsugu_api_async.search_player(player_id, server)
+        )
     except FailedException as exception:
         logger.opt(exception=exception).debug('Failed to search player')
         return exception.response["data"]
@@ -328,9 +708,32 @@ async def search_player(platform: str, user_id: str, player_id: int, server: Opt
         logger.opt(exception=exception).debug('Failed to search player')
         return f"错误: {exception}"
 
+async def _get_rooms() -> List['StationRoom']:
+    rooms = room_cache.get("all")
+    if rooms is not None:
+        return rooms
+    
+    async def _fetch() -> List['StationRoom']:
+        async with _backend("light"):
+            response = await tsugu_api_async.station_query_all_room()
+        room_cache.set("all", response["data"])
+        return response["data"]
+    
+    return await room_flight.do("all", _fetch)
+
+def _filter_rooms(rooms: List['StationRoom'], keyword: Optional[str]) -> List['StationRoom']:
+    '''保留车牌信息中包含所有关键词的房间，关键词以空格分隔且不区分大小写'''
+    if not keyword:
+        return rooms
+    words = [word.casefold() for word in keyword.split()]
+    return [
+        room for room in rooms
+        if all(word in room["raw_message"].casefold() for word in words)
+    ]
+
 async def room_list(keyword: Optional[str]=None) -> Union[str, UniMessage]:
     try:
-        _response = await tsugu_api_async.station_query_all_room()
+        rooms = await _get_rooms()
     except FailedException as exception:
         logger.opt(exception=exception).debug('Failed to query all room')
         return exception.response["data"]
@@ -338,8 +741,17 @@ async def room_list(keyword: Optional[str]=None) -> Union[str, UniMessage]:
         logger.opt(exception=exception).debug('Failed to query all room')
         return f"错误: {exception}"
     
+    rooms = _filter_rooms(rooms, keyword)
+    if keyword and len(rooms) < 1:
+        return "没有找到符合条件的车牌"
+    
+    # 过滤结果相同的请求共享同一次渲染
+    key = _render_key(("room_list", tuple((room["number"], room["time"]) for room in rooms)))
     try:
-        response = await tsugu_api_async.room_list(_response["data"])
+        parts = room_render_cache.get(key)
+        if parts is None:
+            parts = await _fetch_parts(key, lambda: tsugu_api_async.room_list(rooms), "heavy")
+            room_render_cache.set(key, parts)
     except FailedException as exception:
         logger.opt(exception=exception).debug('Failed to request for rendering room list')
         return exception.response["data"]
@@ -347,9 +759,12 @@ async def room_list(keyword: Optional[str]=None) -> Union[str, UniMessage]:
         logger.opt(exception=exception).debug('Failed to request for rendering room list')
         return f"错误: {exception}"
     
-    return _list_to_message(response)
+    return _parts_to_message(parts)
 
 async def search_card(platform: str, user_id: str, word: str) -> Union[str, UniMessage]:
+    if word.isdigit() and (message := _check_id("cards", int(word))) is not None:
+        return message
+
     try:
         tsugu_user = await _get_tsugu_user(platform, user_id)
     except Exception as exception:
@@ -358,29 +773,42 @@ async def search_card(platform: str, user_id: str, word: str) -> Union[str, UniM
     servers = tsugu_user["displayedServerList"]
     
     try:
-        response = await tsugu_api_async.search_card(servers, word)
+        if word.isdigit():
+            return await _render_cached(
+                ("search_card", tuple(servers), int(word)),
+                lambda: tsugu_api_async.search_card(servers, word)
+            )
+        return await _render(
+            ("search_card", tuple(servers), word),
+            lambda: tsugu_api_async.search_card(servers, word)
+        )
     except FailedException as exception:
         logger.opt(exception=exception).debug('Failed to search card')
         return exception.response["data"]
     except Exception as exception:
         logger.opt(exception=exception).debug('Failed to search card')
         return f"错误: {exception}"
-    
-    return _list_to_message(response)
 
 async def get_card_illustration(card_id: int) -> Union[str, UniMessage]:
+    if (message := _check_id("cards", card_id)) is not None:
+        return message
+
     try:
-        response = await tsugu_api_async.get_card_illustration(card_id)
+        return await _render_cached(
+            ("get_card_illustration", card_id),
+            lambda: tsugu_api_async.get_card_illustration(card_id)
+        )
     except FailedException as exception:
         logger.opt(exception=exception).debug('Failed to get card illustration')
         return exception.response["data"]
     except Exception as exception:
         logger.opt(exception=exception).debug('Failed to get card illustration')
         return f"错误: {exception}"
-    
-    return _list_to_message(response)
 
 async def search_character(platform: str, user_id: str, text: str) -> Union[str, UniMessage]:
+    if text.isdigit() and (message := _check_id("characters", int(text))) is not None:
+        return message
+
     try:
         tsugu_user = await _get_tsugu_user(platform, user_id)
     except Exception as exception:
@@ -389,17 +817,21 @@ async def search_character(platform: str, user_id: str, text: str) -> Union[str,
     servers = tsugu_user["displayedServerList"]
     
     try:
-        response = await tsugu_api_async.search_character(servers, text=text)
+        return await _render(
+            ("search_character", tuple(servers), text),
+            lambda: tsugu_api_async.search_character(servers, text=text)
+        )
     except FailedException as exception:
         logger.opt(exception=exception).debug('Failed to search character')
         return exception.response["data"]
     except Exception as exception:
         logger.opt(exception=exception).debug('Failed to search character')
         return f"错误: {exception}"
-    
-    return _list_to_message(response)
 
 async def search_event(platform: str, user_id: str, text: str) -> Union[str, UniMessage]:
+    if text.isdigit() and (message := _check_id("events", int(text))) is not None:
+        return message
+
     try:
         tsugu_user = await _get_tsugu_user(platform, user_id)
     except Exception as exception:
@@ -408,17 +840,21 @@ async def search_event(platform: str, user_id: str, text: str) -> Union[str, Uni
     servers = tsugu_user["displayedServerList"]
 
     try:
-        response = await tsugu_api_async.search_event(servers, text=text)
+        return await _render(
+            ("search_event", tuple(servers), text),
+            lambda: tsugu_api_async.search_event(servers, text=text)
+        )
     except FailedException as exception:
         logger.opt(exception=exception).debug('Failed to search event')
         return exception.response["data"]
     except Exception as exception:
         logger.opt(exception=exception).debug('Failed to search event')
         return f"错误: {exception}"
-    
-    return _list_to_message(response)
 
 async def search_song(platform: str, user_id: str, text: str) -> Union[str, UniMessage]:
+    if text.isdigit() and (message := _check_id("songs", int(text))) is not None:
+        return message
+
     try:
         tsugu_user = await _get_tsugu_user(platform, user_id)
     except Exception as exception:
@@ -427,17 +863,26 @@ async def search_song(platform: str, user_id: str, text: str) -> Union[str, UniM
     servers = tsugu_user["displayedServerList"]
     
     try:
-        response = await tsugu_api_async.search_song(servers, text=text)
+        if text.isdigit():
+            return await _render_cached(
+                ("search_song", tuple(servers), int(text)),
+                lambda: tsugu_api_async.search_song(servers, text=text)
+            )
+        return await _render(
+            ("search_song", tuple(servers), text),
+            lambda: tsugu_api_async.search_song(servers, text=text)
+        )
     except FailedException as exception:
         logger.opt(exception=exception).debug('Failed to search song')
         return exception.response["data"]
     except Exception as exception:
         logger.opt(exception=exception).debug('Failed to search song')
         return f"错误: {exception}"
-    
-    return _list_to_message(response)
 
 async def song_chart(platform: str, user_id: str, song_id: int, difficulty_id: '_DifficultyId') -> Union[str, UniMessage]:
+    if (message := _check_id("songs", song_id)) is not None:
+        return message
+
     try:
         tsugu_user = await _get_tsugu_user(platform, user_id)
     except Exception as exception:
@@ -446,15 +891,16 @@ async def song_chart(platform: str, user_id: str, song_id: int, difficulty_id: '
     servers = tsugu_user["displayedServerList"]
 
     try:
-        response = await tsugu_api_async.song_chart(servers, song_id, difficulty_id)
+        return await _render_cached(
+            ("song_chart", tuple(servers), song_id, difficulty_id),
+            lambda: tsugu_api_async.song_chart(servers, song_id, difficulty_id)
+        )
     except FailedException as exception:
         logger.opt(exception=exception).debug('Failed to get song chart')
         return exception.response["data"]
     except Exception as exception:
         logger.opt(exception=exception).debug('Failed to get song chart')
         return f"错误: {exception}"
-    
-    return _list_to_message(response)
 
 async def random_song(platform: str, user_id: str, text: str) -> Union[str, UniMessage]:
     try:
@@ -465,7 +911,8 @@ async def random_song(platform: str, user_id: str, text: str) -> Union[str, UniM
     main_server = tsugu_user["mainServer"]
 
     try:
-        response = await tsugu_api_async.song_random(main_server, text=text)
+        async with _backend("render"):
+            response = await tsugu_api_async.song_random(main_server, text=text)
     except FailedException as exception:
         logger.opt(exception=exception).debug('Failed to get random song')
         return exception.response["data"]
@@ -473,7 +920,7 @@ async def random_song(platform: str, user_id: str, text: str) -> Union[str, UniM
         logger.opt(exception=exception).debug('Failed to get random song')
         return f"错误: {exception}"
     
-    return _list_to_message(response)
+    return await _list_to_message(response)
 
 async def song_meta(platform: str, user_id: str, server: Optional['ServerId']=None) -> Union[str, UniMessage]:
     try:
@@ -486,7 +933,10 @@ async def song_meta(platform: str, user_id: str, server: Optional['ServerId']=No
         server = tsugu_user["mainServer"]
 
     try:
-        response = await tsugu_api_async.song_meta(servers, server)
+        return await _render(
+            ("song_meta", tuple(servers), server),
+            lambda: tsugu_api_async.song_meta(servers, server)
+        )
     except FailedException as exception:
         logger.opt(exception=exception).debug('Failed to get song meta')
         return exception.response["data"]
@@ -494,8 +944,6 @@ async def song_meta(platform: str, user_id: str, server: Optional['ServerId']=No
         logger.opt(exception=exception).debug('Failed to get song meta')
         return f"错误: {exception}"
 
-    return _list_to_message(response)
-
 async def event_stage(platform: str, user_id: str, event_id: Optional[int]=None, meta: bool=False) -> Union[str, UniMessage]:
     try:
         tsugu_user = await _get_tsugu_user(platform, user_id)
@@ -505,7 +953,10 @@ async def event_stage(platform: str, user_id: str, event_id: Optional[int]=None,
     server = tsugu_user["mainServer"]
 
     try:
-        response = await tsugu_api_async.event_stage(server, event_id, meta)
+        return await _render(
+            ("event_stage", server, event_id, meta),
+            lambda: tsugu_api_async.event_stage(server, event_id, meta)
+        )
     except FailedException as exception:
         logger.opt(exception=exception).debug('Failed to get event stage')
         return exception.response["data"]
@@ -513,9 +964,10 @@ async def event_stage(platform: str, user_id: str, event_id: Optional[int]=None,
         logger.opt(exception=exception).debug('Failed to get event stage')
         return f"错误: {exception}"
 
-    return _list_to_message(response)
-
 async def search_gacha(platform: str, user_id: str, gacha_id: int) -> Union[str, UniMessage]:
+    if (message := _check_id("gachas", gacha_id)) is not None:
+        return message
+
     try:
         tsugu_user = await _get_tsugu_user(platform, user_id)
     except Exception as exception:
@@ -524,7 +976,10 @@ async def search_gacha(platform: str, user_id: str, gacha_id: int) -> Union[str,
     servers = tsugu_user["displayedServerList"]
 
     try:
-        response = await tsugu_api_async.search_gacha(servers, gacha_id)
+        return await _render_cached(
+            ("search_gacha", tuple(servers), gacha_id),
+            lambda: tsugu_api_async.search_gacha(servers, gacha_id)
+        )
     except FailedException as exception:
         logger.opt(exception=exception).debug('Failed to search gacha')
         return exception.response["data"]
@@ -532,8 +987,6 @@ async def search_gacha(platform: str, user_id: str, gacha_id: int) -> Union[str,
         logger.opt(exception=exception).debug('Failed to search gacha')
         return f"错误: {exception}"
 
-    return _list_to_message(response)
-
 async def search_ycx(platform: str, user_id: str, tier: int, event_id: Optional[int]=None, server: Optional['ServerId']=None) -> Union[str, UniMessage]:
     if server is None:
         try:
@@ -543,8 +996,11 @@ async def search_ycx(platform: str, user_id: str, tier: int, event_id: Optional[
         
         server = tsugu_user["mainServer"]
     
+    if event_id is None:
+        cutoff_demand.record(server, tier)
+    
     try:
-        response = await tsugu_api_async.cutoff_detail(server, tier, event_id)
+        return await _render_cutoff(*_cutoff_request(server, tier, event_id))
     except FailedException as exception:
         logger.opt(exception=exception).debug('Failed to search cutoff')
         return exception.response["data"]
@@ -552,8 +1008,6 @@ async def search_ycx(platform: str, user_id: str, tier: int, event_id: Optional[
         logger.opt(exception=exception).debug('Failed to search cutoff')
         return f"错误: {exception}"
 
-    return _list_to_message(response)
-
 async def search_ycx_all(platform: str, user_id: str, server: Optional['ServerId']=None, event_id: Optional[int]=None) -> Union[str, UniMessage]:
     if server is None:
         try:
@@ -563,8 +1017,11 @@ async def search_ycx_all(platform: str, user_id: str, server: Optional['ServerId
         
         server = tsugu_user["mainServer"]
     
+    if event_id is None:
+        cutoff_demand.record(server, None)
+    
     try:
-        response = await tsugu_api_async.cutoff_all(server, event_id)
+        return await _render_cutoff(*_cutoff_request(server, None, event_id))
     except FailedException as exception:
         logger.opt(exception=exception).debug('Failed to search all cutoff')
         return exception.response["data"]
@@ -572,8 +1029,6 @@ async def search_ycx_all(platform: str, user_id: str, server: Optional['ServerId
         logger.opt(exception=exception).debug('Failed to search all cutoff')
         return f"错误: {exception}"
 
-    return _list_to_message(response)
-
 async def search_lsycx(platform: str, user_id: str, tier: int, event_id: Optional[int]=None, server: Optional['ServerId']=None) -> Union[str, UniMessage]:
     if server is None:
         try:
@@ -584,7 +1039,12 @@ async def search_lsycx(platform: str, user_id: str, tier: int, event_id: Optiona
         server = tsugu_user["mainServer"]
     
     try:
-        response = await tsugu_api_async.cutoff_list_of_recent_event(server, tier, event_id)
+        # 已结束活动的历史档线不会再变化
+        return await _render_cutoff(
+            ("cutoff_list_of_recent_event", server, tier, event_id),
+            lambda: tsugu_api_async.cutoff_list_of_recent_event(server, tier, event_id),
+            final=event_id is not None and master_index.event_ended(event_id, server, 86400)
+        )
     except FailedException as exception:
         logger.opt(exception=exception).debug('Failed to search cutoff history')
         return exception.response["data"]
@@ -592,8 +1052,6 @@ async def search_lsycx(platform: str, user_id: str, tier: int, event_id: Optiona
         logger.opt(exception=exception).debug('Failed to search cutoff history')
         return f"错误: {exception}"
 
-    return _list_to_message(response)
-
 async def simulate_gacha(platform: str, user_id: str, times: Optional[int]=None, gacha_id: Optional[int]=None) -> Union[str, UniMessage]:
     try:
         tsugu_user = await _get_tsugu_user(platform, user_id)
@@ -603,7 +1061,8 @@ async def simulate_gacha(platform: str, user_id: str, times: Optional[int]=None,
     server = tsugu_user["mainServer"]
 
     try:
-        response = await tsugu_api_async.gacha_simulate(server, times, gacha_id)
+        async with _backend("heavy"):
+            response = await tsugu_api_async.gacha_simulate(server, times, gacha_id)
     except FailedException as exception:
         logger.opt(exception=exception).debug('Failed to simulate gacha')
         return exception.response["data"]
@@ -611,17 +1070,28 @@ async def simulate_gacha(platform: str, user_id: str, times: Optional[int]=None,
         logger.opt(exception=exception).debug('Failed to simulate gacha')
         return f"错误: {exception}"
 
-    return _list_to_message(response)
+    return await _list_to_message(response)
 
 async def get_fuzzy_search_result(text: str) -> 'FuzzySearchResult':
+    result = fuzzy_search_cache.get(text)
+    if result is not None:
+        return result
+    
     try:
-        response = await tsugu_api_async.fuzzy_search(text)
+        async with _backend("light"):
+            response = await tsugu_api_async.fuzzy_search(text)
     except:
         return {}
     
+    fuzzy_search_cache.set(text, response["data"])
     return response["data"]
 
 async def server_name_fuzzy_search(server_name: str) -> 'ServerId':
+    try:
+        return server_name_to_id(server_name)
+    except ValueError:
+        pass
+    
     result = await get_fuzzy_search_result(server_name)
     result_server = result.get("server", [])
     if len(result_server) < 1 or not result_server[0] in (0, 1, 2, 3, 4):
@@ -630,16 +1100,10 @@ async def server_name_fuzzy_search(server_name: str) -> 'ServerId':
     return result_server[0]
 
 async def difficulty_id_fuzzy_search(difficulty_name: str) -> '_DifficultyId':
-    if difficulty_name in ("ez", "easy", "简单"):
-        return 0
-    if difficulty_name in ("nm", "normal", "普通"):
-        return 1
-    if difficulty_name in ("hd", "hard", "困难"):
-        return 2
-    if difficulty_name in ("ex", "expert", "专家"):
-        return 3
-    if difficulty_name in ("sp", "special", "特殊"):
-        return 4
+    try:
+        return difficulty_name_to_id(difficulty_name)
+    except ValueError:
+        pass
     
     result = await get_fuzzy_search_result(difficulty_name)
     if "difficulty" not in result or result["difficulty"][0] not in (0, 1, 2, 3, 4):
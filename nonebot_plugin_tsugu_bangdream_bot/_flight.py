@@ -0,0 +1,67 @@
+'''相同请求的合并与并发执行'''
+
+import asyncio
+from functools import partial
+from typing import Any, Dict, List, Generic, TypeVar, Callable, Hashable, Awaitable
+
+_T = TypeVar("_T")
+
+class SingleFlight(Generic[_T]):
+    '''合并并发的相同请求
+
+    同一键下同时只会有一个请求在进行，期间到达的相同请求将等待并共享其结果或异常。
+    请求在独立的任务中运行，任一等待者被取消不会影响其他等待者。
+    '''
+    def __init__(self) -> None:
+        self.calls = 0
+        '''实际发出的请求次数'''
+        self.saved = 0
+        '''被合并而节省的请求次数'''
+        self._tasks: Dict[Hashable, 'asyncio.Future[_T]'] = {}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._tasks
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[_T]]) -> _T:
+        '''执行请求，若已有相同键的请求在进行则等待其结果'''
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._tasks[key] = task
+            task.add_done_callback(partial(self._done, key))
+            self.calls += 1
+        else:
+            self.saved += 1
+
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: 'asyncio.Future[Any]') -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # 所有等待者都被取消时，避免出现未获取异常的警告
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        '''获取统计信息'''
+        return {
+            "in_flight": len(self._tasks),
+            "calls": self.calls,
+            "saved": self.saved,
+        }
+
+async def gather(*aws: Awaitable[Any]) -> List[Any]:
+    '''并发执行多个相互独立的可等待对象
+
+    任一失败时取消其余仍在执行的任务并抛出该异常。
+    '''
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
@@ -0,0 +1,131 @@
+'''命令解析前的前缀过滤'''
+
+import re
+from contextlib import AsyncExitStack
+from typing import Any, Dict, List, Tuple, Pattern, Iterable, Optional
+
+from nonebot.rule import Rule
+from nonebot.typing import T_State, T_DependencyCache
+from nonebot.adapters import Bot, Event
+
+# 前缀树中标记词语结尾的键
+_END = ""
+
+class PrefixTrie:
+    '''前缀树，用于判断文本是否以任一已知词语开头'''
+    def __init__(self) -> None:
+        self._root: Dict[str, Any] = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, word: str) -> None:
+        '''添加词语'''
+        node = self._root
+        for char in word:
+            node = node.setdefault(char, {})
+        if _END not in node:
+            node[_END] = True
+            self._size += 1
+
+    def match_prefix(self, text: str) -> bool:
+        '''判断文本是否以任一已添加的词语开头，只需遍历最长词语的长度'''
+        node = self._root
+        if _END in node:
+            return True
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                return False
+            if _END in node:
+                return True
+        return False
+
+class CommandGate:
+    '''在逐个命令解析之前过滤不可能匹配任何命令的消息
+
+    由所有命令名、别名与命令前缀构建一棵前缀树，无法以字面量表示的快捷指令则保留为正则。
+    同一事件只判断一次，结果在各命令之间共享。未构建时放行所有消息。
+    '''
+    def __init__(self) -> None:
+        self.enabled = True
+        '''是否启用过滤'''
+        self.passed = 0
+        '''放行的消息数'''
+        self.discarded = 0
+        '''过滤掉的消息数'''
+        self._trie: Optional[PrefixTrie] = None
+        self._patterns: List[Pattern[str]] = []
+        self._last: Tuple[Optional[Event], bool] = (None, True)
+
+    def build(self, prefixes: Iterable[str], words: Iterable[str], patterns: Iterable[str]=()) -> None:
+        '''以命令前缀与命令名、别名的组合重建前缀树'''
+        trie = PrefixTrie()
+        prefixes = tuple(prefixes) or ("",)
+        for word in words:
+            for prefix in prefixes:
+                trie.add(prefix + word)
+        self._trie = trie
+        self._patterns = [re.compile(pattern) for pattern in dict.fromkeys(patterns)]
+        self._last = (None, True)
+
+    def match(self, text: str) -> bool:
+        '''判断文本是否可能匹配某个命令'''
+        if self._trie is None:
+            return True
+        text = text.lstrip()
+        if self._trie.match_prefix(text):
+            return True
+        return any(pattern.search(text) for pattern in self._patterns)
+
+    def check(self, event: Event) -> bool:
+        '''判断事件是否可能匹配某个命令'''
+        if not self.enabled or self._trie is None:
+            return True
+        last_event, last_result = self._last
+        if event is last_event:
+            return last_result
+
+        try:
+            text = event.get_plaintext()
+        except Exception:
+            # 无法获取文本时交由命令自行判断
+            return True
+
+        result = self.match(text)
+        if result:
+            self.passed += 1
+        else:
+            self.discarded += 1
+        self._last = (event, result)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        '''获取统计信息'''
+        return {
+            "words": len(self._trie) if self._trie is not None else 0,
+            "patterns": len(self._patterns),
+            "passed": self.passed,
+            "discarded": self.discarded,
+        }
+
+command_gate = CommandGate()
+
+class GatedRule(Rule):
+    '''先经过前缀过滤的规则，未通过时直接返回，不再为各个检查器调度任务与解析依赖'''
+    async def __call__(
+        self,
+        bot: Bot,
+        event: Event,
+        state: T_State,
+        stack: Optional[AsyncExitStack]=None,
+        dependency_cache: Optional[T_DependencyCache]=None
+    ) -> bool:
+        if not command_gate.check(event):
+            return False
+        return await super().__call__(bot, event, state, stack, dependency_cache)
+
+def gated(rule: Rule) -> GatedRule:
+    '''在原有规则之前加上前缀过滤'''
+    return GatedRule(*rule.checkers)
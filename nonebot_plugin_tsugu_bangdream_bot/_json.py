@@ -0,0 +1,83 @@
+'''HTTP 客户端使用的 JSON 编解码
+
+安装了 `orjson` 时默认使用 `orjson`，否则使用标准库 `json`。
+后端响应中包含大量 base64 图片数据，较大的响应在线程池中解析，解析期间事件循环仍可运行。
+'''
+
+import json
+import asyncio
+from functools import partial
+from typing import Any, Dict, Tuple, Union, Callable
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from nonebot import logger
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+class JSONCodec:
+    '''可替换实现的 JSON 编解码器
+
+    编码结果直接为 `bytes`，作为请求体发送时无需再经过 `str`。
+    '''
+    def __init__(self) -> None:
+        self.codecs: Dict[str, Tuple[Callable[[Any], bytes], Callable[[Union[bytes, str]], Any]]] = {
+            "json": (_json_dumps, json.loads),
+        }
+        '''可用的实现，值为 (编码方法, 解码方法)'''
+        if orjson is not None:
+            self.codecs["orjson"] = (partial(orjson.dumps, option=orjson.OPT_NON_STR_KEYS), orjson.loads)
+        self.name = "orjson" if orjson is not None else "json"
+        '''当前使用的实现'''
+        self.offload_size = 256 * 1024
+        '''超过该大小（字节）的内容在线程池中解析，`<= 0` 时总是在事件循环中解析'''
+        self.parsed = 0
+        '''解析次数'''
+        self.offloaded = 0
+        '''在线程池中解析的次数'''
+        self._dumps, self._loads = self.codecs[self.name]
+
+    def register(self, name: str, dumps: Callable[[Any], bytes], loads: Callable[[Union[bytes, str]], Any]) -> None:
+        '''注册一个实现，之后可通过 `use` 使用'''
+        self.codecs[name] = (dumps, loads)
+
+    def use(self, name: str) -> None:
+        '''切换实现，为空时自动选择，不可用时保持当前实现'''
+        if not name:
+            return
+        if name not in self.codecs:
+            logger.warning(f"JSON codec '{name}' is not available, using '{self.name}'")
+            return
+        self.name = name
+        self._dumps, self._loads = self.codecs[name]
+
+    def dumps(self, obj: Any) -> bytes:
+        '''编码为 UTF-8 的 `bytes`'''
+        return self._dumps(obj)
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        '''在当前线程中解析'''
+        self.parsed += 1
+        return self._loads(data)
+
+    async def aloads(self, data: Union[bytes, str]) -> Any:
+        '''解析，较大的内容在线程池中进行'''
+        if self.offload_size <= 0 or len(data) < self.offload_size:
+            return self.loads(data)
+        self.parsed += 1
+        self.offloaded += 1
+        return await asyncio.get_running_loop().run_in_executor(None, self._loads, data)
+
+    def stats(self) -> Dict[str, Union[int, str]]:
+        '''获取统计信息'''
+        return {
+            "codec": self.name,
+            "parsed": self.parsed,
+            "offloaded": self.offloaded,
+        }
+
+json_codec = JSONCodec()
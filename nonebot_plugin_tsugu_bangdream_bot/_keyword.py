@@ -0,0 +1,55 @@
+'''车牌关键词的多模式匹配'''
+
+import re
+from typing import Tuple, Pattern, Iterable, Optional
+
+def _compile(keywords: Tuple[str, ...]) -> Optional[Pattern[str]]:
+    if not keywords:
+        return None
+    # 较长的关键词优先，保证报告的命中关键词尽可能完整
+    return re.compile("|".join(re.escape(keyword) for keyword in sorted(keywords, key=len, reverse=True)))
+
+class RoomKeywordMatcher:
+    '''车牌关键词匹配器
+
+    将所有关键词预编译为一个多模式正则，每类关键词只需在 C 层对消息扫描一次，
+    关键词变更时重新编译。
+
+    参数:
+        car (Iterable[str]): 车牌关键词
+        fake (Iterable[str]): 无效关键词，命中时消息不视为车牌
+    '''
+    def __init__(self, car: Iterable[str], fake: Iterable[str]) -> None:
+        self.car: Tuple[str, ...] = ()
+        '''车牌关键词'''
+        self.fake: Tuple[str, ...] = ()
+        '''无效关键词'''
+        self._car_pattern: Optional[Pattern[str]] = None
+        self._fake_pattern: Optional[Pattern[str]] = None
+        self.set_keywords(car, fake)
+
+    def set_keywords(self, car: Iterable[str], fake: Iterable[str]) -> None:
+        '''替换关键词列表并重新编译'''
+        self.car = tuple(dict.fromkeys(keyword for keyword in car if keyword))
+        self.fake = tuple(dict.fromkeys(keyword for keyword in fake if keyword))
+        self._car_pattern = _compile(self.car)
+        self._fake_pattern = _compile(self.fake)
+
+    def extend(self, car: Iterable[str], fake: Iterable[str]) -> None:
+        '''追加关键词并重新编译'''
+        self.set_keywords((*self.car, *car), (*self.fake, *fake))
+
+    def classify(self, text: str) -> Tuple[bool, Optional[str]]:
+        '''判断消息是否为有效车牌
+
+        返回:
+            Tuple[bool, Optional[str]]: (是否为有效车牌, 命中的关键词)，未命中车牌关键词时关键词为 `None`
+        '''
+        if self._car_pattern is None or (car := self._car_pattern.search(text)) is None:
+            return False, None
+
+        # 两类关键词分别扫描，避免重叠的关键词在同一次扫描中被吞掉
+        if self._fake_pattern is not None and (fake := self._fake_pattern.search(text)) is not None:
+            return False, fake.group()
+
+        return True, car.group()
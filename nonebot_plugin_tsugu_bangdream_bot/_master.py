@@ -0,0 +1,210 @@
+'''本地游戏数据索引
+
+从本地快照目录读取 Bestdori 格式的 `all.json` 数据（`cards.json`、`songs.json`、`events.json`、
+`characters.json`、`gachas.json`，均为 `{id: 数据}` 的映射），构建按 ID 与属性、乐队、角色
+划分的紧凑索引，用于在请求后端前校验 ID。
+'''
+
+import json
+import asyncio
+from array import array
+from pathlib import Path
+from time import time
+from bisect import bisect_left
+from typing import Any, Dict, List, Tuple, Union, Iterable, Optional, cast
+
+from nonebot import logger
+
+# 角色数据决定卡牌与活动的乐队索引，需最先读取
+DATASETS = ("characters", "cards", "songs", "events", "gachas")
+
+_Value = Union[int, str]
+
+class MasterTable:
+    '''单类游戏数据的只读索引
+
+    ID 以有序 `array` 保存，属性、乐队与角色的倒排索引同样以有序 `array` 保存对应 ID。
+    '''
+    def __init__(
+        self,
+        ids: Iterable[int],
+        postings: Dict[str, Dict[_Value, Iterable[int]]],
+        end_at: Optional[Dict[int, Tuple[Optional[float], ...]]]=None
+    ) -> None:
+        self.ids = array("l", sorted(set(ids)))
+        '''所有 ID'''
+        self.end_at = end_at or {}
+        '''活动在各服务器的结束时间（秒），按服务器 ID 排列，未开放的服务器为 `None`'''
+        self.index: Dict[str, Dict[_Value, array]] = {
+            field: {value: array("l", sorted(set(_ids))) for value, _ids in values.items()}
+            for field, values in postings.items()
+        }
+        '''倒排索引，字段为 `attribute`、`band` 或 `character`'''
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, id: int) -> bool:
+        position = bisect_left(self.ids, id)
+        return position < len(self.ids) and self.ids[position] == id
+
+    @property
+    def max_id(self) -> int:
+        return self.ids[-1] if self.ids else 0
+
+    def query(self, **conditions: Optional[_Value]) -> List[int]:
+        '''按字段条件取交集，条件为 `None` 的字段将被忽略'''
+        result: Optional[set] = None
+        for field, value in conditions.items():
+            if value is None:
+                continue
+            ids = set(self.index.get(field, {}).get(value, ()))
+            result = ids if result is None else result & ids
+        return sorted(result) if result is not None else list(self.ids)
+
+def _parse(dataset: str, data: Dict[str, Any], band_of_character: Dict[int, int]) -> MasterTable:
+    ids: List[int] = []
+    postings: Dict[str, Dict[_Value, List[int]]] = {"attribute": {}, "band": {}, "character": {}}
+    end_at: Dict[int, Tuple[Optional[float], ...]] = {}
+
+    def add(field: str, value: Any, id: int) -> None:
+        if value is not None:
+            postings[field].setdefault(value, []).append(id)
+
+    for _id, record in data.items():
+        if not _id.isdigit() or not isinstance(record, dict):
+            continue
+        id = int(_id)
+        ids.append(id)
+        if dataset == "cards":
+            add("attribute", record.get("attribute"), id)
+            add("character", record.get("characterId"), id)
+            add("band", band_of_character.get(record.get("characterId", -1)), id)
+        elif dataset == "songs":
+            add("band", record.get("bandId"), id)
+        elif dataset == "characters":
+            add("band", record.get("bandId"), id)
+        elif dataset == "events":
+            for attribute in record.get("attributes", ()):
+                add("attribute", attribute.get("attribute"), id)
+            for character in record.get("characters", ()):
+                add("character", character.get("characterId"), id)
+                add("band", band_of_character.get(character.get("characterId", -1)), id)
+            end_at[id] = tuple(
+                int(value) / 1000 if value is not None else None
+                for value in record.get("endAt") or ()
+            )
+
+    return MasterTable(ids, postings, end_at)
+
+class MasterIndex:
+    '''本地游戏数据索引
+
+    刷新时只重新读取修改过的快照文件，全部解析完成后再整体替换，查询不会看到半更新的状态。
+    '''
+    def __init__(self) -> None:
+        self.directory: Optional[Path] = None
+        '''快照目录'''
+        self.refresh_interval: float = 3600
+        '''刷新间隔（秒）'''
+        self.slack: int = 50
+        '''超出已知最大 ID 多少以内的未知 ID 仍交由后端判断，以容忍快照落后于游戏数据'''
+        self.tables: Dict[str, MasterTable] = {}
+        '''各类数据的索引'''
+        self._mtimes: Dict[str, float] = {}
+        self._task: Optional['asyncio.Task[None]'] = None
+
+    def _load(self) -> Tuple[Dict[str, MasterTable], Dict[str, float]]:
+        assert self.directory is not None
+        tables = dict(self.tables)
+        mtimes = dict(self._mtimes)
+
+        changed: Dict[str, Dict[str, Any]] = {}
+        for dataset in DATASETS:
+            path = self.directory / f"{dataset}.json"
+            try:
+                mtime = path.stat().st_mtime
+            except FileNotFoundError:
+                tables.pop(dataset, None)
+                mtimes.pop(dataset, None)
+                continue
+            # 角色数据变化时，卡牌与活动的索引一并重建
+            if mtimes.get(dataset) == mtime and not (dataset in ("cards", "events") and "characters" in changed):
+                continue
+            with path.open("r", encoding="utf-8") as file:
+                changed[dataset] = json.load(file)
+            mtimes[dataset] = mtime
+
+        band_of_character: Dict[int, int] = {}
+        characters = changed.get("characters")
+        if characters is None and "characters" in tables:
+            band_of_character = {
+                id: band
+                for band, ids in tables["characters"].index["band"].items()
+                for id in ids
+                if isinstance(band, int)
+            }
+        elif characters is not None:
+            band_of_character = {
+                int(id): record["bandId"]
+                for id, record in characters.items()
+                if id.isdigit() and isinstance(record, dict) and record.get("bandId") is not None
+            }
+
+        for dataset, data in changed.items():
+            tables[dataset] = _parse(dataset, data, band_of_character)
+
+        return tables, mtimes
+
+    async def refresh(self) -> None:
+        '''重新读取修改过的快照文件，并在完成后整体替换索引'''
+        if self.directory is None:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            tables, mtimes = await loop.run_in_executor(None, self._load)
+        except Exception as exception:
+            logger.warning(f"Failed to load master data from '{self.directory}': {repr(exception)}")
+            return
+        self.tables, self._mtimes = tables, mtimes
+        logger.debug(f"Master data loaded: { {dataset: len(table) for dataset, table in tables.items()} }")
+
+    async def _run(self) -> None:
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+    async def start(self) -> None:
+        '''启动定时刷新'''
+        if self.directory is not None and self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        '''停止定时刷新'''
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def is_invalid(self, dataset: str, id: int) -> bool:
+        '''判断 ID 是否一定不存在，数据未加载时总是返回 `False`'''
+        table = self.tables.get(dataset)
+        if table is None or len(table) < 1:
+            return False
+        if id <= 0:
+            return True
+        if id in table:
+            return False
+        # 已知最大 ID 以内的空缺一定不存在，超出部分仅在远超最大 ID 时判定为无效
+        return id < table.max_id or id > table.max_id + self.slack
+
+    def event_ended(self, event_id: int, server: int, margin: float=0) -> bool:
+        '''判断活动是否已在指定服务器结束超过 `margin` 秒，数据未加载或未知时返回 `False`'''
+        table = self.tables.get("events")
+        if table is None:
+            return False
+        end_at = table.end_at.get(event_id, ())
+        if server >= len(end_at) or end_at[server] is None:
+            return False
+        return cast(float, end_at[server]) + margin < time()
+
+master_index = MasterIndex()
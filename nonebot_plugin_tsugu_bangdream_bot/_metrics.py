@@ -0,0 +1,282 @@
+'''命令耗时、错误与响应大小的统计'''
+
+import sys
+from random import random
+from time import monotonic, perf_counter
+from bisect import bisect_left
+from collections import Counter
+from types import TracebackType
+from typing import Any, Dict, List, Type, Tuple, Union, Mapping, Callable, Optional, Sequence
+
+from nonebot.matcher import Matcher, current_matcher
+
+try:
+    import resource
+except ImportError:
+    # Windows 下不可用
+    resource = None
+
+_DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+'''耗时直方图的桶上界（秒）'''
+_SIZE_BUCKETS = (1024, 10240, 102400, 262144, 524288, 1048576, 2097152, 5242880, 10485760)
+'''响应大小直方图的桶上界（字节）'''
+
+class Histogram:
+    '''固定桶的直方图，内存占用与观测次数无关，分位数由桶内线性插值估算'''
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        '''估算分位数，落在最后一个桶之外时返回最大的桶上界'''
+        if self.count < 1:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                if index >= len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+class _Span:
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics: 'Metrics', stage: str) -> None:
+        self.metrics = metrics
+        self.stage = stage
+        self.start = 0.0
+
+    def __enter__(self) -> '_Span':
+        self.start = perf_counter()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType]
+    ) -> None:
+        self.metrics.observe_stage(self.stage, perf_counter() - self.start, exc_type is not None)
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> '_NullSpan':
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType]
+    ) -> None:
+        return None
+
+_NULL_SPAN = _NullSpan()
+
+_STARTED = monotonic()
+
+def process_stats() -> Dict[str, float]:
+    '''获取进程的运行时间、峰值内存与 CPU 时间，便于压测时对比'''
+    stats: Dict[str, float] = {"uptime_seconds": monotonic() - _STARTED}
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        # ru_maxrss 在 macOS 下单位为字节，在 Linux 下为 KB
+        stats["max_rss_bytes"] = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+        stats["cpu_user_seconds"] = usage.ru_utime
+        stats["cpu_system_seconds"] = usage.ru_stime
+    return stats
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(labels: Mapping[str, str]) -> str:
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+
+class Metrics:
+    '''命令级统计
+
+    命令耗时按命令统计，阶段耗时（`user`、`backend`、`decode`、`build`、`send`）按命令与阶段统计，
+    命令由当前正在运行的事件响应器确定。采样率为 `0` 时阶段计时退化为空操作。
+    '''
+    def __init__(self, module: str) -> None:
+        self.module = module
+        '''插件模块名，用于识别本插件的事件响应器'''
+        self.sample_rate = 1.0
+        '''采样率，`<= 0` 时关闭计时'''
+        self.names: Dict[Type[Matcher], str] = {}
+        '''非命令事件响应器的名称'''
+        self.durations: Dict[Tuple[str, str], Histogram] = {}
+        '''耗时直方图，键为 (命令, 阶段)，阶段 `command` 为整个命令'''
+        self.sizes: Dict[str, Histogram] = {}
+        '''响应大小直方图，键为命令'''
+        self.errors: 'Counter[Tuple[str, str]]' = Counter()
+        '''错误计数，键为 (命令, 阶段)'''
+        self.sources: Dict[str, Callable[[], Mapping[str, Any]]] = {}
+        '''其他组件的统计信息来源'''
+        self._commands: Dict[Type[Matcher], Optional[str]] = {}
+
+    def sampled(self) -> bool:
+        '''决定本次是否计时'''
+        return self.sample_rate >= 1 or (self.sample_rate > 0 and random() < self.sample_rate)
+
+    def command_of(self, matcher: Union[Matcher, Type[Matcher]]) -> Optional[str]:
+        '''获取事件响应器对应的命令名，不属于本插件时返回 `None`'''
+        cls = matcher if isinstance(matcher, type) else type(matcher)
+        try:
+            return self._commands[cls]
+        except KeyError:
+            pass
+
+        name: Optional[str] = None
+        if (cls.module_name or "").startswith(self.module):
+            for base in cls.__mro__:
+                if base in self.names:
+                    name = self.names[base]
+                    break
+            else:
+                command = getattr(cls, "command", None)
+                alconna = command() if callable(command) else None
+                name = getattr(alconna, "command", None) or cls.__name__
+            name = str(name)
+        self._commands[cls] = name
+        return name
+
+    def current_command(self) -> Optional[str]:
+        matcher = current_matcher.get(None)
+        return self.command_of(matcher) if matcher is not None else None
+
+    def span(self, stage: str) -> Union[_Span, _NullSpan]:
+        '''为当前命令的一个阶段计时'''
+        if self.sample_rate <= 0 or not self.sampled():
+            return _NULL_SPAN
+        return _Span(self, stage)
+
+    def observe_stage(self, stage: str, duration: float, error: bool=False, command: Optional[str]=None) -> None:
+        command = command or self.current_command() or "-"
+        histogram = self.durations.get((command, stage))
+        if histogram is None:
+            histogram = self.durations[(command, stage)] = Histogram(_DURATION_BUCKETS)
+        histogram.observe(duration)
+        if error:
+            self.errors[(command, stage)] += 1
+
+    def observe_size(self, size: int) -> None:
+        '''记录当前命令的响应大小'''
+        if self.sample_rate <= 0:
+            return
+        command = self.current_command() or "-"
+        histogram = self.sizes.get(command)
+        if histogram is None:
+            histogram = self.sizes[command] = Histogram(_SIZE_BUCKETS)
+        histogram.observe(size)
+
+    def reset(self) -> None:
+        '''清空统计数据'''
+        self.durations.clear()
+        self.sizes.clear()
+        self.errors.clear()
+
+    def summary(self) -> str:
+        '''生成便于阅读的统计摘要'''
+        lines: List[str] = []
+        commands = sorted({command for command, _ in self.durations})
+        for command in commands:
+            total = self.durations.get((command, "command"))
+            if total is not None:
+                lines.append(
+                    f"{command}: {total.count} 次, 错误 {self.errors[(command, 'command')]} 次, "
+                    f"p50 {total.quantile(0.5) * 1000:.0f}ms / p95 {total.quantile(0.95) * 1000:.0f}ms / "
+                    f"p99 {total.quantile(0.99) * 1000:.0f}ms"
+                )
+            else:
+                lines.append(f"{command}:")
+            for (_command, stage), histogram in sorted(self.durations.items()):
+                if _command != command or stage == "command":
+                    continue
+                lines.append(
+                    f"  {stage}: {histogram.count} 次, 错误 {self.errors[(command, stage)]} 次, "
+                    f"p50 {histogram.quantile(0.5) * 1000:.1f}ms / p95 {histogram.quantile(0.95) * 1000:.1f}ms"
+                )
+            size = self.sizes.get(command)
+            if size is not None:
+                lines.append(f"  size: p50 {size.quantile(0.5) / 1024:.0f}KB / p95 {size.quantile(0.95) / 1024:.0f}KB")
+
+        for name, source in self.sources.items():
+            try:
+                stats = source()
+            except Exception as exception:
+                stats = {"error": repr(exception)}
+            lines.append(f"{name}: {dict(stats)}")
+        return "\n".join(lines) if lines else "暂无统计数据"
+
+    def render_prometheus(self) -> str:
+        '''生成 Prometheus 文本格式的统计数据'''
+        lines: List[str] = []
+
+        def histogram(name: str, help: str, histograms: Dict[Any, Histogram], labels: Callable[[Any], Dict[str, str]]) -> None:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, _histogram in sorted(histograms.items()):
+                key_labels = labels(key)
+                cumulative = 0
+                for bound, count in zip(_histogram.buckets, _histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{_labels({**key_labels, "le": repr(float(bound))})}}} {cumulative}')
+                lines.append(f'{name}_bucket{{{_labels({**key_labels, "le": "+Inf"})}}} {_histogram.count}')
+                lines.append(f"{name}_sum{{{_labels(key_labels)}}} {_histogram.sum}")
+                lines.append(f"{name}_count{{{_labels(key_labels)}}} {_histogram.count}")
+
+        histogram(
+            "tsugu_duration_seconds", "Duration of commands and their stages.",
+            self.durations, lambda key: {"command": key[0], "stage": key[1]}
+        )
+        histogram(
+            "tsugu_response_size_bytes", "Size of rendered responses.",
+            self.sizes, lambda key: {"command": key}
+        )
+
+        lines.append("# HELP tsugu_errors_total Errors raised in commands and their stages.")
+        lines.append("# TYPE tsugu_errors_total counter")
+        for (command, stage), count in sorted(self.errors.items()):
+            lines.append(f"tsugu_errors_total{{{_labels({'command': command, 'stage': stage})}}} {count}")
+
+        gauges: Dict[str, List[str]] = {}
+        for name, source in self.sources.items():
+            try:
+                stats = source()
+            except Exception:
+                continue
+            metric = f"tsugu_{name}"
+            for key, value in stats.items():
+                if isinstance(value, Mapping):
+                    # 嵌套的统计信息（如各个通道）以标签区分
+                    for field, _value in value.items():
+                        if isinstance(_value, (int, float)):
+                            gauges.setdefault(f"{metric}_{field}", []).append(f"{{{_labels({'name': str(key)})}}} {_value}")
+                elif isinstance(value, (int, float)):
+                    gauges.setdefault(metric, []).append(f"{{{_labels({'key': str(key)})}}} {value}")
+                else:
+                    gauges.setdefault(metric, []).append(f"{{{_labels({'key': str(key), 'value': str(value)})}}} 1")
+        for metric, samples in gauges.items():
+            lines.append(f"# TYPE {metric} gauge")
+            lines.extend(f"{metric}{sample}" for sample in samples)
+
+        lines.append("")
+        return "\n".join(lines)
+
+metrics = Metrics(__name__.rpartition(".")[0])
+'''插件统计数据'''
@@ -0,0 +1,135 @@
+'''当前活动档线预测的后台预渲染'''
+
+import asyncio
+from time import time, monotonic
+from typing import TYPE_CHECKING, Dict, List, Union, Optional
+
+from nonebot import logger
+
+from ._scheduler import scheduler
+from ._commands import cutoff_cache, cutoff_demand, prerender_cutoff
+
+if TYPE_CHECKING:
+    from tsugu_api_core._typing import ServerId
+
+class Prerenderer:
+    '''在每次预期的档线数据更新后预渲染最近被请求过的当前活动档线预测
+
+    只预渲染在 `idle` 秒内有人请求过的服务器与档位，长时间无人请求时不再发出任何请求。
+    各服务器之间间隔 `stagger` 秒，同一时刻最多占用一个后端并发名额，通道繁忙时让出给用户请求。
+    单次渲染超过 `slow` 秒或失败时按指数退避，恢复正常后重置。
+    '''
+    def __init__(self) -> None:
+        self.enabled = False
+        '''是否启用预渲染'''
+        self.stagger: float = 30
+        '''相邻服务器之间的间隔（秒）'''
+        self.idle: float = 3600
+        '''超过多久无人请求后停止预渲染（秒）'''
+        self.slow: float = 10
+        '''单次渲染超过多久视为后端缓慢（秒）'''
+        self.max_backoff: float = 300
+        '''最长退避时间（秒）'''
+        self.backoff: float = 0
+        '''当前退避时间（秒）'''
+        self.rendered = 0
+        '''实际渲染的次数'''
+        self.skipped = 0
+        '''因缓存仍有效或通道繁忙而跳过的次数'''
+        self.failed = 0
+        '''渲染失败的次数'''
+        self.slowed = 0
+        '''渲染缓慢的次数'''
+        self._task: Optional['asyncio.Task[None]'] = None
+
+    def targets(self) -> Dict['ServerId', List[Optional[int]]]:
+        '''获取需要预渲染的服务器与档位，同时清理超时未请求的记录'''
+        now = time()
+        targets: Dict['ServerId', List[Optional[int]]] = {}
+        for (server, tier), requested in list(cutoff_demand.items()):
+            if now - requested > self.idle:
+                del cutoff_demand[(server, tier)]
+                continue
+            targets.setdefault(server, []).append(tier)
+        return targets
+
+    async def _wait_for_budget(self, lane: str, deadline: float) -> bool:
+        # 保留至少一个并发名额给用户请求，有请求在排队时不占用通道
+        _lane = scheduler.lane(lane)
+        while _lane.waiting > 0 or (_lane.concurrency > 0 and _lane.running >= max(_lane.concurrency - 1, 1)):
+            if monotonic() >= deadline:
+                return False
+            await asyncio.sleep(1)
+        return True
+
+    async def _prerender(self, server: 'ServerId', tier: Optional[int]) -> None:
+        lane = "heavy" if tier is None else "render"
+        if not await self._wait_for_budget(lane, monotonic() + max(self.stagger, 1)):
+            self.skipped += 1
+            return
+
+        start = monotonic()
+        try:
+            rendered = await prerender_cutoff(server, tier)
+        except Exception as exception:
+            self.failed += 1
+            self.backoff = min(max(self.backoff * 2, 1), self.max_backoff)
+            logger.opt(exception=exception).debug(f'Failed to prerender cutoff {server} {tier}')
+            return
+
+        if not rendered:
+            self.skipped += 1
+            return
+        self.rendered += 1
+        if monotonic() - start > self.slow:
+            self.slowed += 1
+            self.backoff = min(max(self.backoff * 2, 1), self.max_backoff)
+        else:
+            self.backoff = 0
+
+    async def run_once(self) -> None:
+        '''预渲染一轮'''
+        for index, (server, tiers) in enumerate(sorted(self.targets().items())):
+            if index > 0:
+                await asyncio.sleep(self.stagger)
+            for tier in tiers:
+                if self.backoff > 0:
+                    await asyncio.sleep(self.backoff)
+                await self._prerender(server, tier)
+
+    async def _run(self) -> None:
+        while True:
+            # 缓存在预期的数据更新时刻过期，此时预渲染可以让之后的请求直接命中
+            await asyncio.sleep(max(cutoff_cache.next_update() - time(), 0))
+            try:
+                await self.run_once()
+            except Exception as exception:
+                logger.opt(exception=exception).warning('Failed to prerender cutoff')
+
+    async def start(self) -> None:
+        '''启动预渲染'''
+        if self.enabled and cutoff_cache.enabled and self._task is None:
+            # 只在预渲染运行时记录请求，记录由 `targets` 定期清理
+            cutoff_demand.enabled = True
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        '''停止预渲染'''
+        cutoff_demand.enabled = False
+        cutoff_demand.clear()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        '''获取统计信息'''
+        return {
+            "demand": len(cutoff_demand),
+            "rendered": self.rendered,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "slowed": self.slowed,
+            "backoff": self.backoff,
+        }
+
+prerenderer = Prerenderer()
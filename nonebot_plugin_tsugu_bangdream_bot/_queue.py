@@ -0,0 +1,136 @@
+'''后台提交队列'''
+
+import asyncio
+from typing import Any, Dict, List, Tuple, Generic, TypeVar, Callable, Hashable, Optional, Awaitable
+
+from nonebot import logger
+
+from ._cache import TTLCache
+
+_T = TypeVar("_T")
+
+class SubmitQueue(Generic[_T]):
+    '''在后台提交的队列
+
+    相同的键在等待提交期间与提交成功后的 `window` 秒内只会入队一次，提交失败时清除该键，
+    之后相同的项可以重新入队。调用方入队后立即返回，不等待提交完成。
+    后台任务每次最多取出 `batch_size` 项，以不超过 `concurrency` 的并发提交。
+
+    参数:
+        submit (Callable[[_T], Awaitable[Any]]): 提交单项的方法，返回 `False` 或抛出异常时视为失败，异常将被记录
+        window (float): 去重窗口（秒），`<= 0` 时不去重
+        maxsize (int): 队列长度，已满时丢弃新的项
+        batch_size (int): 每批最多提交的项数
+        concurrency (int): 每批的最大并发数
+    '''
+    def __init__(
+        self,
+        submit: Callable[[_T], Awaitable[Any]],
+        window: float,
+        maxsize: int=256,
+        batch_size: int=8,
+        concurrency: int=4
+    ) -> None:
+        self.submit = submit
+        self.maxsize = maxsize
+        '''队列长度'''
+        self.batch_size = batch_size
+        '''每批最多提交的项数'''
+        self.concurrency = concurrency
+        '''每批的最大并发数'''
+        self.queued = 0
+        '''入队的项数'''
+        self.deduplicated = 0
+        '''因重复而被丢弃的项数'''
+        self.dropped = 0
+        '''因队列已满而被丢弃的项数'''
+        self.failed = 0
+        '''提交失败的项数'''
+        self.batches = 0
+        '''已提交的批次数'''
+        self._seen: 'TTLCache[Hashable, bool]' = TTLCache(1024, window)
+        self._queue: Optional['asyncio.Queue[Tuple[Hashable, _T]]'] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._task: Optional['asyncio.Task[None]'] = None
+
+    @property
+    def window(self) -> float:
+        '''去重窗口（秒）'''
+        return self._seen.ttl
+
+    @window.setter
+    def window(self, value: float) -> None:
+        self._seen.ttl = value
+
+    def put(self, key: Hashable, item: _T) -> bool:
+        '''将一项放入队列，重复或队列已满时返回 `False`'''
+        if self._seen.enabled and self._seen.get(key) is not None:
+            self.deduplicated += 1
+            return False
+
+        if self._queue is None:
+            # 在事件循环中延迟创建，避免绑定到导入时的事件循环
+            self._queue = asyncio.Queue(max(self.maxsize, 1))
+        if self._queue.full():
+            self.dropped += 1
+            return False
+
+        # 入队时即记录该键，等待提交期间相同的项不会重复入队
+        self._queue.put_nowait((key, item))
+        self._seen.set(key, True)
+        self.queued += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        return True
+
+    async def _submit(self, key: Hashable, item: _T) -> None:
+        assert self._semaphore is not None
+        async with self._semaphore:
+            try:
+                succeeded = await self.submit(item) is not False
+            except Exception as exception:
+                logger.opt(exception=exception).debug('Failed to submit queued item')
+                succeeded = False
+        if succeeded:
+            # 去重窗口从提交成功时开始计算
+            self._seen.set(key, True)
+        else:
+            self.failed += 1
+            self._seen.pop(key)
+
+    async def _run(self) -> None:
+        assert self._queue is not None
+        self._semaphore = asyncio.Semaphore(max(self.concurrency, 1))
+        while True:
+            batch: List[Tuple[Hashable, _T]] = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await asyncio.gather(*(self._submit(key, item) for key, item in batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            self.batches += 1
+
+    async def stop(self, timeout: float=5) -> None:
+        '''等待队列中剩余的项提交完成，超时后放弃'''
+        if self._task is None:
+            return
+        if self._queue is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Dropped {self._queue.qsize()} queued items on shutdown")
+        self._task.cancel()
+        self._task = None
+
+    def stats(self) -> Dict[str, int]:
+        '''获取统计信息'''
+        return {
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "queued": self.queued,
+            "deduplicated": self.deduplicated,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
@@ -0,0 +1,119 @@
+'''向后端发送请求的准入控制'''
+
+import asyncio
+from time import monotonic
+from types import TracebackType
+from typing import Dict, Type, Union, Optional
+
+class BusyError(Exception):
+    '''等待队列已满时拒绝请求的异常'''
+
+class Lane:
+    '''一类请求的并发通道
+
+    超出并发数的请求进入等待队列，队列已满时立即以 `BusyError` 拒绝。
+
+    参数:
+        name (str): 通道名称
+        concurrency (int): 最大并发数，`<= 0` 时不限制
+        queue_size (int): 等待队列长度
+    '''
+    def __init__(self, name: str, concurrency: int, queue_size: int) -> None:
+        self.name = name
+        '''通道名称'''
+        self.concurrency = concurrency
+        '''最大并发数'''
+        self.queue_size = queue_size
+        '''等待队列长度'''
+        self.running = 0
+        '''正在执行的请求数'''
+        self.waiting = 0
+        '''正在等待的请求数'''
+        self.admitted = 0
+        '''已准入的请求数'''
+        self.rejected = 0
+        '''被拒绝的请求数'''
+        self.total_wait = 0.0
+        '''准入请求的总等待时间（秒）'''
+        self.max_wait = 0.0
+        '''准入请求的最长等待时间（秒）'''
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def acquire(self) -> None:
+        if self.concurrency <= 0:
+            self.running += 1
+            self.admitted += 1
+            return
+
+        if self._semaphore is None:
+            # 在事件循环中延迟创建，避免绑定到导入时的事件循环
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        if self._semaphore.locked() and self.waiting >= self.queue_size:
+            self.rejected += 1
+            raise BusyError("当前请求过多，请稍后再试")
+
+        start = monotonic()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        wait = monotonic() - start
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.running += 1
+        self.admitted += 1
+
+    def release(self) -> None:
+        self.running -= 1
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    async def __aenter__(self) -> 'Lane':
+        await self.acquire()
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType]
+    ) -> None:
+        self.release()
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        '''获取通道统计信息'''
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_wait": self.total_wait / self.admitted if self.admitted else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+class Scheduler:
+    '''按请求类别划分并发通道的调度器'''
+    def __init__(self) -> None:
+        self.lanes: Dict[str, Lane] = {}
+        '''所有并发通道'''
+
+    def configure(self, name: str, concurrency: int, queue_size: int) -> None:
+        '''设置通道的并发数与等待队列长度，需在发出请求前调用'''
+        self.lanes[name] = Lane(name, concurrency, queue_size)
+
+    def lane(self, name: str) -> Lane:
+        '''获取指定通道'''
+        return self.lanes[name]
+
+    def stats(self) -> Dict[str, Dict[str, Union[int, float]]]:
+        '''获取所有通道的统计信息'''
+        return {name: lane.stats() for name, lane in self.lanes.items()}
+
+scheduler = Scheduler()
+'''后端请求调度器，包含 `light`（用户数据与模糊搜索）、`render`（一般渲染）与 `heavy`（抽卡模拟、全档线与车牌列表渲染）三个通道'''
+scheduler.configure("light", 16, 64)
+scheduler.configure("render", 8, 32)
+scheduler.configure("heavy", 2, 8)
@@ -0,0 +1,173 @@
+'''渲染图片的重新编码
+
+后端返回的图片均为 PNG，体积较大的图片（如抽卡模拟与全档线）上传到聊天平台较慢。
+开启后将图片在线程池中重新编码为 JPEG 或 WebP，并可限制最大边长，编码后未变小的图片保留原图。
+
+需要安装 `Pillow`，未安装时不进行重新编码。
+'''
+
+import asyncio
+from io import BytesIO
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Union, Optional
+
+from nonebot import logger
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from ._cache import RenderedParts
+from ._metrics import metrics
+
+FORMATS = ("jpeg", "webp")
+'''支持的目标格式'''
+
+def _transcode(data: bytes, format: str, quality: int, max_size: int) -> bytes:
+    # 在工作线程中执行，Pillow 解码、缩放与编码时会释放 GIL
+    assert Image is not None
+    with Image.open(BytesIO(data)) as image:
+        image.load()
+        if max_size > 0 and max(image.size) > max_size:
+            image.thumbnail((max_size, max_size), Image.LANCZOS)
+        if format == "jpeg" and image.mode not in ("RGB", "L"):
+            # JPEG 不支持透明通道，以白色背景合成
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif format == "webp" and image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+
+        output = BytesIO()
+        image.save(output, format=format.upper(), quality=quality, optimize=True)
+        return output.getvalue()
+
+class Transcoder:
+    '''渲染图片的重新编码
+
+    同一渲染结果中的图片并发编码，编码失败或未变小时保留原图。
+    '''
+    def __init__(self) -> None:
+        self.format = ""
+        '''目标格式，为空时不重新编码'''
+        self.quality = 85
+        '''编码质量'''
+        self.max_size = 0
+        '''最大边长（像素），`<= 0` 时不缩放'''
+        self.workers = 2
+        '''工作线程数'''
+        self.min_bytes = 16 * 1024
+        '''小于该大小（字节）的图片不重新编码'''
+        self.images = 0
+        '''尝试重新编码的图片数'''
+        self.transcoded = 0
+        '''采用重新编码结果的图片数'''
+        self.kept = 0
+        '''编码后未变小而保留原图的图片数'''
+        self.failed = 0
+        '''编码失败的图片数'''
+        self.bytes_in = 0
+        '''尝试重新编码的图片总字节数'''
+        self.bytes_saved = 0
+        '''重新编码节省的总字节数'''
+        self.seconds = 0.0
+        '''重新编码花费的总时间（秒）'''
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stopped = False
+
+    @property
+    def enabled(self) -> bool:
+        return Image is not None and self.format in FORMATS
+
+    @property
+    def key(self) -> Optional[Tuple[str, int, int]]:
+        '''影响编码结果的设置，用于区分缓存'''
+        return (self.format, self.quality, self.max_size) if self.enabled else None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # 使用线程池而非进程池：插件运行在多线程的进程中，fork 出的子进程可能继承被占用的锁，
+        # 而 spawn 启动的子进程需要重新导入插件包，无法在 NoneBot 初始化之外完成
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=max(self.workers, 1), thread_name_prefix="tsugu-transcode")
+        return self._executor
+
+    async def start(self) -> None:
+        '''检查配置并预先创建线程池'''
+        self._stopped = False
+        if self.format and Image is None:
+            logger.warning("Pillow is not installed, rendered images will not be transcoded")
+            return
+        if self.format and self.format not in FORMATS:
+            logger.warning(f"Unsupported image format '{self.format}', rendered images will not be transcoded")
+            return
+        if self.enabled:
+            self._get_executor()
+
+    async def stop(self) -> None:
+        '''关闭线程池'''
+        self._stopped = True
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def _transcode_one(self, data: bytes) -> bytes:
+        # 各图片的编码在关闭线程池之后才开始时保留原图，不重新创建线程池
+        if self._stopped:
+            return data
+        loop = asyncio.get_running_loop()
+        self.images += 1
+        self.bytes_in += len(data)
+        try:
+            result = await loop.run_in_executor(
+                self._get_executor(), _transcode, data, self.format, self.quality, self.max_size
+            )
+        except Exception as exception:
+            self.failed += 1
+            logger.opt(exception=exception).debug('Failed to transcode image')
+            return data
+
+        if len(result) >= len(data):
+            self.kept += 1
+            return data
+        self.transcoded += 1
+        self.bytes_saved += len(data) - len(result)
+        return result
+
+    async def transcode(self, parts: RenderedParts) -> RenderedParts:
+        '''重新编码渲染结果中的图片，未开启时原样返回'''
+        if not self.enabled:
+            return parts
+        indexes = [
+            index for index, (_type, value) in enumerate(parts)
+            if _type == "image" and isinstance(value, bytes) and len(value) >= self.min_bytes
+        ]
+        if not indexes:
+            return parts
+
+        start = perf_counter()
+        with metrics.span("transcode"):
+            results = await asyncio.gather(*(self._transcode_one(parts[index][1]) for index in indexes)) # type: ignore
+        self.seconds += perf_counter() - start
+
+        _parts: List[Tuple[str, Union[str, bytes]]] = list(parts)
+        for index, result in zip(indexes, results):
+            _parts[index] = ("image", result)
+        return tuple(_parts)
+
+    def stats(self) -> Dict[str, Union[int, float, str]]:
+        '''获取统计信息'''
+        return {
+            "format": self.format if self.enabled else "",
+            "images": self.images,
+            "transcoded": self.transcoded,
+            "kept": self.kept,
+            "failed": self.failed,
+            "bytes_in": self.bytes_in,
+            "bytes_saved": self.bytes_saved,
+            "seconds": self.seconds,
+        }
+
+transcoder = Transcoder()
@@ -0,0 +1,228 @@
+'''用户数据的本地持久化镜像
+
+用户数据以 JSON 保存在 SQLite 数据库中，读取时优先使用本地数据并在后台向后端刷新，
+后端缓慢或不可用时命令不再被用户数据阻塞。插件自身的修改在后端成功后写入镜像。
+'''
+
+import json
+import asyncio
+import sqlite3
+from pathlib import Path
+from time import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple, Callable, Optional, Awaitable, cast
+
+from nonebot import logger
+
+if TYPE_CHECKING:
+    from tsugu_api_core._typing import _TsuguUser, PartialTsuguUser
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    platform TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (platform, user_id)
+)
+'''
+
+class UserStore:
+    '''用户数据的本地持久化镜像
+
+    数据库在首次使用时打开，所有读写在同一个工作线程中执行，不阻塞事件循环。
+    定时按更新时间从旧到新抽取一批记录向后端校验，不一致时以后端为准。
+    '''
+    def __init__(self) -> None:
+        self.path: Optional[Path] = None
+        '''数据库路径，为 `None` 时不启用'''
+        self.refresh_age: float = 300
+        '''读取时记录超过多久（秒）未更新则在后台刷新'''
+        self.check_interval: float = 3600
+        '''一致性校验的间隔（秒），`<= 0` 时不校验'''
+        self.check_size = 32
+        '''每次一致性校验的记录数'''
+        self.fetch: Optional[Callable[[str, str], Awaitable['_TsuguUser']]] = None
+        '''从后端获取用户数据的方法，用于一致性校验'''
+        self.invalidate: Optional[Callable[[str, str], None]] = None
+        '''记录被一致性校验更新后调用的方法，用于清除内存中的缓存'''
+        self.hits = 0
+        '''命中次数'''
+        self.misses = 0
+        '''未命中次数'''
+        self.writes = 0
+        '''写入次数'''
+        self.checked = 0
+        '''已校验的记录数'''
+        self.mismatches = 0
+        '''与后端不一致的记录数'''
+        self._connection: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._task: Optional['asyncio.Task[None]'] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            assert self.path is not None
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(_SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        if self._executor is None:
+            # 单个工作线程，保证同一连接上的操作依次执行
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tsugu-userstore")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _get(self, platform: str, user_id: str) -> Optional[Tuple[str, float]]:
+        return self._connect().execute(
+            "SELECT data, updated_at FROM users WHERE platform = ? AND user_id = ?", (platform, user_id)
+        ).fetchone()
+
+    def _put(self, platform: str, user_id: str, data: str) -> None:
+        self._connect().execute(
+            "INSERT OR REPLACE INTO users (platform, user_id, data, updated_at) VALUES (?, ?, ?, ?)",
+            (platform, user_id, data, time())
+        )
+
+    def _replace(self, platform: str, user_id: str, data: str, updated_at: float) -> bool:
+        # 仅在记录自读取后未被修改或删除时写入
+        return self._connect().execute(
+            "UPDATE users SET data = ?, updated_at = ? WHERE platform = ? AND user_id = ? AND updated_at = ?",
+            (data, time(), platform, user_id, updated_at)
+        ).rowcount > 0
+
+    def _touch(self, platform: str, user_id: str, updated_at: float) -> None:
+        # 数据未变化时只更新校验时间，使下次校验轮到其他记录
+        self._connect().execute(
+            "UPDATE users SET updated_at = ? WHERE platform = ? AND user_id = ? AND updated_at = ?",
+            (time(), platform, user_id, updated_at)
+        )
+
+    def _patch(self, platform: str, user_id: str, update: Dict[str, Any]) -> bool:
+        connection = self._connect()
+        # 读取与写回在同一个事务中完成
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT data FROM users WHERE platform = ? AND user_id = ?", (platform, user_id)
+            ).fetchone()
+            if row is not None:
+                data = json.loads(row[0])
+                data.update(update)
+                connection.execute(
+                    "UPDATE users SET data = ?, updated_at = ? WHERE platform = ? AND user_id = ?",
+                    (json.dumps(data, ensure_ascii=False), time(), platform, user_id)
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return row is not None
+
+    def _delete(self, platform: str, user_id: str) -> None:
+        self._connect().execute("DELETE FROM users WHERE platform = ? AND user_id = ?", (platform, user_id))
+
+    def _oldest(self, limit: int) -> List[Tuple[str, str, str, float]]:
+        return self._connect().execute(
+            "SELECT platform, user_id, data, updated_at FROM users ORDER BY updated_at LIMIT ?", (limit,)
+        ).fetchall()
+
+    async def get(self, platform: str, user_id: str) -> Optional[Tuple['_TsuguUser', float]]:
+        '''获取用户数据与其更新时间，不存在时返回 `None`'''
+        row = await self._run(self._get, platform, user_id)
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return cast('_TsuguUser', json.loads(row[0])), row[1]
+
+    async def put(self, platform: str, user_id: str, tsugu_user: '_TsuguUser') -> None:
+        '''写入从后端获取的用户数据'''
+        await self._run(self._put, platform, user_id, json.dumps(tsugu_user, ensure_ascii=False))
+        self.writes += 1
+
+    async def patch(self, platform: str, user_id: str, update: 'PartialTsuguUser') -> None:
+        '''将插件自身对用户数据的修改写入镜像，记录不存在时忽略'''
+        if await self._run(self._patch, platform, user_id, dict(update)):
+            self.writes += 1
+
+    async def delete(self, platform: str, user_id: str) -> None:
+        '''删除用户数据，下次读取时将从后端获取'''
+        await self._run(self._delete, platform, user_id)
+
+    async def check(self) -> int:
+        '''校验最久未更新的一批记录，返回不一致的记录数
+
+        数据一致时只更新校验时间；校验期间被插件修改或删除的记录不会被覆盖，更新后的记录同时从内存缓存中清除。
+        '''
+        if self.fetch is None:
+            return 0
+        mismatches = 0
+        for platform, user_id, data, updated_at in await self._run(self._oldest, self.check_size):
+            try:
+                tsugu_user = await self.fetch(platform, user_id)
+            except Exception as exception:
+                # 后端不可用时停止本次校验
+                logger.debug(f"Failed to check user data: {repr(exception)}")
+                break
+            self.checked += 1
+            if json.loads(data) == tsugu_user:
+                await self._run(self._touch, platform, user_id, updated_at)
+                continue
+            mismatches += 1
+            # 获取期间记录可能已被修改，此时后端返回的数据可能早于修改
+            if not await self._run(self._replace, platform, user_id, json.dumps(tsugu_user, ensure_ascii=False), updated_at):
+                continue
+            self.writes += 1
+            if self.invalidate is not None:
+                self.invalidate(platform, user_id)
+        self.mismatches += mismatches
+        return mismatches
+
+    async def _check_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                mismatches = await self.check()
+            except Exception as exception:
+                logger.warning(f"Failed to check user data: {repr(exception)}")
+                continue
+            if mismatches > 0:
+                logger.debug(f"Corrected {mismatches} user data records from the backend")
+
+    async def start(self) -> None:
+        '''启动定时一致性校验，数据库仍在首次使用时打开'''
+        if self.enabled and self.check_interval > 0 and self._task is None:
+            self._task = asyncio.ensure_future(self._check_loop())
+
+    async def stop(self) -> None:
+        '''停止校验并关闭数据库'''
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._executor is not None:
+            if self._connection is not None:
+                await self._run(self._connection.close)
+                self._connection = None
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self) -> Dict[str, int]:
+        '''获取统计信息'''
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "checked": self.checked,
+            "mismatches": self.mismatches,
+        }
+
+user_store = UserStore()
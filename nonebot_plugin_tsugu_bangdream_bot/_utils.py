@@ -1,7 +1,8 @@
-from typing import TYPE_CHECKING, List
+import unicodedata
+from typing import TYPE_CHECKING, Dict, List, Tuple
 
 if TYPE_CHECKING:
-    from tsugu_api_core._typing import ServerId, ServerName
+    from tsugu_api_core._typing import ServerId, ServerName, _DifficultyId
 
 TIER_LISTS = {
     "jp": [20, 30, 40, 50, 100, 200, 300, 400, 500, 1000, 2000, 5000, 10000, 20000, 30000, 50000],
@@ -112,39 +113,49 @@ USAGES = {
     抽卡模拟 300 922 :模拟抽卡300次，卡池为922号卡池"""
 }
 
+def _normalize_name(name: str) -> str:
+    # 统一全角/半角与大小写，并去除空白
+    return "".join(unicodedata.normalize("NFKC", name).casefold().split())
+
+_SERVER_ALIASES: Dict['ServerId', Tuple[str, ...]] = {
+    0: ("0", "日服", "日", "日本", "日本服", "jp", "jpn", "japan", "ja"),
+    1: ("1", "国际服", "国际", "國際服", "en", "eng", "global", "gl", "intl", "us", "美服", "英服", "外服"),
+    2: ("2", "台服", "台", "台湾", "台湾服", "臺服", "繁中服", "繁体服", "tw", "taiwan"),
+    3: ("3", "国服", "国", "國服", "囯服", "中国服", "简中服", "陆服", "大陆服", "cn", "china", "zh"),
+    4: ("4", "韩服", "韩", "韓服", "韩国服", "kr", "kor", "korea"),
+}
+
+_SERVER_TABLE: Dict[str, 'ServerId'] = {
+    _normalize_name(alias): server
+    for server, aliases in _SERVER_ALIASES.items()
+    for alias in aliases
+}
+
+_DIFFICULTY_ALIASES: Dict['_DifficultyId', Tuple[str, ...]] = {
+    0: ("0", "ez", "easy", "简单", "簡單"),
+    1: ("1", "nm", "normal", "普通", "nor"),
+    2: ("2", "hd", "hard", "困难", "困難"),
+    3: ("3", "ex", "expert", "专家", "專家", "exp"),
+    4: ("4", "sp", "special", "特殊"),
+}
+
+_DIFFICULTY_TABLE: Dict[str, '_DifficultyId'] = {
+    _normalize_name(alias): difficulty
+    for difficulty, aliases in _DIFFICULTY_ALIASES.items()
+    for alias in aliases
+}
+
 def server_name_to_id(server: str) -> 'ServerId':
-    if server == "0":
-        return 0
-    elif server == "1":
-        return 1
-    elif server == "2":
-        return 2
-    elif server == "3":
-        return 3
-    elif server == "4":
-        return 4
-    elif server == "日服":
-        return 0
-    elif server == "国际服":
-        return 1
-    elif server == "台服":
-        return 2
-    elif server == "国服":
-        return 3
-    elif server == "韩服":
-        return 4
-    elif server == "jp":
-        return 0
-    elif server == "en":
-        return 1
-    elif server == "tw":
-        return 2
-    elif server == "cn":
-        return 3
-    elif server == "kr":
-        return 4
-    else:
-        raise ValueError("服务器不存在")
+    try:
+        return _SERVER_TABLE[_normalize_name(server)]
+    except KeyError:
+        raise ValueError("服务器不存在") from None
+
+def difficulty_name_to_id(difficulty: str) -> '_DifficultyId':
+    try:
+        return _DIFFICULTY_TABLE[_normalize_name(difficulty)]
+    except KeyError:
+        raise ValueError("难度不存在") from None
 
 def server_id_to_full_name(server: 'ServerId') -> str:
     if server == 0:
@@ -1,4 +1,5 @@
-from typing import Set, Optional
+from pathlib import Path
+from typing import Set, Dict, List, Union, Optional
 
 from pydantic import BaseModel
 
@@ -76,20 +77,75 @@ class Config(BaseModel):
     tsugu_use_easy_bg: bool = False
     tsugu_compress: bool = False
     tsugu_bandori_station_token: Optional[str] = None
+    tsugu_car_keywords: Set[str] = set()
+    tsugu_fake_keywords: Set[str] = set()
     
     tsugu_reply: bool = False
     tsugu_at: bool = False
     tsugu_no_space: bool = False
+    tsugu_command_gate: bool = True
+    tsugu_metrics_sample_rate: float = 1.0
+    tsugu_metrics_path: str = ""
 
     tsugu_retries: int = 3
+    tsugu_retry_budget_ratio: float = 0.2
+    tsugu_retry_budget_burst: float = 10
+    tsugu_breaker_threshold: int = 5
+    tsugu_breaker_reset_timeout: float = 30
     
-    tsugu_backend_url: str = ""
-    tsugu_data_backend_url: str = ""
+    tsugu_backend_url: Union[str, List[str]] = ""
+    tsugu_data_backend_url: Union[str, List[str]] = ""
+    tsugu_backend_check_interval: float = 30
+    tsugu_backend_hedge: bool = False
+    tsugu_backend_hedge_min_delay: float = 0.05
+    tsugu_json_codec: str = ""
+    tsugu_json_offload_size: int = 256 * 1024
     
     tsugu_proxy: str = ""
     tsugu_backend_proxy: bool = False
     tsugu_data_backend_proxy: bool = False
     tsugu_timeout: int = 10
+    tsugu_max_connections: int = 10
+    tsugu_idle_timeout: float = 60
+    
+    tsugu_light_concurrency: int = 16
+    tsugu_light_queue_size: int = 64
+    tsugu_render_concurrency: int = 8
+    tsugu_render_queue_size: int = 32
+    tsugu_heavy_concurrency: int = 2
+    tsugu_heavy_queue_size: int = 8
+    
+    tsugu_user_cache_size: int = 1024
+    tsugu_user_cache_ttl: float = 300
+    tsugu_user_store_path: Optional[Path] = None
+    tsugu_user_store_refresh: float = 300
+    tsugu_user_store_check_interval: float = 3600
+    tsugu_response_cache_size: int = 64 * 1024 * 1024
+    tsugu_response_cache_ttl: float = 21600
+    tsugu_response_cache_dir: Optional[Path] = None
+    tsugu_response_cache_disk_size: int = 256 * 1024 * 1024
+    tsugu_cutoff_cache_size: int = 256
+    tsugu_cutoff_update_interval: float = 1800
+    tsugu_cutoff_update_delay: float = 120
+    tsugu_cutoff_stale: float = 600
+    tsugu_room_cache_ttl: float = 5
+    tsugu_stale_cache_size: int = 0
+    tsugu_stale_max_age: float = 86400
+    tsugu_stale_max_ages: Dict[str, float] = {}
+    tsugu_stale_latency_budget: float = 0
+    tsugu_prerender: bool = False
+    tsugu_prerender_stagger: float = 30
+    tsugu_prerender_idle: float = 3600
+    tsugu_prerender_slow: float = 10
+    tsugu_image_format: str = ""
+    tsugu_image_quality: int = 85
+    tsugu_image_max_size: int = 0
+    tsugu_image_workers: int = 2
+    tsugu_car_forward_window: float = 60
+    tsugu_car_forward_concurrency: int = 4
+    tsugu_master_data_dir: Optional[Path] = None
+    tsugu_master_data_refresh: float = 3600
+    tsugu_master_data_slack: int = 50
     
     tsugu_open_forward_aliases: Set[str] = set()
     tsugu_close_forward_aliases: Set[str] = set()
@@ -0,0 +1,10 @@
+import sys
+from pathlib import Path
+
+import nonebot
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# 插件在导入时读取配置并注册指令，所有测试共用同一次初始化
+nonebot.init(driver="~none+~httpx", command_start={"/", ""}, log_level="WARNING")
+nonebot.load_plugin("nonebot_plugin_tsugu_bangdream_bot")
@@ -0,0 +1,84 @@
+'''相互独立的后端请求应当并发进行'''
+
+import asyncio
+from time import perf_counter
+from typing import Any, Dict, List, Tuple
+
+import pytest
+import tsugu_api_async
+
+from nonebot_plugin_tsugu_bangdream_bot import _commands
+
+DELAY = 0.2
+
+@pytest.fixture
+def backend(monkeypatch: pytest.MonkeyPatch) -> List[Tuple[str, float, float]]:
+    '''替换为延迟 `DELAY` 秒的后端，记录每次调用的 (接口, 开始时间, 结束时间)'''
+    calls: List[Tuple[str, float, float]] = []
+
+    def delayed(name: str, result: Any):
+        async def _call(*args: Any, **kwargs: Any) -> Any:
+            start = perf_counter()
+            await asyncio.sleep(DELAY)
+            calls.append((name, start, perf_counter()))
+            return result
+        return _call
+
+    user: Dict[str, Any] = {
+        "userId": "1",
+        "platform": "test",
+        "mainServer": 3,
+        "displayedServerList": [3],
+        "shareRoomNumber": True,
+        "userPlayerIndex": 0,
+        "userPlayerList": [{"playerId": 10000001, "server": 1}],
+    }
+    monkeypatch.setattr(tsugu_api_async, "get_user_data", delayed("get_user_data", {"status": "success", "data": user}))
+    monkeypatch.setattr(tsugu_api_async, "fuzzy_search", delayed("fuzzy_search", {"status": "success", "data": {"server": [1]}}))
+    monkeypatch.setattr(tsugu_api_async, "search_player", delayed("search_player", [{"type": "string", "string": "player"}]))
+    monkeypatch.setattr(tsugu_api_async, "bind_player_request", delayed("bind_player_request", {"status": "success", "data": {"verifyCode": 12345}}))
+    _commands.user_cache.clear()
+    _commands.fuzzy_search_cache.clear()
+    _commands.stale_cache.clear()
+    return calls
+
+def _overlapped(calls: List[Tuple[str, float, float]], first: str, second: str) -> bool:
+    spans = {name: (start, end) for name, start, end in calls}
+    return spans[first][0] < spans[second][1] and spans[second][0] < spans[first][1]
+
+def test_player_info_overlaps_user_and_server_lookup(backend: List[Tuple[str, float, float]]) -> None:
+    start = perf_counter()
+    result = asyncio.run(_commands.player_info("test", "1", None, "某服务器"))
+    elapsed = perf_counter() - start
+
+    assert "player" in str(result)
+    assert _overlapped(backend, "get_user_data", "fuzzy_search")
+    # 用户数据与服务器名并发解析后再查询玩家，串行时至少需要 3 * DELAY
+    assert elapsed < DELAY * 2.5
+
+def test_player_unbind_overlaps_user_and_server_lookup(backend: List[Tuple[str, float, float]]) -> None:
+    sent: List[str] = []
+
+    class Matcher:
+        path_args: Dict[str, Any] = {}
+
+        @classmethod
+        def set_path_arg(cls, key: str, value: Any) -> None:
+            cls.path_args[key] = value
+
+        @classmethod
+        async def send(cls, message: str) -> None:
+            sent.append(message)
+
+        @classmethod
+        async def finish(cls, message: str) -> None:
+            sent.append(message)
+
+    start = perf_counter()
+    asyncio.run(_commands.player_unbind(Matcher, "test", "1", "某服务器")) # type: ignore
+    elapsed = perf_counter() - start
+
+    assert Matcher.path_args == {"verify_server": 1, "player_id": 10000001}
+    assert "12345" in sent[-1]
+    assert _overlapped(backend, "get_user_data", "fuzzy_search")
+    assert elapsed < DELAY * 2.5
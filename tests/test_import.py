@@ -0,0 +1,49 @@
+'''插件的加载耗时不应超出预算'''
+
+import sys
+import subprocess
+from pathlib import Path
+from typing import Tuple
+
+# 本插件的加载耗时与其依赖插件（alconna 与 userinfo）加载耗时之比的上限，以比值衡量以排除机器性能的影响。
+# 在同一台机器上测得：直接构造 `Alconna` 时约为 0.8，使用 `Command` 构造命令时为 1.3 ~ 1.7
+BUDGET = 1.2
+
+_SCRIPT = '''
+import sys
+from time import perf_counter
+
+import nonebot
+
+sys.path.insert(0, {root!r})
+nonebot.init(driver="~none+~httpx", command_start={{"/", ""}}, log_level="ERROR")
+
+start = perf_counter()
+nonebot.load_plugin("nonebot_plugin_alconna")
+nonebot.load_plugin("nonebot_plugin_userinfo")
+reference = perf_counter() - start
+
+start = perf_counter()
+plugin = nonebot.load_plugin("nonebot_plugin_tsugu_bangdream_bot")
+elapsed = perf_counter() - start
+assert plugin is not None
+assert "ycx <tier:int>" in plugin.metadata.usage
+print(reference, elapsed)
+'''
+
+def _load_time() -> Tuple[float, float]:
+    # 在新的解释器中加载，避免受到测试进程中已导入模块的影响
+    result = subprocess.run(
+        [sys.executable, "-c", _SCRIPT.format(root=str(Path(__file__).resolve().parents[1]))],
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+    reference, elapsed = result.stdout.strip().splitlines()[-1].split()
+    return float(reference), float(elapsed)
+
+def test_cold_import_within_budget() -> None:
+    # 取两次中较小的比值，减少机器负载带来的波动
+    ratio, reference, elapsed = min((elapsed / reference, reference, elapsed) for reference, elapsed in (_load_time(), _load_time()))
+    assert ratio < BUDGET, f"plugin load took {elapsed:.3f}s, {ratio:.2f}x its dependencies ({reference:.3f}s), budget is {BUDGET}x"
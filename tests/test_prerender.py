@@ -0,0 +1,15 @@
+'''档线预测的请求只在预渲染开启时记录常用档位'''
+
+from nonebot_plugin_tsugu_bangdream_bot._commands import CutoffDemand
+
+def test_demand_records_only_known_tiers_when_enabled() -> None:
+    demand = CutoffDemand()
+    # 预渲染默认关闭，不记录任何请求
+    demand.record(3, 1000)
+    assert not demand
+
+    demand.enabled = True
+    demand.record(3, 123457)
+    demand.record(3, 1000)
+    demand.record(3, None)
+    assert set(demand) == {(3, 1000), (3, None)}
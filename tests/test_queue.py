@@ -0,0 +1,31 @@
+'''提交失败的项不应计入去重'''
+
+import asyncio
+from typing import List
+
+from nonebot_plugin_tsugu_bangdream_bot._queue import SubmitQueue
+
+def test_failed_submit_can_be_requeued() -> None:
+    submitted: List[str] = []
+    results = [False, True]
+
+    async def _submit(item: str) -> bool:
+        submitted.append(item)
+        return results.pop(0)
+
+    async def _run() -> None:
+        queue: 'SubmitQueue[str]' = SubmitQueue(_submit, 60)
+        assert queue.put("room", "first")
+        # 等待提交期间相同的键不会重复入队
+        assert not queue.put("room", "duplicate")
+        await queue.stop()
+
+        assert queue.put("room", "retry")
+        await queue.stop()
+        assert not queue.put("room", "after success")
+        await queue.stop()
+        assert queue.stats()["failed"] == 1
+        assert queue.stats()["deduplicated"] == 2
+
+    asyncio.run(_run())
+    assert submitted == ["first", "retry"]
@@ -0,0 +1,32 @@
+'''合并的相同渲染请求只写入一次缓存'''
+
+import asyncio
+from typing import Any, List
+
+import pytest
+
+from nonebot_plugin_tsugu_bangdream_bot import _commands
+
+def test_coalesced_render_is_stored_once(monkeypatch: pytest.MonkeyPatch) -> None:
+    stored: List[Any] = []
+    calls: List[int] = []
+    original_set = _commands.response_cache.set
+
+    async def _set(key: Any, parts: Any) -> None:
+        stored.append(key)
+        await original_set(key, parts)
+
+    async def _call() -> Any:
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return [{"type": "string", "string": "card"}]
+
+    monkeypatch.setattr(_commands.response_cache, "set", _set)
+    _commands.response_cache.clear()
+
+    async def _run() -> None:
+        await asyncio.gather(*(_commands._render_cached(("coalesced", 1), _call) for _ in range(5)))
+
+    asyncio.run(_run())
+    assert len(calls) == 1
+    assert len(stored) == 1
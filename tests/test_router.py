@@ -0,0 +1,161 @@
+'''多个后端地址间的路由与失败分类'''
+
+import json
+import time
+import socket
+import struct
+import asyncio
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterator, Tuple
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import httpx
+import pytest
+from tsugu_api_core.client import Request
+
+from nonebot_plugin_tsugu_bangdream_bot import _client
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: '_StubServer'
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _respond(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.server.hits[self.path] += 1
+        if self.server.reset:
+            # 请求已被接收后重置连接，不发送响应
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            self.close_connection = True
+            return
+        time.sleep(self.server.delay)
+        body = json.dumps({"status": "success", "data": self.server.name}).encode()
+        self.send_response(self.server.status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = _respond
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, name: str, delay: float = 0, status: int = 200, reset: bool = False) -> None:
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.name = name
+        self.delay = delay
+        self.status = status
+        self.reset = reset
+        self.hits: 'Counter[str]' = Counter()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+@pytest.fixture
+def servers() -> Iterator[Tuple[_StubServer, _StubServer]]:
+    # 首选地址缓慢且返回 503，次选地址正常
+    failing, healthy = _StubServer("failing", delay=0.05, status=503), _StubServer("healthy")
+    for server in (failing, healthy):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield failing, healthy
+    for server in (failing, healthy):
+        server.shutdown()
+        server.server_close()
+
+@pytest.fixture
+def router(monkeypatch: pytest.MonkeyPatch) -> _client.BackendRouter:
+    router = _client.BackendRouter()
+    monkeypatch.setattr(_client, "backend_router", router)
+    monkeypatch.setattr(_client.client_settings, "backoff_base", 0.01)
+    monkeypatch.setattr(_client.client_settings, "hedge", False)
+    monkeypatch.setattr(_client.settings, "max_retries", 2)
+    monkeypatch.setattr(_client.retry_budget, "tokens", _client.client_settings.retry_budget_burst)
+    return router
+
+def _request(client: _client.Client, url: str) -> Any:
+    return client.arequest(Request("POST", url, headers=None, params=None, data={"key": "value"}))
+
+def test_requests_move_to_healthy_endpoint(servers: Tuple[_StubServer, _StubServer], router: _client.BackendRouter) -> None:
+    failing, healthy = servers
+    primary = router.add([failing.url, healthy.url], False)
+    client = _client.Client(None, 5, 2)
+
+    async def _run() -> Dict[str, int]:
+        served: 'Counter[str]' = Counter()
+        try:
+            for _ in range(20):
+                response = await _request(client, primary + "/searchCard")
+                assert response.status_code == 200
+                served[response.json()["data"]] += 1
+        finally:
+            await _client._close_pools()
+        return served
+
+    served = asyncio.run(_run())
+    assert served == {"healthy": 20}
+    # 失败的地址错误率上升后不再被优先选择
+    assert failing.hits["/searchCard"] <= 3
+    assert healthy.hits["/searchCard"] == 20
+
+def test_connect_failure_retries_non_idempotent_request(servers: Tuple[_StubServer, _StubServer], router: _client.BackendRouter) -> None:
+    _, healthy = servers
+    # 关闭的端口，连接会被拒绝
+    closed = _StubServer("closed")
+    closed.server_close()
+    primary = router.add([closed.url, healthy.url], False)
+    client = _client.Client(None, 5, 2)
+
+    async def _run() -> Any:
+        try:
+            return await _request(client, primary + "/station/submitRoomNumber")
+        finally:
+            await _client._close_pools()
+
+    response = asyncio.run(_run())
+    assert response.json()["data"] == "healthy"
+    assert healthy.hits["/station/submitRoomNumber"] == 1
+
+def test_reset_after_send_is_not_retried_for_non_idempotent_request(router: _client.BackendRouter) -> None:
+    # 两个地址都在接收请求后重置连接，请求可能已被处理，不应重试
+    servers = [_StubServer(name, reset=True) for name in ("first", "second")]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    primary = router.add([server.url for server in servers], False)
+    client = _client.Client(None, 5, 2)
+
+    async def _run() -> None:
+        try:
+            with pytest.raises(Exception) as exception:
+                await _request(client, primary + "/station/submitRoomNumber")
+            assert _client._classify_exception(exception.value) == "other"
+        finally:
+            await _client._close_pools()
+
+    try:
+        asyncio.run(_run())
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+    assert sum(server.hits["/station/submitRoomNumber"] for server in servers) == 1
+
+def test_route_requires_path_boundary(router: _client.BackendRouter) -> None:
+    primary = router.add(["http://a:3000", "http://b:3000"], False)
+    assert [url for _, url in router.route(primary + "/searchCard")] == ["http://a:3000/searchCard", "http://b:3000/searchCard"]
+    assert router.route("http://a:30001/searchCard") == [(None, "http://a:30001/searchCard")]
+
+def test_only_pre_send_failures_are_connect_failures() -> None:
+    assert _client._classify_exception(httpx.ConnectTimeout("timed out")) == "connect"
+    assert _client._classify_exception(httpx.ReadTimeout("timed out")) == "timeout"
+    assert _client._classify_exception(asyncio.TimeoutError()) == "timeout"
+    assert _client._classify_exception(ConnectionRefusedError()) == "connect"
+    # 请求可能已发出的连接异常
+    assert _client._classify_exception(ConnectionResetError()) == "other"
+    assert _client._classify_exception(BrokenPipeError()) == "other"
+    assert _client._classify_exception(httpx.RemoteProtocolError("Server disconnected")) == "other"
+    assert _client._classify_exception(httpx.ReadError("Connection reset by peer")) == "other"
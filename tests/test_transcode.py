@@ -0,0 +1,41 @@
+'''关闭后的重新编码不应重新创建线程池'''
+
+import asyncio
+from io import BytesIO
+
+import pytest
+
+from nonebot_plugin_tsugu_bangdream_bot._transcode import Image, Transcoder
+
+pytestmark = pytest.mark.skipif(Image is None, reason="Pillow is not installed")
+
+def _png(size: int = 256) -> bytes:
+    assert Image is not None
+    output = BytesIO()
+    Image.effect_noise((size, size), 64).convert("RGB").save(output, format="PNG")
+    return output.getvalue()
+
+def test_transcode_during_and_after_stop() -> None:
+    transcoder = Transcoder()
+    transcoder.format = "jpeg"
+    transcoder.min_bytes = 0
+    data = _png()
+
+    async def _run() -> None:
+        await transcoder.start()
+        parts = await transcoder.transcode((("image", data),))
+        assert len(parts[0][1]) < len(data)
+
+        # 在编码开始前关闭，以及关闭后的请求均返回原图，且不重新创建线程池
+        running = asyncio.ensure_future(transcoder.transcode((("image", data),)))
+        await asyncio.sleep(0)
+        await transcoder.stop()
+        parts = await running
+        assert parts[0][1] == data
+        parts = await transcoder.transcode((("image", data),))
+        assert parts[0][1] == data
+        assert transcoder._executor is None
+
+    asyncio.run(_run())
+    assert transcoder.transcoded == 1
+    assert transcoder.failed == 0
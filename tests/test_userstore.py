@@ -0,0 +1,94 @@
+'''后台刷新与一致性校验不应覆盖插件自身的修改'''
+
+import asyncio
+from pathlib import Path
+from typing import Any, Dict
+
+import pytest
+import tsugu_api_async
+
+from nonebot_plugin_tsugu_bangdream_bot import _commands
+from nonebot_plugin_tsugu_bangdream_bot._userstore import UserStore
+
+DELAY = 0.1
+
+def _user(main_server: int) -> Dict[str, Any]:
+    return {
+        "userId": "1",
+        "platform": "test",
+        "mainServer": main_server,
+        "displayedServerList": [3],
+        "shareRoomNumber": True,
+        "userPlayerIndex": 0,
+        "userPlayerList": [],
+    }
+
+def test_refresh_does_not_overwrite_patch(monkeypatch: pytest.MonkeyPatch) -> None:
+    async def _get_user_data(platform: str, user_id: str) -> Dict[str, Any]:
+        # 请求在修改之前发出，返回修改前的数据
+        await asyncio.sleep(DELAY)
+        return {"status": "success", "data": _user(3)}
+
+    monkeypatch.setattr(tsugu_api_async, "get_user_data", _get_user_data)
+    _commands.user_cache.clear()
+    _commands.user_cache.set(("test", "1"), _user(3)) # type: ignore
+
+    async def _run() -> None:
+        _commands._refresh_tsugu_user("test", "1")
+        await asyncio.sleep(DELAY / 2)
+        await _commands._patch_tsugu_user("test", "1", {"mainServer": 0})
+        await asyncio.gather(*_commands._refreshing)
+
+    asyncio.run(_run())
+    cached = _commands.user_cache.peek(("test", "1"))
+    assert cached is not None and cached["mainServer"] == 0
+
+def test_check_keeps_patch_and_invalidates_cache(tmp_path: Path) -> None:
+    store = UserStore()
+    store.path = tmp_path / "users.db"
+    invalidated = []
+    store.invalidate = lambda platform, user_id: invalidated.append((platform, user_id))
+
+    async def _fetch(platform: str, user_id: str) -> Any:
+        await asyncio.sleep(DELAY)
+        return _user(1)
+
+    async def _run() -> None:
+        await store.put("test", "1", _user(3)) # type: ignore
+        await store.put("test", "2", _user(3)) # type: ignore
+        store.fetch = _fetch
+
+        # 校验 1 号用户期间修改该用户，校验结果不应覆盖修改
+        check = asyncio.ensure_future(store.check())
+        await asyncio.sleep(DELAY / 2)
+        await store.patch("test", "1", {"mainServer": 0})
+        assert await check == 2
+
+        record = await store.get("test", "1")
+        assert record is not None and record[0]["mainServer"] == 0
+        record = await store.get("test", "2")
+        assert record is not None and record[0]["mainServer"] == 1
+        await store.stop()
+
+    asyncio.run(_run())
+    assert invalidated == [("test", "2")]
+
+def test_check_skips_unchanged_records(tmp_path: Path) -> None:
+    store = UserStore()
+    store.path = tmp_path / "users.db"
+    invalidated = []
+    store.invalidate = lambda platform, user_id: invalidated.append((platform, user_id))
+
+    async def _fetch(platform: str, user_id: str) -> Any:
+        return _user(3)
+
+    async def _run() -> None:
+        await store.put("test", "1", _user(3)) # type: ignore
+        store.fetch = _fetch
+        writes = store.writes
+        assert await store.check() == 0
+        assert store.writes == writes
+        await store.stop()
+
+    asyncio.run(_run())
+    assert invalidated == []